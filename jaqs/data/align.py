@@ -1,4 +1,7 @@
 # encoding: utf-8
+import hashlib
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 
@@ -22,24 +25,95 @@ def get_neareast(df_ann, df_value, date):
         The value whose ann_date is earlier and nearest to date. shape (n_securities)
 
     """
+    pos = get_position(df_ann, date)
+    res = take_position(df_value, pos)
+    return res[0]
+
+
+def get_position(ann_arr, date_arr):
     """
-    df_ann.fillna(99999999, inplace=True)  # IMPORTANT: At cells where no quarterly data is available,
-                                           # we know nothing, thus it will be filled nan in the next step
+    For every date and security, get the row index of the last quarter whose ann_date is no later than date.
+    
+    Parameters
+    ----------
+    ann_arr : np.ndarray
+        announcement dates. shape = (n_quarters, n_securities), dtype = int.
+        Missing announcement dates must have been filled with a value larger than any date (e.g. 99999999).
+    date_arr : np.ndarray
+        Target dates. shape = (n_days,), dtype = int
+
+    Returns
+    -------
+    pos : np.ndarray
+        shape = (n_days, n_securities), dtype = int.
+        -1 means no quarterly data has been announced yet.
+    
+    Notes
+    -----
+    "Last" means last in row order of ann_arr, which is the same rule used by the original loop version.
+    The suffix minimum of each column is non-decreasing, and the last row whose ann_date <= date
+    is exactly the last row whose suffix minimum <= date, so one searchsorted on each column is enough.
+    All columns are searched at once by adding a distinct offset to each column.
+
     """
-    mask = date[0] >= df_ann
-    # res = np.where(mask, df_value, np.nan)
-    n = df_value.shape[1]
-    res = np.empty(n, dtype=df_value.dtype)
-    
-    # for each column, get the last True value
-    for i in xrange(n):
-        v = df_value[:, i]
-        m = mask[:, i]
-        r = v[m]
-        res[i] = r[-1] if len(r) else np.nan
+    ann_arr = np.asarray(ann_arr, dtype=np.int64)
+    date_arr = np.asarray(date_arr, dtype=np.int64).ravel()
+    n_quarters, n_securities = ann_arr.shape
+    n_days = len(date_arr)
     
-    return res
+    if n_quarters == 0 or n_securities == 0:
+        return np.full((n_days, n_securities), -1, dtype=np.int64)
+    
+    suffix_min = np.minimum.accumulate(ann_arr[::-1, :], axis=0)[::-1, :]
+    
+    lo = min(suffix_min.min(), date_arr.min()) if n_days else suffix_min.min()
+    hi = max(suffix_min.max(), date_arr.max()) if n_days else suffix_min.max()
+    span = hi - lo + 1
+    offset = np.arange(n_securities, dtype=np.int64) * span
     
+    keys = (suffix_min - lo + offset).ravel(order='F')  # column by column, globally sorted
+    queries = (date_arr.reshape(-1, 1) - lo) + offset
+    
+    pos_flat = np.searchsorted(keys, queries, side='right') - 1
+    pos = pos_flat - offset // span * n_quarters
+    pos[pos < 0] = -1
+    return pos
+
+
+def take_position(value_arr, pos):
+    """
+    Take values of each security at given row positions. Position -1 results in NaN.
+    
+    Parameters
+    ----------
+    value_arr : np.ndarray
+        shape = (n_quarters, n_securities)
+    pos : np.ndarray
+        shape = (n_days, n_securities), returned by get_position.
+
+    Returns
+    -------
+    res : np.ndarray
+        shape = (n_days, n_securities)
+
+    """
+    value_arr = np.asarray(value_arr)
+    n_securities = pos.shape[1]
+    mask = pos < 0
+    
+    if value_arr.shape[0] == 0:
+        res = np.empty(pos.shape, dtype=float)
+        res.fill(np.nan)
+        return res
+    
+    cols = np.arange(n_securities)
+    res = value_arr[np.where(mask, 0, pos), cols]
+    if mask.any():
+        if not issubclass(res.dtype.type, (np.floating, np.object_)):
+            res = res.astype(float)
+        res[mask] = np.nan
+    return res
+
 
 def align(df_value, df_ann, date_arr):
     """
@@ -49,14 +123,15 @@ def align(df_value, df_ann, date_arr):
     ----------
     df_ann : pd.DataFrame
         DataFrame of announcement dates. shape = (n_quarters, n_securities)
-    df_value : pd.DataFrame
+    df_value : pd.DataFrame or dict of pd.DataFrame
         DataFrame of announcement values. shape = (n_quarters, n_securities)
+        If a dict is provided, all DataFrames in it will be expanded using the same df_ann.
     date_arr : list or np.array
         Target date array. dtype = int
 
     Returns
     -------
-    df_res : pd.DataFrame
+    df_res : pd.DataFrame or dict of pd.DataFrame
         Expanded DataFrame. shape = (n_days, n_securities)
 
     """
@@ -64,12 +139,194 @@ def align(df_value, df_ann, date_arr):
     
     date_arr = np.asarray(date_arr, dtype=int)
     
-    res = np.apply_along_axis(lambda date: get_neareast(df_ann.values, df_value.values, date), 1, date_arr.reshape(-1, 1))
+    pos = get_position(df_ann.values, date_arr)
+    
+    if isinstance(df_value, dict):
+        return {key: _expand(df, pos, date_arr) for key, df in df_value.items()}
+    return _expand(df_value, pos, date_arr)
 
+
+def _expand(df_value, pos, date_arr):
+    res = take_position(df_value.values, pos)
     df_res = pd.DataFrame(index=date_arr, columns=df_value.columns, data=res)
     return df_res
 
 
+def get_version(obj):
+    """
+    Digest of content of a DataFrame or an array, used as version of cached alignment.
+    Equal content (values, index and columns) gives the same version, even for different objects.
+    
+    Returns
+    -------
+    str or None
+        None if values are not numeric (no reliable digest).
+    
+    """
+    md5 = hashlib.md5()
+    if isinstance(obj, pd.DataFrame):
+        md5.update(str(list(obj.index)).encode('utf-8'))
+        md5.update(str(list(obj.columns)).encode('utf-8'))
+        obj = obj.values
+    arr = np.ascontiguousarray(obj)
+    if arr.dtype.kind not in 'biuf':
+        return None
+    md5.update(str(arr.dtype).encode('utf-8'))
+    md5.update(str(arr.shape).encode('utf-8'))
+    md5.update(arr.view(np.uint8).ravel())
+    return md5.hexdigest()
+
+
+class AlignCache(object):
+    """
+    LRU cache of expanded low frequency data.
+    
+    An entry is keyed by (field, version of values, version of ann_date, version of target dates),
+    so it is invalid as soon as any of them changes.
+    Positions (get_position) are shared by all fields with the same announcement dates.
+    
+    Attributes
+    ----------
+    max_size : int
+        Max number of expanded DataFrames kept.
+    hits : int
+    misses : int
+
+    """
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._pos = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def clear(self):
+        self._data.clear()
+        self._pos.clear()
+    
+    @staticmethod
+    def _put(od, key, value, max_size):
+        od[key] = value
+        while len(od) > max_size:
+            od.popitem(last=False)
+    
+    def get_position(self, df_ann, date_arr, ann_version=None, dates_version=None):
+        ann_version = ann_version or get_version(df_ann)
+        dates_version = dates_version or get_version(np.asarray(date_arr, dtype=int))
+        key = (ann_version, dates_version)
+        if key in self._pos:
+            pos = self._pos.pop(key)
+        else:
+            ann_arr = df_ann.fillna(99999999).astype(int).values
+            pos = get_position(ann_arr, np.asarray(date_arr, dtype=int))
+        self._put(self._pos, key, pos, self.max_size)
+        return pos
+    
+    def align(self, field, df_value, df_ann, date_arr):
+        """
+        The same as align(df_value, df_ann, date_arr), result of the same inputs is computed only once.
+        Returned DataFrame is shared by all callers, it must not be modified in place.
+        
+        Parameters
+        ----------
+        field : str
+            Name of df_value.
+        df_value : pd.DataFrame
+        df_ann : pd.DataFrame
+        date_arr : np.ndarray
+
+        Returns
+        -------
+        pd.DataFrame
+
+        """
+        date_arr = np.asarray(date_arr, dtype=int)
+        value_version = get_version(df_value)
+        ann_version = get_version(df_ann)
+        dates_version = get_version(date_arr)
+        if value_version is None or ann_version is None:
+            self.misses += 1
+            return align(df_value, df_ann, date_arr)
+        
+        key = (field, value_version, ann_version, dates_version)
+        if key in self._data:
+            self.hits += 1
+            df_res = self._data.pop(key)
+        else:
+            self.misses += 1
+            pos = self.get_position(df_ann, date_arr, ann_version=ann_version, dates_version=dates_version)
+            df_res = _expand(df_value, pos, date_arr)
+        self._put(self._data, key, df_res, self.max_size)
+        return df_res
+
+
+class ExpandedCache(object):
+    """
+    LRU cache of arrays with a memory budget, e.g. quarterly fields expanded to daily frequency.
+    Unlike AlignCache, entries are keyed by name only, so they must be invalidated by the owner
+    when the source data changes.
+    
+    Attributes
+    ----------
+    max_bytes : int
+        Memory budget. Least recently used entries are evicted when it is exceeded.
+        An array larger than the budget is never kept.
+    nbytes : int
+        Memory used by kept arrays.
+    hits : int
+    misses : int
+
+    """
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __contains__(self, key):
+        return key in self._data
+    
+    def get(self, key):
+        """Kept array of key, or None."""
+        if key not in self._data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        arr = self._data.pop(key)
+        self._data[key] = arr
+        return arr
+    
+    def put(self, key, arr):
+        self.invalidate(key)
+        if arr.nbytes <= self.max_bytes:
+            self._data[key] = arr
+            self.nbytes += arr.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self._data.popitem(last=False)
+            self.nbytes -= old.nbytes
+    
+    def invalidate(self, key):
+        arr = self._data.pop(key, None)
+        if arr is not None:
+            self.nbytes -= arr.nbytes
+    
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+    
+    def info(self):
+        """dict of hits, misses, size (number of arrays), nbytes and max_bytes."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
 def demo_usage():
     # -------------------------------------------------------------------------------------
     # input and pre-process demo data
@@ -0,0 +1,393 @@
+# encoding: utf-8
+"""
+NumPy-array evaluation backend of compiled expression plans (see py_expression_eval.Plan).
+
+All DataFrame inputs are aligned once to a common (dates, symbols) grid, then every node is computed
+on raw ndarrays, and labels are attached to the outputs only.
+Element-wise arithmetic writes into buffers taken from a BufferPool, and a buffer goes back to the pool
+as soon as the last consumer of its node is evaluated, so a long formula reuses a few buffers.
+
+Only plans whose inputs share the same date index (one frequency) and whose functions all have an array
+implementation are supported, see supports(). Others are evaluated by the pandas backend.
+
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data import rolling
+from jaqs.data import group_ops
+
+
+class BufferPool(object):
+    """Free float arrays of the grid shape, which can be used as out= of ufuncs."""
+    def __init__(self, shape, dtype=np.float64):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self._free = []
+        self.n_allocated = 0
+
+    def acquire(self):
+        if self._free:
+            return self._free.pop()
+        self.n_allocated += 1
+        return np.empty(self.shape, dtype=self.dtype)
+
+    def release(self, arr):
+        if isinstance(arr, np.ndarray) and arr.shape == self.shape and arr.dtype == self.dtype:
+            self._free.append(arr)
+
+
+# -----------------------------------------------------
+# element-wise
+def _compare(ufunc):
+    def f(a, b):
+        with np.errstate(invalid='ignore'):
+            res = ufunc(a, b).astype(float)
+        res[np.isnan(a) | np.isnan(b)] = np.nan
+        return res
+    return f
+
+
+def _if(cond, b, c):
+    res = np.where(cond, b, c).astype(float)
+    res[np.isnan(cond)] = np.nan
+    return res
+
+
+def _tail(x, lower, upper, neweval):
+    with np.errstate(invalid='ignore'):
+        return np.where((x >= lower) & (x <= upper), neweval, x)
+
+
+def _signed_power(x, e):
+    return np.sign(x) * np.power(np.abs(x), e)
+
+
+# -----------------------------------------------------
+# time series
+def _shift(x, n):
+    n = int(n)
+    res = np.empty(x.shape, dtype=np.float64)
+    res.fill(np.nan)
+    if n >= 0:
+        if n < x.shape[0]:
+            res[n:] = x[:x.shape[0] - n]
+    elif -n < x.shape[0]:
+        res[:n] = x[-n:]
+    return res
+
+
+def _delta(x, n):
+    return x - _shift(x, n)
+
+
+def _calc_return(x, forward=1, log=False):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if log:
+            return _delta(np.log(x), forward)
+        shift = _shift(x, forward)
+        return (x - shift) / shift
+
+
+def _ewma(x, halflife):
+    return pd.DataFrame(x).ewm(halflife=halflife, axis=0).mean().values
+
+
+def _sma(x, n, m):
+    return pd.DataFrame(x).ewm(com=n * 1.0 / m - 1, axis=0).mean().values
+
+
+def _step(x, n):
+    n = n + 1
+    col = np.arange(n - x.shape[0], n, dtype=np.float64).reshape(-1, 1)
+    return np.repeat(col, x.shape[1], axis=1)
+
+
+# -----------------------------------------------------
+# cross section, the whole cross section is one group
+def _whole(x):
+    return group_ops.GroupIndex(np.zeros(x.shape, dtype=np.int64), 1)
+
+
+def _rank(x):
+    # the Cython rank of pandas is faster than group_rank for a single group
+    return pd.DataFrame(x).rank(axis=1).values
+
+
+def _standardize(x):
+    return group_ops.group_standardize(x, _whole(x))
+
+
+def _cutoff(x, z_score=3.0):
+    return group_ops.group_cutoff(x, _whole(x), z_score)
+
+
+# functions of Parser, keyed by __name__ of the Parser method (or NumPy ufunc).
+ARRAY_FUNCS = {
+    'add': np.add,
+    'sub': np.subtract,
+    'mul': np.multiply,
+    'div': np.divide,
+    'mod': np.mod,
+    'power': np.power,
+    'neg': np.negative,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'sqrt': np.sqrt,
+    'log': np.log,
+    'exp': np.exp,
+    'absolute': np.absolute,
+    'ceil': np.ceil,
+    'floor': np.floor,
+    'sign': np.sign,
+    'round_': np.round,
+    'equal': _compare(np.equal),
+    'notEqual': _compare(np.not_equal),
+    'greaterThan': _compare(np.greater),
+    'lessThan': _compare(np.less),
+    'greaterThanEqual': _compare(np.greater_equal),
+    'lessThanEqual': _compare(np.less_equal),
+    'andOperator': _compare(np.logical_and),
+    'orOperator': _compare(np.logical_or),
+    'ifFunction': _if,
+    'tail': _tail,
+    'signed_power': _signed_power,
+    'minimum': np.minimum,
+    'maximum': np.maximum,
+
+    'delay': _shift,
+    'delta': _delta,
+    'calc_return': _calc_return,
+    'ewma': _ewma,
+    'sma': _sma,
+    'step': _step,
+    'sum': rolling.rolling_sum,
+    'product': rolling.rolling_product,
+    'count_nans': rolling.count_nans,
+    'std_dev': rolling.rolling_std,
+    'ts_mean': rolling.rolling_mean,
+    'ts_min': rolling.rolling_min,
+    'ts_max': rolling.rolling_max,
+    'ts_skew': rolling.rolling_skew,
+    'ts_kurt': rolling.rolling_kurt,
+    'ts_rank': rolling.rolling_rank,
+    'ts_argmax': rolling.rolling_argmax,
+    'ts_argmin': rolling.rolling_argmin,
+    'ts_median': rolling.rolling_median,
+    'ts_quantile': rolling.rolling_quantile,
+    'decay_linear': rolling.decay_linear,
+    'decay_exp': rolling.decay_exp,
+    'corr': rolling.rolling_corr,
+    'cov': rolling.rolling_cov,
+
+    'rank': _rank,
+    'standardize': _standardize,
+    'cutoff': _cutoff,
+}
+
+# functions which need group codes
+GROUP_FUNCS = {'group_apply', 'group_rank', 'industry_neutral', 'industry_mkt_cap_neutral'}
+
+# ufuncs whose result can be written into a buffer of the pool
+_BUFFERED = {np.add, np.subtract, np.multiply, np.divide, np.mod, np.power, np.negative,
+             np.sin, np.cos, np.tan, np.sqrt, np.log, np.exp, np.absolute, np.ceil, np.floor, np.sign}
+
+_GROUP_APPLY_FUNCS = {
+    'rank': group_ops.group_rank,
+    'standardize': group_ops.group_standardize,
+    'cutoff': group_ops.group_cutoff,
+}
+
+
+def _func_name(f):
+    return getattr(f, '__name__', None)
+
+
+def _shares(a, b):
+    return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and np.may_share_memory(a, b)
+
+
+def _resolve(parser, node, values):
+    """Function called by a node, the same lookup as Parser.evaluate_plan."""
+    if node.name in values:
+        return values[node.name]
+    return parser.functions.get(node.name, None)
+
+
+def _node_func_name(parser, node, values):
+    if node.kind == 'op1':
+        return _func_name(parser.ops1.get(node.name, None))
+    elif node.kind == 'op2':
+        return _func_name(parser.ops2.get(node.name, None))
+    return _func_name(_resolve(parser, node, values))
+
+
+def supports(parser, plan, values, trade_dts=None):
+    """
+    Whether plan can be evaluated by this backend.
+    
+    Parameters
+    ----------
+    parser : Parser
+    plan : Plan
+    values : dict
+    trade_dts : np.ndarray or None
+        Date index of result, inputs of other length need to be expanded.
+
+    Returns
+    -------
+    bool
+
+    """
+    dfs = [v for v in values.values() if isinstance(v, pd.DataFrame)]
+    if not dfs:
+        return False
+    for df in dfs[1:]:
+        if not df.index.equals(dfs[0].index):
+            return False  # different frequencies, quarterly data must be expanded by the pandas backend
+    if trade_dts is not None and len(trade_dts) != len(dfs[0].index):
+        return False
+
+    for i, node in enumerate(plan.nodes):
+        if node.kind in ('const', 'var'):
+            continue
+        name = _node_func_name(parser, node, values)
+        if name == 'group_apply':
+            func_node = node.children[0]
+            if func_node.kind != 'var' or _node_func_name(parser, func_node, values) not in _GROUP_APPLY_FUNCS:
+                return False
+        elif name not in ARRAY_FUNCS and name not in GROUP_FUNCS:
+            return False
+    return True
+
+
+def evaluate_plan(parser, plan, values, df_group=None, on_node=None):
+    """
+    Evaluate plan on ndarrays. Only call it if supports(parser, plan, values).
+
+    Parameters
+    ----------
+    parser : Parser
+    plan : Plan
+    values : dict
+        {var: pd.DataFrame}, all with the same date index.
+    df_group : pd.DataFrame or pd.Series or None
+        Group codes of group functions.
+    on_node : callable or None
+        If not None, on_node(position, args, result, seconds) is called after each node is evaluated.
+
+    Returns
+    -------
+    list
+        Values of plan.outputs, DataFrame labeled with the common grid.
+
+    """
+    dfs = [v for v in values.values() if isinstance(v, pd.DataFrame)]
+    index = dfs[0].index
+    columns = dfs[0].columns
+    for df in dfs[1:]:
+        if not df.columns.equals(columns):
+            columns = columns.union(df.columns)
+    shape = (len(index), len(columns))
+
+    arrays = dict()
+    for k, v in values.items():
+        if isinstance(v, pd.DataFrame):
+            if not v.columns.equals(columns):
+                v = v.reindex(columns=columns)
+            v = v.values
+            if v.dtype.kind in 'biu':
+                v = v.astype(np.float64)
+        arrays[k] = v
+
+    group_cache = dict()
+
+    def get_group_index(group):
+        key = id(group)
+        if key not in group_cache:
+            if isinstance(group, np.ndarray):
+                group = pd.DataFrame(group, index=index, columns=columns)
+            group_cache[key] = (group, group_ops.GroupIndex.from_group(group, index, columns))
+        return group_cache[key][1]
+
+    dtype = np.dtype(parser.dtype or np.float64)
+    pool = BufferPool(shape, dtype)
+    results = [None] * len(plan.nodes)
+    owned = [False] * len(plan.nodes)  # whether the result is a new array of this evaluation
+    n_consumers = [0] * len(plan.nodes)
+    for children in plan.children:
+        for j in children:
+            n_consumers[j] += 1
+    for j in plan.output_pos:
+        n_consumers[j] += 1
+
+    for i, node in enumerate(plan.nodes):
+        if node.kind in ('const', 'var'):
+            if node.kind == 'const':
+                results[i] = node.value
+            elif node.name in arrays:
+                results[i] = arrays[node.name]
+            elif node.name in parser.functions:
+                results[i] = parser.functions[node.name]
+            else:
+                raise Exception('undefined variable: ' + node.name)
+            if on_node is not None:
+                on_node(i, [], results[i], 0.0)
+            continue
+
+        args = [results[j] for j in plan.children[i]]
+        if on_node is not None:
+            start = time.time()
+        name = _node_func_name(parser, node, values)
+        if name == 'group_apply':
+            func = _GROUP_APPLY_FUNCS[_func_name(args[0])]
+            res = func(args[1], get_group_index(df_group), *args[2:])
+        elif name == 'group_rank':
+            res = group_ops.group_rank(args[0], get_group_index(args[1]))
+        elif name in ('industry_neutral', 'industry_mkt_cap_neutral'):
+            x = args[0]
+            if name == 'industry_neutral':
+                group = args[1] if len(args) > 1 else df_group
+                mkt_cap = args[2] if len(args) > 2 else None
+            else:
+                group, mkt_cap = df_group, args[1]
+            exog = None
+            if mkt_cap is not None:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    exog = np.log(mkt_cap)
+                exog[~np.isfinite(exog)] = np.nan
+            res = group_ops.group_neutralize(x, get_group_index(group), exog)
+        else:
+            func = ARRAY_FUNCS[name]
+            if func in _BUFFERED and any(isinstance(arg, np.ndarray) and arg.shape == shape for arg in args):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    res = func(*args, out=pool.acquire())
+            else:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    res = func(*args)
+        if isinstance(res, np.ndarray) and res.dtype.kind == 'f' and res.dtype != dtype:
+            res = res.astype(dtype)
+        results[i] = res
+        if on_node is not None:
+            on_node(i, args, res, time.time() - start)
+        owned[i] = isinstance(res, np.ndarray) and not any(_shares(res, arg) for arg in args)
+        del args
+
+        for j in plan.children[i]:
+            n_consumers[j] -= 1
+            if n_consumers[j] == 0:
+                arr, results[j] = results[j], None
+                # a result may be a view of its argument, which must not be overwritten
+                if owned[j] and not any(_shares(arr, other) for other in results[:i + 1]):
+                    pool.release(arr)
+
+    res_list = []
+    for pos in plan.output_pos:
+        res = results[pos]
+        if isinstance(res, np.ndarray) and res.shape == shape:
+            res = pd.DataFrame(res, index=index, columns=columns)
+        res_list.append(res)
+    return res_list
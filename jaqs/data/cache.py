@@ -0,0 +1,236 @@
+# encoding: utf-8
+"""
+Persistent local cache of query results of the remote data server.
+
+A result (DataFrame) is stored as one .npz file, one array per column, keyed by digest of
+the normalized (method, params) of the query. Entries are evicted in least recently used order
+when the cache exceeds its size limit. Results of recent dates may still change on the server,
+so they expire after ttl seconds, while results of older dates never expire.
+
+"""
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import jaqs.util.fileio
+
+_END_DATE_PATTERN = re.compile(r'(?:^|&)end_date=(\d{8})(?:&|$)')
+
+
+class ResponseCache(object):
+    """
+    LRU cache of query results on local disk, shared by processes using the same folder.
+    
+    There is no index: each entry is one file, which holds the time it was created and end_date of its query.
+    Modification time of the file is the time of last access, and the size limit is checked
+    by scanning the folder, so entries written by any process are counted and evicted.
+
+    Attributes
+    ----------
+    folder : str
+    max_bytes : int
+        Size limit of files. Least recently used entries are evicted when it is exceeded.
+    ttl : float or None
+        Seconds after which a result of recent dates expires. None for never.
+    recent_days : int
+        A result is of recent dates if its end_date is at most recent_days days before today,
+        or it has no end_date.
+    enabled : bool
+        If False, the cache is bypassed: every query goes to the server and results are not stored.
+    hits : int
+    misses : int
+
+    """
+    FILE_SUFFIX = '.npz'
+
+    def __init__(self, folder, max_bytes=1024 * 1024 * 1024, ttl=24 * 3600, recent_days=7):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.recent_days = recent_days
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scan())
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size, _ in self._scan())
+
+    @staticmethod
+    def _normalize(name, value):
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        if isinstance(value, basestring):
+            value = value.strip()
+            if name == 'filter':
+                # order of conditions does not matter
+                value = '&'.join(sorted(s.strip() for s in value.split('&') if s.strip()))
+        return value
+
+    @classmethod
+    def make_key(cls, method, params):
+        """Digest of method and normalized params, order of params and of filter conditions does not matter."""
+        normalized = {str(k): cls._normalize(k, v) for k, v in params.items()}
+        s = json.dumps([method, normalized], sort_keys=True)
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _get_end_date(params):
+        """end_date (or trade_date) of the query as int, None if there is no end_date."""
+        for k, v in params.items():
+            if k in ('end_date', 'trade_date') and isinstance(v, (int, np.integer)):
+                return int(v)
+            if k in ('end_date', 'trade_date') and isinstance(v, basestring) and v.strip().isdigit():
+                return int(v)
+            if k == 'filter' and isinstance(v, basestring):
+                match = _END_DATE_PATTERN.search(v.replace(' ', ''))
+                if match:
+                    return int(match.group(1))
+        return None
+
+    def _is_expired(self, created, end_date):
+        if self.ttl is None or time.time() - created <= self.ttl:
+            return False
+        recent = datetime.date.today() - datetime.timedelta(days=self.recent_days)
+        return end_date is None or end_date >= int(recent.strftime('%Y%m%d'))
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + self.FILE_SUFFIX)
+
+    def _scan(self):
+        """list of (last access time, size, path) of all entries in the folder, written by any process."""
+        if not os.path.isdir(self.folder):
+            return []
+        res = []
+        for fn in os.listdir(self.folder):
+            if not fn.endswith(self.FILE_SUFFIX):
+                continue
+            path = os.path.join(self.folder, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed by another process
+            res.append((st.st_mtime, st.st_size, path))
+        return res
+
+    def get(self, method, params):
+        """
+        Cached result of a query.
+
+        Returns
+        -------
+        tuple or None
+            (df, msg), None if the query is not cached, expired or the cache is disabled.
+
+        """
+        if not self.enabled:
+            return None
+        path = self._path(self.make_key(method, params))
+        df = None
+        try:
+            created, end_date, df = _load_entry(path, self._is_expired)
+            if df is None:
+                _remove(path)
+            else:
+                os.utime(path, None)  # time of last access
+        except (IOError, OSError, ValueError, KeyError):
+            # not cached or removed by another process
+            df = None
+
+        with self._lock:
+            if df is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return df, '0,'
+
+    def put(self, method, params, df, msg):
+        """Store result of a query. Only successful DataFrame results are stored."""
+        if not self.enabled or msg != '0,' or not isinstance(df, pd.DataFrame):
+            return
+        _save_frame(self._path(self.make_key(method, params)), df, self._get_end_date(params))
+        self._evict()
+
+    def _evict(self):
+        entries = sorted(self._scan())
+        nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if nbytes <= self.max_bytes:
+                break
+            nbytes -= size
+            _remove(path)
+
+    def clear(self):
+        """Remove all entries."""
+        for _, _, path in self._scan():
+            _remove(path)
+
+    def info(self):
+        """dict of hits, misses, size (number of results), nbytes and max_bytes."""
+        entries = self._scan()
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(entries),
+                'nbytes': sum(size for _, size, _ in entries), 'max_bytes': self.max_bytes}
+
+
+def _save_frame(path, df, end_date=None):
+    """Save DataFrame to .npz file, one array per column, with time of creation and end_date (-1 for None)."""
+    arrays = {'columns': np.array(list(df.columns), dtype=object),
+              'index': np.asarray(df.index.values),
+              'index_name': np.array([df.index.name], dtype=object),
+              'meta': np.array([time.time(), -1 if end_date is None else end_date], dtype=np.float64)}
+    for i, col in enumerate(df.columns):
+        arrays['c{:d}'.format(i)] = np.asarray(df[col].values)
+
+    jaqs.util.fileio.create_dir(path)
+    # unique name, several processes may write the same entry
+    tmp_path = '{:s}.{:d}.{:d}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    _replace(tmp_path, path)
+
+
+def _load_entry(path, is_expired):
+    """
+    Returns
+    -------
+    created : float
+    end_date : int or None
+    df : pd.DataFrame or None
+        None if is_expired(created, end_date).
+
+    """
+    with np.load(path, allow_pickle=True) as npz:
+        created, end_date = npz['meta']
+        end_date = None if end_date < 0 else int(end_date)
+        if is_expired(created, end_date):
+            return created, end_date, None
+        columns = list(npz['columns'])
+        data = OrderedDict((col, npz['c{:d}'.format(i)]) for i, col in enumerate(columns))
+        index = pd.Index(npz['index'], name=npz['index_name'][0])
+    return created, end_date, pd.DataFrame(data, index=index, columns=columns)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _replace(src, dst):
+    if os.name == 'nt' and os.path.exists(dst):
+        _remove(dst)
+    os.rename(src, dst)
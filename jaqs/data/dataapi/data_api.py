@@ -75,6 +75,7 @@ class DataApi:
         self._sub_hash = ""
         self._subscribed_set = set()
         self._timeout = 20
+        self._cache = None
 
     def login(self, username, password):
         """
@@ -136,6 +137,19 @@ class DataApi:
         """
         self._timeout = timeout
 
+    def set_cache(self, cache):
+        """
+        Set cache of query results, which are served without network when cached.
+        
+        Parameters
+        ----------
+        cache : jaqs.data.cache.ResponseCache or None
+            Any object with get(method, params) and put(method, params, result, msg).
+            None for no cache.
+        
+        """
+        self._cache = cache
+
     
     # def quote(self, symbol, fields="", data_format="", **kwargs):        
         
@@ -468,6 +482,20 @@ class DataApi:
     
     def _call_rpc(self, method, data_format, data_class, **kwargs):
 
+        # only DataFrame results are cached
+        cache = self._cache if data_format == "pandas" else None
+        if cache is not None:
+            cached = cache.get(method, kwargs)
+            if cached is not None:
+                return cached
+            result, msg = self._call_rpc_remote(method, data_format, data_class, **kwargs)
+            cache.put(method, kwargs, result, msg)
+            return (result, msg)
+
+        return self._call_rpc_remote(method, data_format, data_class, **kwargs)
+
+    def _call_rpc_remote(self, method, data_format, data_class, **kwargs):
+
         r, msg = self._check_session()
         if not r:
             return (r, msg)
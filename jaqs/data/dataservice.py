@@ -1,6 +1,9 @@
 # encoding: UTF-8
 
+import os
+import time
 from abc import abstractmethod
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import pandas as pd
@@ -9,6 +12,7 @@ from jaqs.util import fileio
 from jaqs.trade.pubsub import Publisher
 from jaqs.data.dataapi import DataApi
 from jaqs.data import align
+from jaqs.data.cache import ResponseCache
 from jaqs.util import dtutil
 
 
@@ -236,6 +240,15 @@ class Singleton(type):
 class RemoteDataService(DataService):
     """
     RemoteDataService is a concrete class using data from remote server's database.
+    
+    Queries of daily, daily indicator, financial statements and adjust factors are split into batches
+    of at most symbol_batch_size symbols and date_batch_days calendar days (0 means no split).
+    Adjusted daily queries (adjust_mode is not None) and adjust factors are not split by dates.
+    At most n_workers batches are queried concurrently, a failed batch is retried n_retries times.
+    
+    Results can be cached on local disk, see set_cache. The cache is enabled when "cache.folder" is given
+    in etc/data_config.json, with optional "cache.max_bytes", "cache.ttl" and "cache.recent_days".
+    Set cache.enabled to False to bypass it.
 
     """
     __metaclass__ = Singleton
@@ -260,15 +273,135 @@ class RemoteDataService(DataService):
             print "DataAPI login success.".format(address)
         
         self.REPORT_DATE_FIELD_NAME = 'report_date'
+        
+        self.symbol_batch_size = 100
+        self.date_batch_days = 0
+        self.n_workers = 4
+        self.n_retries = 2
+        self.retry_wait = 1.0
+        
+        self.cache = None
+        if dic.get("cache.folder", None):
+            self.set_cache(dic["cache.folder"],
+                           **{k: dic["cache." + k] for k in ['max_bytes', 'ttl', 'recent_days'] if "cache." + k in dic})
+    
+    def set_cache(self, folder, max_bytes=1024 * 1024 * 1024, ttl=24 * 3600, recent_days=7):
+        """
+        Cache results of queries in folder. Cached results are served without network.
+        
+        Parameters
+        ----------
+        folder : str or None
+            None for no cache.
+        max_bytes : int, optional
+            Size limit of cache files, least recently used results are removed when it is exceeded.
+        ttl : float or None, optional
+            Seconds after which results of recent dates expire. None for never.
+        recent_days : int, optional
+            Results whose end_date is within recent_days before today (or that have no end_date) are recent.
+
+        """
+        if folder is None:
+            self.cache = None
+        else:
+            self.cache = ResponseCache(os.path.expanduser(folder), max_bytes=max_bytes, ttl=ttl,
+                                       recent_days=recent_days)
+        self.api.set_cache(self.cache)
 
     def daily(self, symbol, start_date, end_date,
               fields="", adjust_mode=None):
-        df, err_msg = self.api.daily(symbol=symbol, start_date=start_date, end_date=end_date,
-                                     fields=fields, adjust_mode=adjust_mode, data_format="")
+        def query(symbol_batch, start, end):
+            return self.api.daily(symbol=symbol_batch, start_date=start, end_date=end,
+                                  fields=fields, adjust_mode=adjust_mode, data_format="")
+        # adjusted prices depend on the end date of the query (pre adjust is relative to it),
+        # so only unadjusted queries are split by dates
+        df, err_msg = self._query_batches(query, symbol, start_date, end_date, split_dates=adjust_mode is None)
         # trade_status performance warning
         # TODO there will be duplicate entries when on stocks' IPO day
-        df = df.drop_duplicates()
+        if df is not None:
+            df = df.drop_duplicates()
         return df, err_msg
+    
+    @staticmethod
+    def _split_symbol(symbol, size):
+        """Split symbols separated by ',' into batches of size, 0 for no split."""
+        symbol_list = [s for s in symbol.split(',') if s]
+        if not size or len(symbol_list) <= size:
+            return [symbol]
+        return [','.join(symbol_list[i: i + size]) for i in range(0, len(symbol_list), size)]
+    
+    @staticmethod
+    def _split_dates(start_date, end_date, n_days):
+        """Split [start_date, end_date] (int) into consecutive ranges of n_days calendar days, 0 for no split."""
+        is_int = isinstance(start_date, (int, np.integer)) and isinstance(end_date, (int, np.integer))
+        if not n_days or not is_int:
+            return [(start_date, end_date)]
+        res = []
+        start = start_date
+        while start <= end_date:
+            end = min(dtutil.shift(start, n_days=n_days - 1), end_date)
+            res.append((start, end))
+            start = dtutil.shift(end, n_days=1)
+        return res
+    
+    def _query_batches(self, query, symbol, start_date, end_date, split_dates=True):
+        """
+        Call query on batches of symbols and dates and concatenate results.
+        
+        Parameters
+        ----------
+        query : callable
+            query(symbol, start_date, end_date) returns (df, msg).
+        symbol : str
+            separated by ','
+        start_date, end_date : int
+        split_dates : bool
+            Whether to split dates.
+
+        Returns
+        -------
+        df : pd.DataFrame or None
+            Results of batches in order. Results of failed batches are missing, None if all batches failed.
+        msg : str
+            '0,' if all batches succeed, otherwise error of the first failed batch and number of failed batches.
+
+        """
+        date_ranges = self._split_dates(start_date, end_date, self.date_batch_days if split_dates else 0)
+        batches = [(symbol_batch, start, end)
+                   for symbol_batch in self._split_symbol(symbol, self.symbol_batch_size)
+                   for start, end in date_ranges]
+        
+        def run(batch):
+            for i in range(self.n_retries + 1):
+                if i > 0:
+                    time.sleep(self.retry_wait * i)
+                try:
+                    df, msg = query(*batch)
+                except Exception as e:
+                    df, msg = None, "-1,{:s}: {}".format(type(e).__name__, e)
+                if msg == '0,':
+                    return df, msg
+            return None, msg
+        
+        if len(batches) == 1:
+            return run(batches[0])
+        
+        pool = ThreadPool(min(self.n_workers, len(batches)))
+        try:
+            results = pool.map(run, batches)
+        finally:
+            pool.close()
+            pool.join()
+        
+        dfs = [df for df, msg in results if msg == '0,' and df is not None]
+        errors = [(batch, msg) for batch, (df, msg) in zip(batches, results) if msg != '0,']
+        df = pd.concat(dfs, axis=0, ignore_index=True) if dfs else None
+        if not errors:
+            return df, '0,'
+        (symbol_batch, start, end), msg = errors[0]
+        msg = "{:s} [{:d} of {:d} batches failed, e.g. symbol {:s} from {} to {}]".format(
+            msg, len(errors), len(batches), symbol_batch, start, end)
+        return df, msg
 
     def bar(self, symbol,
             start_time=200000, end_time=160000, trade_date=None,
@@ -380,10 +513,13 @@ class RemoteDataService(DataService):
             408002000: joint (single quarter)
             """
         
-        filter_argument = self._dic2url(dic_argument)  # 0 means first time, not update
-        
-        res, msg = self.query(view_name, fields=fields, filter=filter_argument,
+        def query(symbol_batch, start, end):
+            dic = dict(dic_argument, symbol=symbol_batch, start_date=start, end_date=end)
+            filter_argument = self._dic2url(dic)  # 0 means first time, not update
+            return self.query(view_name, fields=fields, filter=filter_argument,
                               order_by=self.REPORT_DATE_FIELD_NAME)
+        
+        res, msg = self._query_batches(query, symbol, start_date, end_date)
         # change data type
         try:
             cols = list(set.intersection({'ann_date', 'report_date'}, set(res.columns)))
@@ -414,14 +550,16 @@ class RemoteDataService(DataService):
         msg : str
         
         """
-        filter_argument = self._dic2url({'symbol': symbol,
-                                         'start_date': start_date,
-                                         'end_date': end_date})
-    
-        return self.query("lb.secDailyIndicator",
-                          fields=fields,
-                          filter=filter_argument,
-                          orderby="trade_date")
+        def query(symbol_batch, start, end):
+            filter_argument = self._dic2url({'symbol': symbol_batch,
+                                             'start_date': start,
+                                             'end_date': end})
+            return self.query("lb.secDailyIndicator",
+                              fields=fields,
+                              filter=filter_argument,
+                              orderby="trade_date")
+        
+        return self._query_batches(query, symbol, start_date, end_date)
 
     def _get_index_comp(self, index, start_date, end_date):
         """
@@ -658,12 +796,15 @@ class RemoteDataService(DataService):
         if end_date is None:
             end_date = ""
         
-        filter_argument = self._dic2url({'symbol': symbol,
-                                         'start_date': start_date, 'end_date': end_date})
         fields_list = ['symbol', 'trade_date', 'adjust_factor']
-
-        df_raw, msg = self.query("lb.secAdjFactor", fields=','.join(fields_list),
-                                 filter=filter_argument, orderby="symbol")
+        
+        def query(symbol_batch, start, end):
+            filter_argument = self._dic2url({'symbol': symbol_batch,
+                                             'start_date': start, 'end_date': end})
+            return self.query("lb.secAdjFactor", fields=','.join(fields_list),
+                              filter=filter_argument, orderby="symbol")
+        
+        df_raw, msg = self._query_batches(query, symbol, start_date, end_date, split_dates=False)
         if msg != '0,':
             print msg
         df_raw = df_raw.astype(dtype={'symbol': str,
@@ -8,14 +8,21 @@ If you will use this data frequently, you can add define a new method of DataSer
 If you want to declare your field in props, instead of append it manually, you will have to modify prepare_data function.
 """
 import os
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import pandas as pd
 
 import jaqs.util.fileio
 from jaqs.util import dtutil
-from jaqs.data.align import align
-from jaqs.data.py_expression_eval import Parser
+from jaqs.data.align import AlignCache, ExpandedCache, get_position, take_position
+from jaqs.data.panel import PanelStore, FORMAT_VERSION
+from jaqs.data.py_expression_eval import get_parser
+
+# financial statements are announced at most this many days after the end of the report period
+# (annual reports by April 30)
+ANN_LAG_DAYS = 120
 
 
 class DataView(object):
@@ -35,9 +42,13 @@ class DataView(object):
     data_d : pd.DataFrame
         All daily frequency data will be merged and stored here.
         index is date, columns is symbol-field MultiIndex
+        It is built from the underlying PanelStore when accessed, modify data with append_df instead of it.
     data_q : pd.DataFrame
         All quarterly frequency data will be merged and stored here.
         index is date, columns is symbol-field MultiIndex
+    expanded_cache : ExpandedCache
+        Quarterly fields expanded to daily by get, with memory budget expanded_cache.max_bytes
+        and statistics expanded_cache.info().
     
     """
     # TODO only support stocks!
@@ -52,17 +63,43 @@ class DataView(object):
         self.end_date = 0
         self.fields = []
         self.freq = 1
+        self.formulas = {}
+        # max number of queries issued concurrently, 1 for one after another
+        self.n_query_workers = 4
+        # number of symbols queried together, 0 for all symbols at once
+        self.symbol_batch_size = 500
+        # if True, data of failed queries (or failed batches of a query) is missing instead of raising an error
+        self.allow_partial = False
+        # [field_name, formula, is_quarterly, formula_func_name_style, options] of added formulas in order, see update
+        self.formula_fields = []
 
         self.meta_data_list = ['start_date', 'end_date',
                                'extended_start_date_d', 'extended_start_date_q',
                                'freq', 'fields', 'symbol', 'universe',
-                               'custom_daily_fields', 'custom_quarterly_fields']
+                               'custom_daily_fields', 'custom_quarterly_fields',
+                               'dtype', 'field_dtypes', 'formula_fields']
         self.adjust_mode = 'post'
         
-        self.data_d = None
-        self.data_q = None
+        # dtype of float fields, e.g. 'float32' halves memory. field_dtypes is {field_name: dtype} override.
+        self.dtype = 'float64'
+        self.field_dtypes = {}
+        # dates (yyyymmdd can not be represented exactly by float32) and large accumulations keep float64
+        self.float64_fields = {'trade_date', 'ann_date', 'act_ann_date', 'report_date',
+                               'start_date', 'end_date', 'start_actdate', 'end_actdate',
+                               'start_reportdate', 'end_reportdate',
+                               'adjust_factor', 'volume', 'turnover', 'oi',
+                               'total_market_value', 'float_market_value',
+                               'share_amount', 'share_float', 'share_float_free'}
+        
+        # PanelStore {field: (n_dates x n_symbols) array} of daily and quarterly data
+        self._store_d = None
+        self._store_q = None
         self._data_benchmark = None
         self._data_group = None
+        # quarterly fields expanded to daily by formulas, shared by all formulas
+        self._align_cache = AlignCache()
+        # quarterly fields expanded to daily by get, invalidated when quarterly data or dates change
+        self.expanded_cache = ExpandedCache()
         
         common_list = {'symbol', 'start_date', 'end_date'}
         market_bar_list = {'open', 'high', 'low', 'close', 'volume', 'turnover', 'vwap', 'oi'}
@@ -216,6 +253,38 @@ class DataView(object):
         self .REPORT_DATE_FIELD_NAME = 'report_date'
         self.TRADE_STATUS_FIELD_NAME = 'trade_status'
         self.TRADE_DATE_FIELD_NAME = 'trade_date'
+        self._EXPANDED_POSITION_KEY = ('position', self.ANN_DATE_FIELD_NAME)
+    
+    @property
+    def data_d(self):
+        """
+        Daily data, index is date, columns is symbol-field MultiIndex.
+        
+        A new DataFrame is built from the store on every access, so modifying it does not change the DataView.
+        Use set_field or append_df to write data, or assign a whole DataFrame to data_d.
+        
+        """
+        if self._store_d is None:
+            return None
+        return self._store_d.to_frame()
+    
+    @data_d.setter
+    def data_d(self, df):
+        self._store_d = None if df is None else PanelStore.from_frame(df)
+        self.expanded_cache.clear()
+    
+    @property
+    def data_q(self):
+        """Quarterly data, index is report date, columns is symbol-field MultiIndex. A copy, see data_d."""
+        if self._store_q is None:
+            return None
+        return self._store_q.to_frame()
+    
+    @data_q.setter
+    def data_q(self, df):
+        self._store_q = None if df is None else PanelStore.from_frame(df)
+        self.expanded_cache.clear()
+        self._align_cache.clear()
     
     @property
     def data_benchmark(self):
@@ -299,16 +368,21 @@ class DataView(object):
         l = list(s)
         return l
     
-    def _query_data(self, symbol, fields):
+    def _query_data(self, symbol, fields, start_date=None, end_date=None):
         """
         Query data using different APIs, then store them in dict.
-        period, start_date and end_date are fixed.
+        period and end_date are fixed.
         Keys of dict are securitites.
         
         Parameters
         ----------
         symbol : list of str
         fields : list of str
+        start_date : int, optional
+            Start of trade dates of daily data and of announcement dates of quarterly data.
+            Default extended_start_date_d and extended_start_date_q.
+        end_date : int, optional
+            Default self.end_date.
 
         Returns
         -------
@@ -324,81 +398,127 @@ class DataView(object):
             {str: DataFrame}
         dic_fin_ind : dict
             {str: DataFrame}
+        
+        Raises
+        ------
+        ValueError
+            If any query (or any batch of a query) fails and allow_partial is False.
 
         """
         sep = ','
         symbol_str = sep.join(symbol)
+        start_date_d = self.extended_start_date_d if start_date is None else start_date
+        start_date_q = self.extended_start_date_q if start_date is None else start_date
+        if end_date is None:
+            end_date = self.end_date
         
-        dic_ref_daily = None
-        dic_market_daily = None
-        dic_balance = None
-        dic_cf = None
-        dic_income = None
-        dic_fin_ind = None
-        
-        if self.freq == 1:
-            # TODO : use fields = {field: kwargs} to enable params
-            fields_market_daily = self._get_fields('market_daily', fields, append=True)
-            if fields_market_daily:
-                print "NOTE: price adjust method is [{:s} adjust]".format(self.adjust_mode)
-                # no adjust prices and other market daily fields
-                df_daily, msg1 = self.data_api.daily(symbol_str, start_date=self.extended_start_date_d, end_date=self.end_date,
-                                                     adjust_mode=None, fields=sep.join(fields_market_daily))
-                adj_cols = ['open', 'high', 'low', 'close']
-                # adjusted prices
-                df_daily_adjust, msg11 = self.data_api.daily(symbol_str, start_date=self.extended_start_date_d, end_date=self.end_date,
-                                                             adjust_mode=self.adjust_mode, fields=','.join(adj_cols))
-                df_daily_adjust = df_daily_adjust.loc[:, adj_cols]
-                # concat axis = 1
-                df_daily = df_daily.join(df_daily_adjust, rsuffix='_adj')
-                if msg1 != '0,':
-                    print msg1
-                dic_market_daily = self._group_df_to_dict(df_daily, 'symbol')
-
-            fields_ref_daily = self._get_fields('ref_daily', fields)
-            if fields_ref_daily:
-                df_ref_daily, msg2 = self.data_api.query_lb_dailyindicator(symbol_str, self.extended_start_date_d, self.end_date,
-                                                                           sep.join(fields_ref_daily))
-                if msg2 != '0,':
-                    print msg2
-                dic_ref_daily = self._group_df_to_dict(df_ref_daily, 'symbol')
-
-            fields_income = self._get_fields('income', fields, append=True)
-            if fields_income:
-                df_income, msg3 = self.data_api.query_lb_fin_stat('income', symbol_str, self.extended_start_date_q, self.end_date,
-                                                                  sep.join(fields_income))
-                if msg3 != '0,':
-                    print msg3
-                dic_income = self._group_df_to_dict(df_income, 'symbol')
-
-            fields_balance = self._get_fields('balance_sheet', fields, append=True)
-            if fields_balance:
-                df_balance, msg3 = self.data_api.query_lb_fin_stat('balance_sheet', symbol_str, self.extended_start_date_q, self.end_date,
-                                                                   sep.join(fields_balance))
-                if msg3 != '0,':
-                    print msg3
-                dic_balance = self._group_df_to_dict(df_balance, 'symbol')
-
-            fields_cf = self._get_fields('cash_flow', fields, append=True)
-            if fields_cf:
-                df_cf, msg3 = self.data_api.query_lb_fin_stat('cash_flow', symbol_str, self.extended_start_date_q, self.end_date,
-                                                              sep.join(fields_cf))
-                if msg3 != '0,':
-                    print msg3
-                dic_cf = self._group_df_to_dict(df_cf, 'symbol')
-
-            fields_fin_ind = self._get_fields('fin_indicator', fields, append=True)
-            if fields_fin_ind:
-                df_fin_ind, msg4 = self.data_api.query_lb_fin_stat('fin_indicator', symbol_str,
-                                                                   self.extended_start_date_q, self.end_date,
-                                                                   sep.join(fields_cf))
-                if msg4 != '0,':
-                    print msg4
-                dic_fin_ind = self._group_df_to_dict(df_fin_ind, 'symbol')
-        else:
+        if self.freq != 1:
             raise NotImplementedError("freq = {}".format(self.freq))
         
-        return dic_market_daily, dic_ref_daily, dic_income, dic_balance, dic_cf, dic_fin_ind
+        # TODO : use fields = {field: kwargs} to enable params
+        # {category: query}, independent queries are issued concurrently
+        queries = dict()
+        fields_market_daily = self._get_fields('market_daily', fields, append=True)
+        adj_cols = ['open', 'high', 'low', 'close']
+        if fields_market_daily:
+            print "NOTE: price adjust method is [{:s} adjust]".format(self.adjust_mode)
+            # no adjust prices and other market daily fields
+            queries['market_daily'] = partial(self.data_api.daily, symbol_str, start_date=start_date_d,
+                                              end_date=end_date, adjust_mode=None,
+                                              fields=sep.join(fields_market_daily))
+            # adjusted prices
+            queries['market_daily_adjust'] = partial(self.data_api.daily, symbol_str, start_date=start_date_d,
+                                                     end_date=end_date, adjust_mode=self.adjust_mode,
+                                                     fields=sep.join(adj_cols))
+        
+        fields_ref_daily = self._get_fields('ref_daily', fields)
+        if fields_ref_daily:
+            queries['ref_daily'] = partial(self.data_api.query_lb_dailyindicator, symbol_str, start_date_d,
+                                           end_date, sep.join(fields_ref_daily))
+        
+        fields_income = self._get_fields('income', fields, append=True)
+        if fields_income:
+            queries['income'] = partial(self.data_api.query_lb_fin_stat, 'income', symbol_str, start_date_q,
+                                        end_date, sep.join(fields_income))
+        
+        fields_balance = self._get_fields('balance_sheet', fields, append=True)
+        if fields_balance:
+            queries['balance_sheet'] = partial(self.data_api.query_lb_fin_stat, 'balance_sheet', symbol_str,
+                                               start_date_q, end_date, sep.join(fields_balance))
+        
+        fields_cf = self._get_fields('cash_flow', fields, append=True)
+        if fields_cf:
+            queries['cash_flow'] = partial(self.data_api.query_lb_fin_stat, 'cash_flow', symbol_str, start_date_q,
+                                           end_date, sep.join(fields_cf))
+        
+        fields_fin_ind = self._get_fields('fin_indicator', fields, append=True)
+        if fields_fin_ind:
+            queries['fin_indicator'] = partial(self.data_api.query_lb_fin_stat, 'fin_indicator', symbol_str,
+                                               start_date_q, end_date, sep.join(fields_cf))
+        
+        dic_df = dict()
+        errors = []
+        for category, (df, msg) in sorted(self._run_queries(queries).items()):
+            if msg != '0,':
+                errors.append("[{:s}] {:s}".format(category, msg))
+            if df is not None:
+                dic_df[category] = df
+        if errors:
+            # a failed batch of data_api leaves symbols or dates missing
+            if not self.allow_partial:
+                raise ValueError("Query failed:\n    " + "\n    ".join(errors))
+            print "WARNING: data is incomplete. Query failed:\n    " + "\n    ".join(errors)
+        df_daily_adjust = dic_df.pop('market_daily_adjust', None)
+        if 'market_daily' in dic_df and df_daily_adjust is not None:
+            # concat axis = 1
+            dic_df['market_daily'] = dic_df['market_daily'].join(df_daily_adjust.loc[:, adj_cols], rsuffix='_adj')
+        
+        dic = {category: self._group_df_to_dict(df, 'symbol') for category, df in dic_df.items()}
+        return (dic.get('market_daily'), dic.get('ref_daily'), dic.get('income'),
+                dic.get('balance_sheet'), dic.get('cash_flow'), dic.get('fin_indicator'))
+    
+    def _run_queries(self, queries):
+        """
+        Run independent queries concurrently on a thread pool of at most n_query_workers threads.
+        
+        Parameters
+        ----------
+        queries : dict
+            {category: function without arguments}
+
+        Returns
+        -------
+        dict
+            {category: result of function}
+        
+        Raises
+        ------
+        ValueError
+            If any query fails. It is raised after all queries are finished, with errors of all failed categories.
+
+        """
+        def run(item):
+            category, func = item
+            try:
+                return category, func(), None
+            except Exception as e:
+                return category, None, "{:s}: {}".format(type(e).__name__, e)
+        
+        items = sorted(queries.items())
+        if self.n_query_workers > 1 and len(items) > 1:
+            pool = ThreadPool(min(self.n_query_workers, len(items)))
+            try:
+                outcomes = pool.map(run, items)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            outcomes = [run(item) for item in items]
+        
+        errors = ["[{:s}] {:s}".format(category, err) for category, res, err in outcomes if err is not None]
+        if errors:
+            raise ValueError("Query failed:\n    " + "\n    ".join(errors))
+        return {category: res for category, res, err in outcomes}
 
     @staticmethod
     def _process_index(df, index_name='trade_date'):
@@ -481,7 +601,7 @@ class DataView(object):
         return merge
 
     '''
-    def _dic_of_df_to_multi_index_df(self, dic, level_names=None):
+    def _dic_of_df_to_multi_index_df(self, dic, level_names=None, symbol=None):
         """
         Convert dict of DataFrame to MultiIndex DataFrame.
         Columns of result will be MultiIndex constructed using keys of dict and columns of DataFrame.
@@ -496,6 +616,8 @@ class DataView(object):
             Column labels for MultiIndex level 0.
         level_names : list of str
             Name of columns.
+        symbol : list of str, optional
+            Column labels for MultiIndex level 0. Default self.symbol.
 
         Returns
         -------
@@ -505,6 +627,8 @@ class DataView(object):
         """
         if level_names is None:
             level_names = ['symbol', 'field']
+        if symbol is None:
+            symbol = self.symbol
         '''
         if fields is None:
             fields = dic.values()[0].columns
@@ -514,7 +638,7 @@ class DataView(object):
         idx = np.unique(np.concatenate([df.index.values for df in values]))
         fields = np.unique(np.concatenate([df.columns.values for df in values]))
 
-        cols_multi = pd.MultiIndex.from_product([self.symbol, fields], names=level_names)
+        cols_multi = pd.MultiIndex.from_product([symbol, fields], names=level_names)
         cols_multi = cols_multi.sort_values()
         merge_final = pd.DataFrame(index=idx, columns=cols_multi, data=np.nan)
 
@@ -539,7 +663,7 @@ class DataView(object):
                    + "\n    At fields " + ', '.join(col_diff))
         return merge_final
 
-    def _preprocess_market_daily(self, dic):
+    def _preprocess_market_daily(self, dic, symbol=None):
         """
         Process data and construct MultiIndex.
         
@@ -558,10 +682,10 @@ class DataView(object):
             # df = df.astype({'trade_status': str})
             dic[sec] = self._process_index(df, self.TRADE_DATE_FIELD_NAME)
             
-        res = self._dic_of_df_to_multi_index_df(dic, level_names=['symbol', 'field'])
+        res = self._dic_of_df_to_multi_index_df(dic, level_names=['symbol', 'field'], symbol=symbol)
         return res
         
-    def _preprocess_ref_daily(self, dic, fields):
+    def _preprocess_ref_daily(self, dic, fields, symbol=None):
         """
         Process data and construct MultiIndex.
         
@@ -581,10 +705,10 @@ class DataView(object):
             df_mod = df_mod.loc[:, self._get_fields('ref_daily', fields)]
             dic[sec] = df_mod
         
-        res = self._dic_of_df_to_multi_index_df(dic, level_names=['symbol', 'field'])
+        res = self._dic_of_df_to_multi_index_df(dic, level_names=['symbol', 'field'], symbol=symbol)
         return res
 
-    def _preprocess_ref_quarterly(self, type_, dic, fields):
+    def _preprocess_ref_quarterly(self, type_, dic, fields, symbol=None):
         """
         Process data and construct MultiIndex.
         
@@ -606,7 +730,7 @@ class DataView(object):
             
             new_dic[sec] = df_mod
     
-        res = self._dic_of_df_to_multi_index_df(new_dic, level_names=['symbol', 'field'])
+        res = self._dic_of_df_to_multi_index_df(new_dic, level_names=['symbol', 'field'], symbol=symbol)
         return res
     
     @staticmethod
@@ -698,13 +822,21 @@ class DataView(object):
         """
         return self._is_quarter_field(field_name) or self._is_daily_field(field_name)
     
-    def _prepare_data(self, fields):
+    def _prepare_data(self, fields, symbol=None, start_date=None, dates=None, end_date=None):
         """
         Query and process data from data_api.
         
         Parameters
         ----------
         fields : list
+        symbol : list of str, optional
+            Default self.symbol.
+        start_date : int, optional
+            See _query_data. Default extended start dates.
+        dates : np.ndarray, optional
+            Trade dates of daily data. Default self.dates.
+        end_date : int, optional
+            See _query_data. Default self.end_date.
 
         Returns
         -------
@@ -717,17 +849,19 @@ class DataView(object):
         
         # query data
         print "Query data - query..."
+        if symbol is None:
+            symbol = self.symbol
         dic_market_daily, dic_ref_daily, dic_income, dic_balance_sheet, dic_cash_flow, dic_fin_ind = \
-            self._query_data(self.symbol, fields)
+            self._query_data(symbol, fields, start_date=start_date, end_date=end_date)
         
         # pre-process data
         print "Query data - preprocess..."
-        multi_market_daily = self._preprocess_market_daily(dic_market_daily)
-        multi_ref_daily = self._preprocess_ref_daily(dic_ref_daily, fields)
-        multi_income = self._preprocess_ref_quarterly('income', dic_income, fields)
-        multi_balance_sheet = self._preprocess_ref_quarterly('balance_sheet', dic_balance_sheet, fields)
-        multi_cash_flow = self._preprocess_ref_quarterly('cash_flow', dic_cash_flow, fields)
-        multi_fin_ind = self._preprocess_ref_quarterly('fin_indicator', dic_fin_ind, fields)
+        multi_market_daily = self._preprocess_market_daily(dic_market_daily, symbol)
+        multi_ref_daily = self._preprocess_ref_daily(dic_ref_daily, fields, symbol)
+        multi_income = self._preprocess_ref_quarterly('income', dic_income, fields, symbol)
+        multi_balance_sheet = self._preprocess_ref_quarterly('balance_sheet', dic_balance_sheet, fields, symbol)
+        multi_cash_flow = self._preprocess_ref_quarterly('cash_flow', dic_cash_flow, fields, symbol)
+        multi_fin_ind = self._preprocess_ref_quarterly('fin_indicator', dic_fin_ind, fields, symbol)
     
         print "Query data - merge..."
         merge_d = self._merge_data([multi_market_daily, multi_ref_daily],
@@ -737,39 +871,291 @@ class DataView(object):
     
         # drop dates that are not trade date
         if merge_d is not None:
-            trade_dates = self.dates
+            trade_dates = self.dates if dates is None else dates
             merge_d = merge_d.loc[trade_dates, pd.IndexSlice[:, :]].copy()
         
         return merge_d, merge_q
     
+    def _prepare_stores(self, fields, symbol=None, start_date=None, dates=None, end_date=None):
+        """
+        Query and process data from data_api in batches of symbol_batch_size symbols.
+        At most n_query_workers batches are queried at a time. Each batch is written into the stores
+        as soon as it is processed, so raw data of only a few batches is held in memory.
+        
+        Parameters
+        ----------
+        See _prepare_data.
+
+        Returns
+        -------
+        store_d : PanelStore or None
+        store_q : PanelStore or None
+
+        """
+        if symbol is None:
+            symbol = self.symbol
+        if dates is None:
+            dates = self.dates
+        size = self.symbol_batch_size or len(symbol)
+        batches = [symbol[i: i + size] for i in range(0, len(symbol), size)]
+        
+        def prepare(batch):
+            return self._prepare_data(fields, symbol=batch, start_date=start_date, dates=dates, end_date=end_date)
+        
+        if self.n_query_workers > 1 and len(batches) > 1:
+            pool = ThreadPool(min(self.n_query_workers, len(batches)))
+            results = pool.imap_unordered(prepare, batches)
+        else:
+            pool = None
+            results = (prepare(batch) for batch in batches)
+        
+        store_d, dfs_q = None, []
+        try:
+            for merge_d, merge_q in results:
+                if merge_d is not None:
+                    if store_d is None:
+                        store_d = PanelStore(pd.Index(dates, name=self.TRADE_DATE_FIELD_NAME), symbol)
+                    store_d.update(PanelStore.from_frame(merge_d))
+                if merge_q is not None:
+                    dfs_q.append(merge_q)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        
+        merge_q = self._merge_data(dfs_q, index_name=self.REPORT_DATE_FIELD_NAME)
+        store_q = None if merge_q is None else PanelStore.from_frame(merge_q)
+        return store_d, store_q
+    
     def _prepare_adj_factor(self):
         symbol_str = ','.join(self.symbol)
-        df_adj = self.data_api.get_adj_factor_daily(symbol_str,
-                                                    start_date=self.extended_start_date_d, end_date=self.end_date, div=False)
-        self.append_df(df_adj, 'adjust_factor', is_quarterly=False)
+        return self.data_api.get_adj_factor_daily(symbol_str,
+                                                  start_date=self.extended_start_date_d, end_date=self.end_date,
+                                                  div=False)
 
     def _prepare_comp_info(self):
-        df = self.data_api.get_index_comp_df(self.universe, self.extended_start_date_d, self.end_date)
-        self.append_df(df, 'index_member', is_quarterly=False)
+        return self.data_api.get_index_comp_df(self.universe, self.extended_start_date_d, self.end_date)
 
     def prepare_data(self):
         """Prepare data for the FIRST time."""
-        # prepare benchmark and group
-        print "Query data..."
-        self.data_d, self.data_q = self._prepare_data(self.fields)
+        # fields, adj_factor, industry, benchmark and member info are queried concurrently
+        print "Query data, adj_factor" + (", industry, benchmark and member info..." if self.universe else "...")
+        queries = {'data': partial(self._prepare_stores, self.fields),
+                   'adj_factor': self._prepare_adj_factor}
+        if self.universe:
+            queries.update({'industry': self._prepare_group,
+                            'benchmark': self._prepare_benchmark,
+                            'index_member': self._prepare_comp_info})
+        res = self._run_queries(queries)
+        
+        self._store_d, self._store_q = res['data']
+        self._apply_dtype()
+        self.append_df(res['adj_factor'], 'adjust_factor', is_quarterly=False)
+        if self.universe:
+            self._data_group = res['industry']
+            self._data_benchmark = res['benchmark']
+            self.append_df(res['index_member'], 'index_member', is_quarterly=False)
+
+        if self.formulas:
+            print "Add formulas..."
+            self.add_formulas(self.formulas)
+
+        print "Data has been successfully prepared."
+
+    def update(self, end_date, data_api=None, custom_data=None):
+        """
+        Extend data of a prepared DataView to a later end_date.
+        Only daily data of the new trade dates and financial statements announced since the
+        latest known ann_date are queried. Symbols which join the universe are queried for all dates.
+        adjust_factor, index_member, benchmark and industry groups are extended
+        and formula fields are computed again with the options they were added with.
+        Fields appended by append_df cannot be queried, so their data must be provided again in custom_data.
 
-        print "Query adj_factor..."
-        self._prepare_adj_factor()
+        Parameters
+        ----------
+        end_date : int
+            New end date.
+        data_api : RemoteDataService, optional
+        custom_data : dict, optional
+            {field_name: pd.DataFrame} of all fields appended by append_df, covering old and new dates.
+            Formulas using these fields are computed on the new data.
+
+        """
+        if data_api is not None:
+            self.data_api = data_api
+        if self.data_api is None:
+            raise ValueError("Update failed. No data_api available. Please specify one in parameter.")
+        if self._store_d is None:
+            raise ValueError("No data to update, prepare data first.")
+        
+        custom_data = dict(custom_data or {})
+        custom_fields = self._get_appended_fields()
+        missing = [field for field in custom_fields if field not in custom_data]
+        if missing:
+            raise ValueError("Update failed. Fields {} were appended by append_df, "
+                             "provide their data in custom_data.".format(missing))
+        unknown = [field for field in custom_data if field not in custom_fields]
+        if unknown:
+            raise ValueError("Update failed. Fields {} of custom_data were not appended by append_df.".format(unknown))
+        
+        if end_date <= self.end_date:
+            print "end_date {:d} is not later than {:d}, no update.".format(end_date, self.end_date)
+            return
+
+        # query everything into locals first, so a failed query leaves the DataView unchanged
+        old_dates = self.dates
+        start_date = dtutil.shift(self.end_date, n_days=1)
+        new_dates = self.data_api.get_trade_date(start_date, end_date)
+        new_dates = new_dates[new_dates >= start_date]
+        all_dates = np.concatenate([old_dates, new_dates])
 
+        old_symbol = list(self.symbol)
+        new_symbol = []
         if self.universe:
-            print "Query industry..."
-            self._data_group = self._prepare_group()
-            print "Query benchmark..."
-            self._data_benchmark = self._prepare_benchmark()
-            print "Query benchmar member info..."
-            self._prepare_comp_info()
+            symbol = self.data_api.get_index_comp(self.universe, self.extended_start_date_d, end_date)
+            new_symbol = sorted(set(symbol) - set(old_symbol))
+            if new_symbol:
+                print "Symbols {} joined universe, query all dates of them.".format(new_symbol)
+        all_symbol = sorted(old_symbol + new_symbol)
+
+        print "Update daily data..."
+        store_d = self._store_d.reindex(index=all_dates, symbols=all_symbol)
+        if len(new_dates):
+            store_d.update(self._prepare_daily_part(old_symbol, start_date, new_dates, end_date))
+        if new_symbol:
+            store_d.update(self._prepare_daily_part(new_symbol, self.extended_start_date_d, all_dates, end_date))
+        self._fill_daily_part(store_d, len(old_dates))
+
+        print "Update quarterly data..."
+        store_q = None
+        if self._store_q is not None:
+            df_q = self._store_q.to_frame()
+            ann_arr = self._store_q.get_array(self.ANN_DATE_FIELD_NAME)
+            if not np.isnan(ann_arr).all():
+                df_new = self._prepare_quarterly_part(old_symbol, int(np.nanmax(ann_arr)), end_date)
+                if df_new is not None:
+                    df_q = df_new.combine_first(df_q)
+            if new_symbol:
+                df_new = self._prepare_quarterly_part(new_symbol, self.extended_start_date_q, end_date)
+                if df_new is not None:
+                    df_q = df_new.combine_first(df_q)
+            store_q = PanelStore.from_frame(self._merge_data([df_q], index_name=self.REPORT_DATE_FIELD_NAME))
+
+        data_group, data_benchmark = self._data_group, self._data_benchmark
+        if self.universe:
+            print "Update industry..."
+            data_group = self._prepare_group(symbol=all_symbol, end_date=end_date)
+            print "Update benchmark..."
+            if len(new_dates):
+                df_new = self._prepare_benchmark(start_date=start_date, end_date=end_date)
+                df_bench = pd.concat([data_benchmark, df_new], axis=0)
+                data_benchmark = df_bench.loc[~df_bench.index.duplicated(keep='last')]
+
+        if custom_data:
+            print "Update appended fields..."
+            for field_name, df in custom_data.items():
+                store = store_q if field_name in self.custom_quarterly_fields else store_d
+                store.set(field_name, df)
+
+        # all queries succeeded
+        self.end_date = end_date
+        self.symbol = all_symbol
+        self._store_d, self._store_q = store_d, store_q
+        self._data_group, self._data_benchmark = data_group, data_benchmark
+        self._apply_dtype()
+        self._align_cache.clear()
+
+        if self.formula_fields:
+            print "Update formulas..."
+            self._recompute_formulas()
+
+        print "Data has been successfully updated to {:d}.".format(end_date)
+
+    def _prepare_daily_part(self, symbol, start_date, dates, end_date):
+        """
+        Daily data of symbol at dates from start_date to end_date, including adjust_factor and index_member.
 
-        print "Data has been successfully prepared."
+        Returns
+        -------
+        PanelStore
+
+        """
+        symbol_str = ','.join(symbol)
+        queries = {'data': partial(self._prepare_stores, self._get_fields('daily', self.fields),
+                                   symbol=symbol, start_date=start_date, dates=dates, end_date=end_date)}
+        if 'adjust_factor' in self._store_d:
+            queries['adj_factor'] = partial(self.data_api.get_adj_factor_daily, symbol_str,
+                                            start_date=start_date, end_date=end_date, div=False)
+        if 'index_member' in self._store_d:
+            queries['index_member'] = partial(self.data_api.get_index_comp_df, self.universe, start_date, end_date)
+        res = self._run_queries(queries)
+
+        store, _ = res['data']
+        if 'adj_factor' in res:
+            store.set('adjust_factor', res['adj_factor'])
+        if 'index_member' in res:
+            store.set('index_member', res['index_member'].reindex(columns=symbol).fillna(0))
+        return store
+
+    def _fill_daily_part(self, store, n_old):
+        """Forward fill queried fields from the last old date, like _merge_data does for a full query."""
+        if n_old == 0:
+            return
+        queried = set(self._get_fields('market_daily', self.fields, append=True)
+                      + self._get_fields('ref_daily', self.fields))
+        for field in store.fields:
+            if field not in queried:
+                continue
+            arr = store.get_array(field)
+            if pd.isnull(arr[n_old:]).any():
+                df = pd.DataFrame(arr[n_old - 1:]).fillna(method='ffill')
+                store.set(field, np.concatenate([arr[:n_old - 1], df.values.astype(arr.dtype)]))
+
+    def _prepare_quarterly_part(self, symbol, start_date, end_date):
+        """Financial statements of symbol announced from start_date to end_date, None if no quarterly fields."""
+        _, merge_q = self._prepare_data(self._get_fields('quarterly', self.fields), symbol=symbol,
+                                        start_date=start_date, end_date=end_date)
+        if merge_q is None:
+            return None
+        return merge_q.loc[:, pd.IndexSlice[symbol, :]]
+
+    def _get_appended_fields(self):
+        """Custom fields appended by append_df, except formula fields and fields extended by update."""
+        excluded = {entry[0] for entry in self.formula_fields} | {'adjust_factor', 'index_member'}
+        return [field for field in self.custom_daily_fields + self.custom_quarterly_fields
+                if field not in excluded]
+
+    def _recompute_formulas(self):
+        """
+        Drop formula fields and add them again in order. Consecutive formulas of the same kind
+        without options (chunk_size, profile) are added at once.
+        
+        """
+        formula_fields, self.formula_fields = self.formula_fields, []
+        for entry in formula_fields:
+            field_name, is_quarterly = entry[0], entry[2]
+            store = self._store_q if is_quarterly else self._store_d
+            if field_name in store:
+                store.drop(field_name)
+            self.fields.remove(field_name)
+            for custom in [self.custom_daily_fields, self.custom_quarterly_fields]:
+                if field_name in custom:
+                    custom.remove(field_name)
+        self.expanded_cache.clear()
+
+        # entries recorded before options were recorded have no options
+        formula_fields = [list(entry[:4]) + [entry[4] if len(entry) > 4 else {}] for entry in formula_fields]
+        batch = dict()
+        for i, (field_name, formula, is_quarterly, style, options) in enumerate(formula_fields):
+            if any(options.values()):
+                self.add_formula(field_name, formula, is_quarterly=is_quarterly, formula_func_name_style=style,
+                                 **options)
+                continue
+            batch[field_name] = formula
+            if (i + 1 == len(formula_fields) or any(formula_fields[i + 1][4].values())
+                    or formula_fields[i + 1][2:4] != [is_quarterly, style]):
+                self.add_formulas(batch, is_quarterly=is_quarterly, formula_func_name_style=style)
+                batch = dict()
 
     def init_from_config(self, props, data_api):
         """
@@ -779,7 +1165,13 @@ class DataView(object):
         Parameters
         ----------
         props : dict, optional
-            start_date, end_date, freq, symbol, fields
+            start_date, end_date, freq, symbol, fields, formulas
+            formulas is optional {field_name: formula} of daily fields, which are added after data is prepared.
+            Only data needed by lookback of formulas is queried before start_date.
+            n_query_workers is optional max number of queries issued concurrently, default 4.
+            symbol_batch_size is optional number of symbols queried together, default 500.
+            allow_partial is optional, if True data of failed queries is missing instead of raising error,
+            default False.
         data_api : BaseDataServer
         
         """
@@ -789,8 +1181,6 @@ class DataView(object):
     
         # initialize parameters
         self.start_date = props['start_date']
-        self.extended_start_date_d = dtutil.shift(self.start_date, n_weeks=-8)  # query more data
-        self.extended_start_date_q = dtutil.shift(self.start_date, n_weeks=-80)
         self.end_date = props['end_date']
         
         fields = props.get('fields', [])
@@ -803,8 +1193,23 @@ class DataView(object):
         # TODO: hard-coded
         self.fields.extend(['open_adj', 'high_adj', 'low_adj', 'close_adj'])
         
+        # formulas will be added after data is prepared. Their variables are queried together with fields.
+        self.formulas = dict(props.get('formulas', {}))
+        n_days, n_quarters = self._get_warm_up(self.formulas)
+        for var in self._formula_variables(self.formulas):
+            if var not in self.fields and self._is_predefined_field(var):
+                self.fields.append(var)
+        
+        # query more data before start_date, exactly as needed by formulas
+        self.extended_start_date_d = self._get_extended_start_date_d(n_days)
+        self.extended_start_date_q = self._get_extended_start_date_q(n_quarters)
+        
         self.freq = props['freq']
+        self.n_query_workers = props.get('n_query_workers', self.n_query_workers)
+        self.symbol_batch_size = props.get('symbol_batch_size', self.symbol_batch_size)
+        self.allow_partial = props.get('allow_partial', self.allow_partial)
         self.universe = props.get('universe', "")
+        self.set_dtype(props.get('dtype', 'float64'), props.get('field_dtypes', None))
         if self.universe:
             self.symbol = data_api.get_index_comp(self.universe, self.extended_start_date_d, self.end_date)
             self.fields.append('index_member')
@@ -814,9 +1219,93 @@ class DataView(object):
     
         print "Initialize config success."
         
-    def _prepare_benchmark(self):
+    @staticmethod
+    def _formula_variables(formulas):
+        parser = get_parser().copy()
+        plan, names = parser.compile_formulas(formulas)
+        return plan.variables(parser.functions)
+    
+    def _get_warm_up(self, formulas):
+        """
+        Number of trade days and quarters needed before start_date to compute formulas from start_date.
+        
+        Parameters
+        ----------
+        formulas : dict
+            {field_name: formula}
+
+        Returns
+        -------
+        n_days, n_quarters : int or None
+            None if the lookback of any formula is unbounded (e.g. Ewma).
+
+        """
+        if not formulas:
+            return 0, 0
+        
+        parser = get_parser().copy()
+        plan, names = parser.compile_formulas(formulas)
+        quarterly_vars = {var for var in plan.variables(parser.functions) if self._is_quarter_field(var)}
+        warm_up = parser.get_warm_up(plan, quarterly_vars)
+        lookbacks = parser.get_lookbacks(plan)
+        
+        n_days, n_quarters = 0, 0
+        for name, (days, quarters), lookback in zip(names, warm_up, lookbacks):
+            if lookback is None:
+                print "Lookback of formula [{:s}] is unbounded, use default warm-up period.".format(name)
+                return None, None
+            n_days = max(n_days, days or 0)
+            n_quarters = max(n_quarters, quarters or 0)
+        return n_days, n_quarters
+    
+    def _get_extended_start_date_d(self, n_days):
+        """The date n_days trade days before start_date. Default 8 weeks before if n_days is None."""
+        if n_days is None:
+            return dtutil.shift(self.start_date, n_weeks=-8)
+        if n_days == 0:
+            return self.start_date
+        
+        n_weeks = n_days // 5 + 4  # allow for holidays
+        while True:
+            dates = self.data_api.get_trade_date(dtutil.shift(self.start_date, n_weeks=-n_weeks), self.start_date)
+            dates = dates[dates < self.start_date]
+            if len(dates) >= n_days:
+                return int(dates[-n_days])
+            n_weeks *= 2
+    
+    def _get_extended_start_date_q(self, n_quarters):
+        """
+        Reports of n_quarters quarters before the latest report announced before start_date are needed.
+        Reports are queried by announcement date. The latest report is at least of the last quarter ending
+        ANN_LAG_DAYS before start_date, and a report is announced after its period ends,
+        so the needed reports are announced after the quarter end n_quarters quarters before that quarter.
+        Default 80 weeks before if n_quarters is None.
+        
+        """
+        if n_quarters is None:
+            return dtutil.shift(self.start_date, n_weeks=-80)
+        quarter_end = pd.tseries.offsets.QuarterEnd(startingMonth=12)
+        dt = quarter_end.rollback(dtutil.convert_int_to_datetime(dtutil.shift(self.start_date, n_days=-ANN_LAG_DAYS)))
+        return dtutil.convert_datetime_to_int(dt - n_quarters * quarter_end)
+    
+    def _check_warm_up(self, parser, plan):
+        """Print a warning if there are not enough dates before start_date, so the first values will be NaN."""
+        quarterly_vars = {var for var in plan.variables(parser.functions) if self._is_quarter_field(var)}
+        warm_up = parser.get_warm_up(plan, quarterly_vars)
+        n_needed = max([days or 0 for days, quarters in warm_up] or [0])
+        n_available = np.sum(self.dates < self.start_date)
+        if n_needed > n_available:
+            print "Warning: formula needs {:d} trade days before start_date, but only {:d} are available. " \
+                  "Values at the beginning will be NaN. Add the formula to props['formulas'] to " \
+                  "query enough data.".format(n_needed, n_available)
+    
+    def _prepare_benchmark(self, start_date=None, end_date=None):
+        if start_date is None:
+            start_date = self.extended_start_date_d
+        if end_date is None:
+            end_date = self.end_date
         df_bench, msg = self.data_api.daily(self.universe,
-                                            start_date=self.extended_start_date_d, end_date=self.end_date,
+                                            start_date=start_date, end_date=end_date,
                                             adjust_mode=self.adjust_mode, fields='close')
         if msg != '0,':
             raise ValueError("msg = {:s}".format(msg))
@@ -824,9 +1313,13 @@ class DataView(object):
         df_bench = self._process_index(df_bench, self.TRADE_DATE_FIELD_NAME)
         return df_bench
     
-    def _prepare_group(self):
-        df = self.data_api.get_industry_daily(symbol=','.join(self.symbol),
-                                              start_date=self.extended_start_date_q, end_date=self.end_date)
+    def _prepare_group(self, symbol=None, end_date=None):
+        if symbol is None:
+            symbol = self.symbol
+        if end_date is None:
+            end_date = self.end_date
+        df = self.data_api.get_industry_daily(symbol=','.join(symbol),
+                                              start_date=self.extended_start_date_q, end_date=end_date)
         return df
     
     def _add_field(self, field_name, is_quarterly=None):
@@ -872,7 +1365,8 @@ class DataView(object):
         merge = merge.loc[:, pd.IndexSlice[:, field_name]]
         self.append_df(merge, field_name, is_quarterly=is_quarterly)  # whether contain only trade days is decided by existing data.
     
-    def add_formula(self, field_name, formula, is_quarterly, formula_func_name_style='upper', data_api=None):
+    def add_formula(self, field_name, formula, is_quarterly, formula_func_name_style='upper', data_api=None,
+                    chunk_size=None, profile=False):
         """
         Add a new field, which is calculated using existing fields.
         
@@ -886,6 +1380,11 @@ class DataView(object):
             Whether df is quarterly data (like quarterly financial statement) or daily data.
         formula_func_name_style : {'upper', 'lower'}, optional
         data_api : RemoteDataService, optional
+        chunk_size : int, optional
+            If not None, evaluate formula on blocks of chunk_size dates to limit memory usage.
+            See Parser.evaluate_chunked.
+        profile : bool, optional
+            If True, print time, shape, memory and NaN ratio of each node of the formula. See Parser.get_profile.
         
         """
         if data_api is not None:
@@ -895,14 +1394,87 @@ class DataView(object):
             print "Add formula failed: field name [{:s}] exist. Try another name.".format(field_name)
             return
         
-        parser = Parser()
-        parser.set_capital(formula_func_name_style)
+        parser = get_parser(formula_func_name_style).copy(align_cache=self._align_cache)
         
         expr = parser.parse(formula)
         
-        var_df_dic = dict()
         var_list = expr.variables()
+        var_df_dic = self._get_formula_values(var_list)
+        self._check_warm_up(parser, parser.plan)
+        
+        # TODO: send ann_date into expr.evaluate. We assume that ann_date of all fields of a symbol is the same
+        df_ann = self.get_ann_df()
+        parser.profile = profile
+        parser.dtype = self._parser_dtype(self._get_field_dtype(field_name))
+        if chunk_size:
+            df_eval = parser.evaluate_chunked(var_df_dic, chunk_size,
+                                              ann_dts=df_ann, trade_dts=self.dates, df_group=self.data_group)
+        else:
+            df_eval = parser.evaluate(var_df_dic, ann_dts=df_ann, trade_dts=self.dates, df_group=self.data_group)
+        if profile:
+            print "Profile of formula [{:s}]:\n{:s}".format(field_name, parser.get_profile(tree=True))
+        
+        self.append_df(df_eval, field_name, is_quarterly=is_quarterly)
+        self.formula_fields.append([field_name, formula, is_quarterly, formula_func_name_style,
+                                    {'chunk_size': chunk_size, 'profile': profile}])
+
+    def add_formulas(self, formulas, is_quarterly=False, formula_func_name_style='upper', data_api=None):
+        """
+        Add several new fields at once. Formulas can refer to each other by field name.
+        All formulas are merged into one evaluation plan: every variable is loaded once,
+        common sub-expressions are evaluated once and all results are appended in one merge.
+        
+        Parameters
+        ----------
+        formulas : dict
+            {field_name: formula}
+        is_quarterly : bool
+            Whether results are quarterly data or daily data.
+        formula_func_name_style : {'upper', 'lower'}, optional
+        data_api : RemoteDataService, optional
+
+        """
+        if data_api is not None:
+            self.data_api = data_api
+        
+        formulas = dict(formulas)
+        for field_name in list(formulas.keys()):
+            if field_name in self.fields:
+                print "Add formula failed: field name [{:s}] exist. Try another name.".format(field_name)
+                formulas.pop(field_name)
+        if not formulas:
+            return
+        
+        parser = get_parser(formula_func_name_style).copy(align_cache=self._align_cache)
+        
+        plan, names = parser.compile_formulas(formulas)
+        
+        var_list = plan.variables(parser.functions)
+        var_df_dic = self._get_formula_values(var_list)
+        self._check_warm_up(parser, plan)
         
+        df_ann = self.get_ann_df()
+        parser.dtype = self._parser_dtype(self.dtype)
+        res_list = parser.evaluate_plan(plan, var_df_dic,
+                                        ann_dts=df_ann, trade_dts=self.dates, df_group=self.data_group)
+        
+        self._append_dfs(dict(zip(names, res_list)), is_quarterly=is_quarterly)
+        self.formula_fields.extend([name, formulas[name], is_quarterly, formula_func_name_style, {}] for name in names)
+    
+    def _get_formula_values(self, var_list):
+        """
+        Get values of variables used by formulas. Fields not in the DataView will be queried.
+        
+        Parameters
+        ----------
+        var_list : list of str
+
+        Returns
+        -------
+        dict
+            {var: pd.DataFrame}
+
+        """
         # TODO
         # users do not need to prepare data before add_formula
         if not self.fields:
@@ -915,7 +1487,7 @@ class DataView(object):
                           "try to fetch from the server...".format(var)
                     self.add_field(var)
         
-        df_ann = self.get_ann_df()
+        var_df_dic = dict()
         for var in var_list:
             if self._is_quarter_field(var):
                 df_var = self.get_ts_quarter(var, start_date=self.extended_start_date_q)
@@ -925,10 +1497,7 @@ class DataView(object):
             
             var_df_dic[var] = df_var
         
-        # TODO: send ann_date into expr.evaluate. We assume that ann_date of all fields of a symbol is the same
-        df_eval = parser.evaluate(var_df_dic, ann_dts=df_ann, trade_dts=self.dates, df_group=self.data_group)
-        
-        self.append_df(df_eval, field_name, is_quarterly=is_quarterly)
+        return var_df_dic
 
     @staticmethod
     def _load_h5(fp):
@@ -950,26 +1519,97 @@ class DataView(object):
         
         return res
         
-    def load_dataview(self, folder='.'):
+    def load_dataview(self, folder='.', fields="", symbol="", start_date=0, end_date=0, mmap=True):
         """
-        Load data from local file.
+        Load data from local file. Both the columnar format (default of save_dataview)
+        and the legacy hd5 format can be loaded.
         
         Parameters
         ----------
         folder : str, optional
-            Folder path to store hd5 file and meta data.
+            Folder path to store data files and meta data.
+        fields : str, optional
+            Separated by ',' default "" (all fields). Only these fields are loaded,
+            ann_date is also loaded if there is any quarterly field.
+        symbol : str, optional
+            Separated by ',' default "" (all securities).
+        start_date : int, optional
+            Default 0 (all dates). Daily data before it is not loaded.
+        end_date : int, optional
+            Default 0 (all dates). Daily data after it is not loaded.
+        mmap : bool, optional
+            If True, numeric fields of the columnar format are memory-mapped, not read into memory.
             
         """
         meta_data = jaqs.util.fileio.read_json(os.path.join(folder, 'meta_data.json'))
-        dic = self._load_h5(os.path.join(folder, 'data.hd5'))
-        self.data_d = dic.get('/data_d', None)
-        self.data_q = dic.get('/data_q', None)
-        self._data_benchmark = dic.get('/data_benchmark', None)
-        self._data_group = dic.get('/data_group', None)
+        if meta_data is None:
+            raise IOError("No meta_data.json in {:s}".format(folder))
+        fmt = meta_data.pop('format', 'hd5')
+        meta_data.pop('format_version', None)
         self.__dict__.update(meta_data)
         
+        symbol_list = symbol.split(',') if symbol else None
+        fields_d = fields_q = None
+        if fields:
+            field_list = fields.split(',')
+            fields_d = [field for field in field_list if self._is_daily_field(field)]
+            fields_q = [field for field in field_list if self._is_quarter_field(field)]
+            unknown = set(field_list) - set(fields_d) - set(fields_q)
+            if unknown:
+                raise ValueError("Fields {} are not in the DataView.".format(list(unknown)))
+            if fields_q and self.ANN_DATE_FIELD_NAME not in fields_q:
+                fields_q.append(self.ANN_DATE_FIELD_NAME)
+        
+        if fmt == 'hd5':
+            dic = self._load_h5(os.path.join(folder, 'data.hd5'))
+            self.data_d = dic.get('/data_d', None)
+            self.data_q = dic.get('/data_q', None)
+            self._data_benchmark = dic.get('/data_benchmark', None)
+            self._data_group = dic.get('/data_group', None)
+            if self._store_d is not None:
+                self._store_d = self._store_d.select(fields_d, symbol_list, start_date or None, end_date or None)
+            if self._store_q is not None:
+                self._store_q = None if fields_q == [] else self._store_q.select(fields_q, symbol_list)
+        else:
+            store_d, store_q = None, None
+            folder_d, folder_q = os.path.join(folder, 'data_d'), os.path.join(folder, 'data_q')
+            if os.path.exists(folder_d):
+                store_d = PanelStore.load(folder_d, fields_d, symbol_list, start_date or None, end_date or None,
+                                          mmap=mmap)
+            if os.path.exists(folder_q) and fields_q != []:
+                store_q = PanelStore.load(folder_q, fields_q, symbol_list, mmap=mmap)
+            self._store_d, self._store_q = store_d, store_q
+            self._data_benchmark = self._read_pickle(os.path.join(folder, 'data_benchmark.pkl'))
+            self._data_group = self._read_pickle(os.path.join(folder, 'data_group.pkl'))
+        self.expanded_cache.clear()
+        
+        # meta data of the loaded part
+        if fields:
+            self.fields = [field for field in self.fields if field in fields_d or field in fields_q]
+        if symbol_list is not None:
+            self.symbol = sorted(symbol_list)
+            if self._data_group is not None:
+                self._data_group = self._data_group.loc[:, self.symbol]
+        if start_date or end_date:
+            if start_date:
+                self.start_date = max(self.start_date, start_date)
+                self.extended_start_date_d = max(self.extended_start_date_d, start_date)
+            if end_date:
+                self.end_date = min(self.end_date, end_date)
+            if self._data_benchmark is not None:
+                self._data_benchmark = self._data_benchmark.loc[start_date or None: end_date or None]
+        
+        # data saved before dtype policy existed is float64
+        self._apply_dtype()
+        
         print "Dataview loaded successfully."
 
+    @staticmethod
+    def _read_pickle(fp):
+        if not os.path.exists(fp):
+            return None
+        return pd.read_pickle(fp)
+
     @property
     def dates(self):
         """
@@ -981,8 +1621,8 @@ class DataView(object):
             dtype: int
 
         """
-        if self.data_d is not None:
-            res = self.data_d.index.values
+        if self._store_d is not None:
+            res = self._store_d.index.values
         elif self.data_api is not None:
             res = self.data_api.get_trade_date(self.extended_start_date_d, self.end_date, is_datetime=False)
         else:
@@ -1033,23 +1673,22 @@ class DataView(object):
         
         df_ref_expanded = None
         if fields_quarterly:
-            df_ref_quarterly = self.data_q.loc[:,
-                                               pd.IndexSlice[symbol, fields_quarterly]]
-            df_ref_ann = self.data_q.loc[:,
-                                         pd.IndexSlice[symbol, self.ANN_DATE_FIELD_NAME]]
-            df_ref_ann.columns = df_ref_ann.columns.droplevel(level='field')
+            dates = self.dates
+            rows = slice(np.searchsorted(dates, start_date, side='left'),
+                         np.searchsorted(dates, end_date, side='right'))
+            cols = self._symbol_positions(self._store_q, symbol)
+            symbols_q = self._store_q.symbols[cols]
             
-            dic_expanded = dict()
-            for field_name, df in df_ref_quarterly.groupby(level=1, axis=1):  # by column multiindex fields
-                df_expanded = align(df, df_ref_ann, self.dates)
-                dic_expanded[field_name] = df_expanded
-            df_ref_expanded = pd.concat(dic_expanded.values(), axis=1)
+            df_list = []
+            for field_name in fields_quarterly:
+                arr = self._get_expanded(field_name)[rows, cols]
+                multi_idx = pd.MultiIndex.from_product([symbols_q, [field_name]], names=['symbol', 'field'])
+                df_list.append(pd.DataFrame(arr, index=dates[rows], columns=multi_idx))
+            df_ref_expanded = pd.concat(df_list, axis=1)
             df_ref_expanded.index.name = self.TRADE_DATE_FIELD_NAME
-            df_ref_expanded = df_ref_expanded.loc[start_date: end_date, :]
         
         if fields_daily:
-            df_others = self.data_d.loc[pd.IndexSlice[start_date: end_date],
-                                        pd.IndexSlice[symbol, fields_daily]]
+            df_others = self._store_d.to_frame(fields_daily, symbol, start_date, end_date)
         else:
             df_others = None
         
@@ -1077,6 +1716,16 @@ class DataView(object):
             symbol as index, field as columns
 
         """
+        field_list = fields.split(',') if fields else self.fields
+        snapshot = self._get_snapshot_arrays(snapshot_date, symbol, field_list)
+        if snapshot is not None:
+            # take the row of each field directly
+            symbols, dic = snapshot
+            res = pd.DataFrame(dic, index=symbols, columns=sorted(set(field_list)))
+            res.index.name = 'symbol'
+            res.columns.name = 'field'
+            return res
+        
         res = self.get(symbol=symbol, start_date=snapshot_date, end_date=snapshot_date, fields=fields)
         
         res = res.stack(level='symbol', dropna=False)
@@ -1084,6 +1733,106 @@ class DataView(object):
         
         return res
 
+    def get_snapshot_arrays(self, snapshot_date, symbol="", fields=""):
+        """
+        Get snapshot of given fields and symbol at snapshot_date as raw arrays.
+        It is the fast path of get_snapshot for loops over dates, e.g. backtest.
+        
+        Parameters
+        ----------
+        snapshot_date : int
+            Trade date of snapshot.
+        symbol : str, optional
+            Separated by ',' default "" (all securities).
+        fields : str, optional
+            Separated by ',' default "" (all daily fields).
+
+        Returns
+        -------
+        symbols : np.ndarray
+        dic : dict
+            {field: np.ndarray} values of symbols. If symbol is not given,
+            they are read-only views of the stored data, which must be copied before modification.
+
+        """
+        if self._store_d is None:
+            raise ValueError("No daily data.")
+        if snapshot_date not in self._store_d.index:
+            raise KeyError("{} is not a date of this DataView.".format(snapshot_date))
+        field_list = fields.split(',') if fields else self._get_fields('daily', self.fields)
+        snapshot = self._get_snapshot_arrays(snapshot_date, symbol, field_list)
+        if snapshot is None:
+            raise ValueError("Fields {} are not all fields of this DataView.".format(field_list))
+        symbols, dic = snapshot
+        return symbols.values, dic
+    
+    def _get_snapshot_arrays(self, snapshot_date, symbol, field_list):
+        """
+        Returns
+        -------
+        tuple or None
+            (symbols, {field: np.ndarray}), None if snapshot_date is not a date of daily data,
+            any field is not in the stores, or daily and quarterly data have different symbols.
+        
+        """
+        store = self._store_d
+        if store is None or snapshot_date not in store.index:
+            return None
+        fields_d = [field for field in field_list if self._is_daily_field(field) and field in store]
+        fields_q = [field for field in field_list if field not in fields_d]
+        if fields_q:
+            store_q = self._store_q
+            if (store_q is None or not store_q.symbols.equals(store.symbols)
+                    or not all(self._is_quarter_field(field) and field in store_q for field in fields_q)):
+                return None
+        
+        symbol_list = symbol.split(',') if symbol else None
+        symbols, dic = store.snapshot(snapshot_date, fields_d, symbol_list)
+        if fields_q:
+            row = store.index.get_loc(snapshot_date)
+            cols = self._symbol_positions(store, symbol_list)
+            for field in fields_q:
+                arr = self._get_expanded(field)[row, cols]
+                if isinstance(cols, slice):
+                    arr.flags.writeable = False
+                dic[field] = arr
+        return symbols, dic
+    
+    @staticmethod
+    def _symbol_positions(store, symbol_list):
+        if symbol_list is None:
+            return slice(None)
+        pos = store.symbols.get_indexer(symbol_list)
+        if (pos < 0).any():
+            raise KeyError("symbols not in data: {}".format(list(np.asarray(symbol_list)[pos < 0])))
+        return np.sort(pos)
+    
+    def _get_expanded(self, field):
+        """
+        Quarterly field expanded to all daily dates using announcement dates, cached in self.expanded_cache.
+        
+        Returns
+        -------
+        np.ndarray
+            (n_dates x n_symbols) of quarterly data, shared by all callers, must not be modified.
+        
+        """
+        cache = self.expanded_cache
+        arr = cache.get(field)
+        if arr is not None:
+            return arr
+        
+        # row of the last announced quarter of every date and symbol, shared by all fields
+        pos = cache.get(self._EXPANDED_POSITION_KEY)
+        if pos is None:
+            ann_arr = self._store_q.frame(self.ANN_DATE_FIELD_NAME).fillna(99999999).astype(int).values
+            pos = get_position(ann_arr, np.asarray(self.dates, dtype=int))
+            cache.put(self._EXPANDED_POSITION_KEY, pos)
+        
+        arr = take_position(self._store_q.get_array(field), pos)
+        cache.put(field, arr)
+        return arr
+
     def get_ann_df(self):
         """
         Query announcement date of financial statements of all securities.
@@ -1095,14 +1844,9 @@ class DataView(object):
             If no quarterly data available, return None.
         
         """
-        if self.data_q is None:
+        if self._store_q is None:
             return None
-        df_ann = self.data_q.loc[:, pd.IndexSlice[:, self.ANN_DATE_FIELD_NAME]]
-        
-        df_ann = df_ann.copy()
-        df_ann.columns = df_ann.columns.droplevel(level='field')
-    
-        return df_ann
+        return self._store_q.frame(self.ANN_DATE_FIELD_NAME)
         
     def get_ts_quarter(self, field, symbol="", start_date=0, end_date=0):
         # TODO
@@ -1117,11 +1861,7 @@ class DataView(object):
         if not end_date:
             end_date = self.end_date
     
-        df_ref_quarterly = self.data_q.loc[:,
-                                           pd.IndexSlice[symbol, field]]
-        df_ref_quarterly.columns = df_ref_quarterly.columns.droplevel(level='field')
-        
-        return df_ref_quarterly
+        return self._store_q.frame(field, symbol)
     
     def get_ts(self, field, symbol="", start_date=0, end_date=0):
         """
@@ -1144,21 +1884,34 @@ class DataView(object):
             Index is int date, column is symbol.
 
         """
+        if self._store_d is not None and field in self._store_d and self._is_daily_field(field):
+            # single daily field is taken from the store directly, the same as self.get
+            symbol = symbol.split(',') if symbol else self.symbol
+            res = self._store_d.frame(field, symbol,
+                                      start_date=start_date or self.start_date, end_date=end_date or self.end_date)
+            res.index.name = self.TRADE_DATE_FIELD_NAME
+            if res.isnull().values.any():
+                res = res.fillna(method='ffill')
+            return res
+        
         res = self.get(symbol, start_date=start_date, end_date=end_date, fields=field)
         
         res.columns = res.columns.droplevel(level='field')
         
         return res
 
-    def save_dataview(self, folder_path=".", sub_folder=""):
+    def save_dataview(self, folder_path=".", sub_folder="", fmt='npy'):
         """
-        Save data and meta_data_to_store to a single hd5 file.
-        Store at output/sub_folder
+        Save data and meta_data_to_store to folder_path/sub_folder.
         
         Parameters
         ----------
         folder_path : str
         sub_folder : str
+        fmt : {'npy', 'hd5'}, optional
+            'npy': columnar format, daily and quarterly data are stored in sub folders data_d and data_q,
+            one .npy file per field (see PanelStore.save), which can be loaded selectively.
+            'hd5': legacy format, all data in a single hd5 file.
 
         """
         if not sub_folder:
@@ -1167,17 +1920,28 @@ class DataView(object):
         folder_path = os.path.join(folder_path, sub_folder)
         abs_folder = os.path.abspath(folder_path)
         meta_path = os.path.join(folder_path, 'meta_data.json')
-        data_path = os.path.join(folder_path, 'data.hd5')
         
-        data_to_store = {'data_d': self.data_d, 'data_q': self.data_q,
-                         'data_benchmark': self._data_benchmark,
-                         'data_group': self._data_group}
-        data_to_store = {k: v for k, v in data_to_store.items() if v is not None}
         meta_data_to_store = {key: self.__dict__[key] for key in self.meta_data_list}
+        meta_data_to_store['format'] = fmt
 
         print "\nStore data..."
+        if fmt == 'hd5':
+            data_to_store = {'data_d': self.data_d, 'data_q': self.data_q,
+                             'data_benchmark': self._data_benchmark,
+                             'data_group': self._data_group}
+            data_to_store = {k: v for k, v in data_to_store.items() if v is not None}
+            self._save_h5(os.path.join(folder_path, 'data.hd5'), data_to_store)
+        elif fmt == 'npy':
+            meta_data_to_store['format_version'] = FORMAT_VERSION
+            for name, store in [('data_d', self._store_d), ('data_q', self._store_q)]:
+                if store is not None:
+                    store.save(os.path.join(folder_path, name))
+            for name, df in [('data_benchmark', self._data_benchmark), ('data_group', self._data_group)]:
+                if df is not None:
+                    pd.to_pickle(df, os.path.join(folder_path, name + '.pkl'))
+        else:
+            raise NotImplementedError("fmt = {:s}".format(fmt))
         jaqs.util.fileio.save_json(meta_data_to_store, meta_path)
-        self._save_h5(data_path, data_to_store)
         
         print ("Dataview has been successfully saved to:\n"
                + abs_folder + "\n\n"
@@ -1216,29 +1980,108 @@ class DataView(object):
             Whether df is quarterly data (like quarterly financial statement) or daily data.
 
         """
-        if isinstance(df, pd.DataFrame):
-            pass
-        elif isinstance(df, pd.Series):
-            df = pd.DataFrame(df)
+        self._append_dfs({field_name: df}, is_quarterly=is_quarterly)
+    
+    def set_field(self, field_name, df):
+        """
+        Overwrite values of an existing field, which is the way to edit data (data_d and data_q are copies).
+        df is aligned to dates and symbols of existing data by label, missing labels become NaN.
+        Formula fields computed from this field are not recomputed.
+        
+        Parameters
+        ----------
+        field_name : str
+        df : pd.DataFrame or pd.Series
+            Index is date (report date for quarterly fields), columns are symbols.
+
+        """
+        if not isinstance(df, (pd.DataFrame, pd.Series)):
+            raise ValueError("Data to be set must be pandas format. But we have {}".format(type(df)))
+        if self._store_q is not None and field_name in self._store_q:
+            store, is_quarterly = self._store_q, True
+        elif self._store_d is not None and field_name in self._store_d:
+            store, is_quarterly = self._store_d, False
         else:
-            raise ValueError("Data to be appended must be pandas format. But we have {}".format(type(df)))
+            raise ValueError("Field [{:s}] is not in the DataView, use append_df to add it.".format(field_name))
         
+        store.set(field_name, df)
+        store.astype(field_name, self._get_field_dtype(field_name))
         if is_quarterly:
-            the_data = self.data_q
-        else:
-            the_data = self.data_d
-            
-        multi_idx = pd.MultiIndex.from_product([the_data.columns.levels[0], [field_name]])
-        df.columns = multi_idx
+            if field_name == self.ANN_DATE_FIELD_NAME:
+                self.expanded_cache.clear()
+                self._align_cache.clear()
+            self.expanded_cache.invalidate(field_name)
+    
+    def _append_dfs(self, dic_df, is_quarterly=False):
+        """
+        Add several fields to existing daily or quarterly data.
+        DataFrames are aligned to dates and symbols of existing data by label.
         
-        merge = the_data.join(df, how='left')  # left: keep index of existing data unchanged
-        merge.sort_index(axis=1, level=['symbol', 'field'], inplace=True)
+        Parameters
+        ----------
+        dic_df : dict
+            {field_name: pd.DataFrame or pd.Series}
+        is_quarterly : bool
 
-        if is_quarterly:
-            self.data_q = merge
-        else:
-            self.data_d = merge
-        self._add_field(field_name, is_quarterly)
+        """
+        store = self._store_q if is_quarterly else self._store_d
+        if store is None:
+            raise ValueError("No {} data to append to.".format('quarterly' if is_quarterly else 'daily'))
+        
+        for field_name, df in dic_df.items():
+            if not isinstance(df, (pd.DataFrame, pd.Series)):
+                raise ValueError("Data to be appended must be pandas format. But we have {}".format(type(df)))
+            store.set(field_name, df)
+            store.astype(field_name, self._get_field_dtype(field_name))
+            if is_quarterly:
+                if field_name == self.ANN_DATE_FIELD_NAME:
+                    self.expanded_cache.clear()
+                self.expanded_cache.invalidate(field_name)
+        for field_name in dic_df.keys():
+            self._add_field(field_name, is_quarterly)
+    
+    def set_dtype(self, dtype='float64', field_dtypes=None):
+        """
+        Set dtype policy of float fields and convert existing data.
+        
+        Parameters
+        ----------
+        dtype : {'float64', 'float32'}
+            dtype of float fields. Fields in self.float64_fields (dates, volume, market value, etc.) keep float64.
+        field_dtypes : dict, optional
+            {field_name: dtype} override for specific fields, including formula fields.
+
+        """
+        field_dtypes = dict(field_dtypes or {})
+        for dt in [dtype] + list(field_dtypes.values()):
+            if np.dtype(dt) not in (np.float32, np.float64):
+                raise ValueError("dtype must be float32 or float64, but we have {}".format(dt))
+        
+        self.dtype = np.dtype(dtype).name
+        self.field_dtypes = {k: np.dtype(v).name for k, v in field_dtypes.items()}
+        self._apply_dtype()
+    
+    def _get_field_dtype(self, field_name):
+        if field_name in self.field_dtypes:
+            return self.field_dtypes[field_name]
+        if field_name in self.float64_fields:
+            return 'float64'
+        return self.dtype
+    
+    @staticmethod
+    def _parser_dtype(dtype):
+        """dtype of Parser results, None means no casting."""
+        dtype = np.dtype(dtype)
+        return None if dtype == np.float64 else dtype
+    
+    def _apply_dtype(self):
+        """Cast float fields of daily and quarterly data according to dtype policy. Non-float fields are unchanged."""
+        self.expanded_cache.clear()
+        for store in [self._store_d, self._store_q]:
+            if store is None:
+                continue
+            for field in store.fields:
+                store.astype(field, self._get_field_dtype(field))
     
     def _is_quarter_field(self, field_name):
         """
@@ -0,0 +1,285 @@
+# encoding: utf-8
+"""
+Cross-sectional operations within groups (e.g. industries) on 2-D arrays (index is date, column is symbol).
+
+Group codes are factorized once into an integer (date x symbol) array. Every (date, group) pair is a segment,
+so group reductions on all dates are done in one vectorized pass with np.bincount (mean, std),
+or with a single sort by (segment, value) (rank, median).
+
+Group codes can be static (one code per symbol) or time-variant (one code per date and symbol).
+A symbol with NaN group code does not belong to any group, its results are NaN.
+
+"""
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex(object):
+    """
+    Factorized group codes.
+
+    Attributes
+    ----------
+    shape : tuple
+        (n_dates, n_symbols)
+    n_groups : int
+    codes : np.ndarray
+        (n_dates, n_symbols) group code from 0 to n_groups - 1, -1 if the group code is NaN.
+    seg : np.ndarray
+        Flattened (C order) segment id, date_index * n_groups + group_code, -1 if the group code is NaN.
+    n_seg : int
+
+    """
+    def __init__(self, codes, n_groups):
+        codes = np.asarray(codes, dtype=np.int64)
+        self.shape = codes.shape
+        self.n_groups = max(int(n_groups), 1)
+
+        n_dates = self.shape[0]
+        self.codes = codes
+        seg = codes + np.arange(n_dates, dtype=np.int64).reshape(-1, 1) * self.n_groups
+        seg[codes < 0] = -1
+        self.seg = seg.ravel()
+        self.n_seg = n_dates * self.n_groups
+
+    @classmethod
+    def from_group(cls, group, index, columns):
+        """
+        Parameters
+        ----------
+        group : pd.DataFrame or pd.Series
+            DataFrame is time-variant group codes (index is date, column is symbol),
+            DataFrame with only one row / column, or Series (index is symbol), is static group codes.
+        index : pd.Index
+            Dates of the values to be grouped.
+        columns : pd.Index
+            Symbols of the values to be grouped.
+
+        """
+        if isinstance(group, pd.DataFrame) and (group.shape[0] == 1 or group.shape[1] == 1):
+            group = group.squeeze()
+            if not isinstance(group, pd.Series):
+                group = pd.Series([group], index=columns)  # 1 x 1 DataFrame
+
+        if isinstance(group, pd.Series):
+            group = group.reindex(columns)
+            codes, uniques = pd.factorize(group.values)
+            codes = np.tile(codes, (len(index), 1))
+        elif isinstance(group, pd.DataFrame):
+            if not (group.index.equals(index) and group.columns.equals(columns)):
+                group = group.reindex(index=index, columns=columns)
+            codes, uniques = pd.factorize(group.values.ravel())
+            codes = codes.reshape(group.shape)
+        else:
+            raise NotImplementedError("type of df_group{}".format(type(group)))
+        return cls(codes, len(uniques))
+
+    def _valid(self, values):
+        return (self.seg >= 0) & ~np.isnan(values)
+
+    def sorted_order(self, values):
+        """
+        Positions of valid (flattened) values sorted by (segment, value).
+        Each date is sorted separately (by value, then stably by group code),
+        which is much faster than sorting all dates as one array.
+
+        """
+        n_dates, n_symbols = self.shape
+        valid = self._valid(values).reshape(self.shape)
+        row_offset = np.arange(n_dates, dtype=np.int64).reshape(-1, 1) * n_symbols
+
+        # invalid values go to the end of each date
+        by_value = np.argsort(np.where(valid, values.reshape(self.shape), np.inf), axis=1)
+        by_value += row_offset
+        if self.n_groups == 1:
+            order = by_value.ravel()
+            return order[valid.ravel()[order]]
+        code = np.where(valid, self.codes, self.n_groups).ravel()[by_value]
+        by_code = np.argsort(code, axis=1, kind='mergesort')
+        by_code += row_offset
+        order = by_value.ravel()[by_code.ravel()]
+        return order[valid.ravel()[order]]
+
+
+def _flat(values, gi):
+    arr = np.asarray(values, dtype=np.float64)
+    if arr.shape != gi.shape:
+        raise ValueError("shape of values {} and group {} do not match".format(arr.shape, gi.shape))
+    return arr.ravel()
+
+
+def _broadcast(seg_values, gi):
+    """Broadcast value of each segment back to (date x symbol), NaN for symbols without group."""
+    res = np.empty(gi.seg.shape, dtype=np.float64)
+    res.fill(np.nan)
+    has_group = gi.seg >= 0
+    res[has_group] = seg_values[gi.seg[has_group]]
+    return res.reshape(gi.shape)
+
+
+def _seg_count_sum(flat, gi):
+    valid = gi._valid(flat)
+    seg = gi.seg[valid]
+    count = np.bincount(seg, minlength=gi.n_seg).astype(np.float64)
+    total = np.bincount(seg, weights=flat[valid], minlength=gi.n_seg)
+    return count, total
+
+
+def _seg_mean(flat, gi):
+    count, total = _seg_count_sum(flat, gi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return total / count
+
+
+def _seg_std(flat, gi, ddof=1):
+    count, total = _seg_count_sum(flat, gi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        valid = gi._valid(flat)
+        dev = flat[valid] - mean[gi.seg[valid]]
+        ss = np.bincount(gi.seg[valid], weights=dev * dev, minlength=gi.n_seg)
+        var = ss / (count - ddof)
+    var[count <= ddof] = np.nan
+    return mean, np.sqrt(var)
+
+
+def group_mean(values, gi):
+    """Mean of non-NaN values in each group of each date, broadcast back to every symbol of the group."""
+    flat = _flat(values, gi)
+    return _broadcast(_seg_mean(flat, gi), gi)
+
+
+def group_std(values, gi, ddof=1):
+    """Standard deviation of non-NaN values in each group of each date, broadcast back."""
+    flat = _flat(values, gi)
+    mean, std = _seg_std(flat, gi, ddof=ddof)
+    return _broadcast(std, gi)
+
+
+def group_demean(values, gi):
+    flat = _flat(values, gi)
+    return (flat - _broadcast(_seg_mean(flat, gi), gi).ravel()).reshape(gi.shape)
+
+
+def group_standardize(values, gi):
+    """(x - mean) / std in each group, the same as Parser.standardize applied in each group."""
+    flat = _flat(values, gi)
+    mean, std = _seg_std(flat, gi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = (flat - _broadcast(mean, gi).ravel()) / _broadcast(std, gi).ravel()
+    return res.reshape(gi.shape)
+
+
+def group_rank(values, gi):
+    """
+    Rank (start from 1) of each value in its group of each date. Ties get the average rank, NaN stays NaN.
+    The same as DataFrame.rank(axis=1) applied in each group.
+
+    """
+    flat = _flat(values, gi)
+    order = gi.sorted_order(flat)
+    res = np.empty(flat.shape, dtype=np.float64)
+    res.fill(np.nan)
+    n = len(order)
+    if n == 0:
+        return res.reshape(gi.shape)
+
+    seg_sorted = gi.seg[order]
+    val_sorted = flat[order]
+    pos = np.arange(n, dtype=np.float64)
+
+    # first position of each segment
+    seg_start = np.r_[True, seg_sorted[1:] != seg_sorted[:-1]]
+    start_pos = np.maximum.accumulate(np.where(seg_start, pos, 0.0))
+
+    # runs of ties: average of first and last rank in the run
+    run_start = seg_start | np.r_[True, val_sorted[1:] != val_sorted[:-1]]
+    run_id = np.cumsum(run_start) - 1
+    run_first = pos[run_start]
+    run_last = np.r_[run_first[1:] - 1, n - 1]
+    avg_pos = (run_first + run_last) / 2.0
+
+    res[order] = avg_pos[run_id] - start_pos + 1
+    return res.reshape(gi.shape)
+
+
+def _seg_median(flat, gi):
+    """Median of each segment, NaN if there is any NaN in the segment (the same as np.median)."""
+    order = gi.sorted_order(flat)
+    count = np.bincount(gi.seg[order], minlength=gi.n_seg)
+    start = np.r_[0, np.cumsum(count)[:-1]]
+
+    res = np.empty(gi.n_seg, dtype=np.float64)
+    res.fill(np.nan)
+    ok = count > 0
+    lo = order[start[ok] + (count[ok] - 1) // 2]
+    hi = order[start[ok] + count[ok] // 2]
+    res[ok] = (flat[lo] + flat[hi]) / 2.0
+
+    has_nan = (gi.seg >= 0) & np.isnan(flat)
+    res[np.bincount(gi.seg[has_nan], minlength=gi.n_seg) > 0] = np.nan
+    return res
+
+
+def group_cutoff(values, gi, z_score=3.0):
+    """
+    Cut off extreme values using Median Absolute Deviation in each group,
+    the same as Parser.cutoff applied in each group: x is moved to median +- z_score * MAD if it is beyond.
+    As np.median, nothing is cut in a group of a date which has NaN.
+
+    """
+    flat = _flat(values, gi)
+    median = _broadcast(_seg_median(flat, gi), gi).ravel()
+    diff = flat - median
+    diff_abs = np.abs(diff)
+    mad = _broadcast(_seg_median(diff_abs, gi), gi).ravel()
+
+    res = flat.copy()
+    with np.errstate(invalid='ignore'):
+        mask = diff_abs > z_score * mad
+    res[mask] = z_score * mad[mask] * np.sign(diff[mask]) + median[mask]
+    res[gi.seg < 0] = np.nan
+    return res.reshape(gi.shape)
+
+
+def group_neutralize(values, gi, exog=None):
+    """
+    Residual of cross-sectional least-squares regression of values on group dummies (and exog), for each date.
+
+    Regression on one-hot group dummies only is the same as demeaning in each group.
+    With exog (e.g. log market value), by Frisch-Waugh-Lovell theorem, both values and exog are demeaned in each group,
+    then the slope of each date is sum(x * z) / sum(z * z) of the demeaned ones.
+    So all dates are solved at once without building the dummy matrices.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (n_dates, n_symbols)
+    gi : GroupIndex
+    exog : np.ndarray or None
+        (n_dates, n_symbols) the other regressor.
+
+    Returns
+    -------
+    np.ndarray
+        NaN if values (or exog) is NaN or symbol has no group.
+
+    """
+    flat = _flat(values, gi)
+    if exog is None:
+        return group_demean(flat.reshape(gi.shape), gi)
+
+    z = _flat(exog, gi)
+    both = ~np.isnan(flat) & ~np.isnan(z)
+    x = np.where(both, flat, np.nan)
+    z = np.where(both, z, np.nan)
+    x_dm = group_demean(x.reshape(gi.shape), gi)
+    z_dm = group_demean(z.reshape(gi.shape), gi)
+
+    valid = ~np.isnan(x_dm)
+    xz = np.where(valid, x_dm * z_dm, 0.0).sum(axis=1)
+    zz = np.where(valid, z_dm * z_dm, 0.0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = xz / zz
+    beta[zz == 0] = 0.0  # exog is constant in every group, no more to remove
+    return x_dm - beta.reshape(-1, 1) * z_dm
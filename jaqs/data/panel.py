@@ -0,0 +1,385 @@
+# encoding: utf-8
+"""
+Storage of DataView data: one contiguous (n_dates x n_symbols) array per field on a shared date and symbol index.
+
+Getting or appending a field is a dict operation, while the legacy wide DataFrame
+(index is date, columns is symbol-field MultiIndex) is only built when it is asked for.
+
+On disk, a store is a directory with one .npy file per field, the date index, the symbol index
+and panel.json, see PanelStore.save. Fields can be loaded selectively and memory-mapped.
+
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import jaqs.util.fileio
+
+# version of the directory format written by PanelStore.save
+FORMAT_VERSION = 1
+
+
+class PanelStore(object):
+    """
+    Fields on a (dates x symbols) grid.
+
+    Attributes
+    ----------
+    index : pd.Index
+        Sorted dates.
+    symbols : pd.Index
+        Sorted symbols.
+
+    """
+    def __init__(self, index, symbols):
+        self.index = pd.Index(index)
+        self.symbols = pd.Index(symbols)
+        self._arrays = dict()
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Parameters
+        ----------
+        df : pd.DataFrame
+            index is date, columns is symbol-field MultiIndex.
+
+        """
+        df = df.sort_index(axis=1, level=[0, 1])
+        symbols = df.columns.get_level_values(0).unique()
+        store = cls(df.index, symbols)
+        for field in df.columns.get_level_values(1).unique():
+            df_field = df.xs(field, axis=1, level=1)
+            if not df_field.columns.equals(symbols):
+                df_field = df_field.reindex(columns=symbols)
+            store._arrays[field] = np.ascontiguousarray(df_field.values)
+        return store
+
+    @property
+    def fields(self):
+        return sorted(self._arrays.keys())
+
+    @property
+    def shape(self):
+        return len(self.index), len(self.symbols)
+
+    def __contains__(self, field):
+        return field in self._arrays
+
+    def get_array(self, field):
+        """The stored array of field, do not modify it."""
+        return self._arrays[field]
+
+    def set(self, field, data):
+        """
+        Add or replace a field.
+
+        Parameters
+        ----------
+        field : str
+        data : pd.DataFrame or pd.Series or np.ndarray
+            DataFrame (index is date, column is symbol, or symbol-field MultiIndex) is aligned to the grid by label,
+            dates or symbols not in the grid are dropped and missing ones are NaN.
+            ndarray must have the shape of the grid.
+
+        """
+        if isinstance(data, pd.Series):
+            data = pd.DataFrame(data)
+        if isinstance(data, pd.DataFrame):
+            if isinstance(data.columns, pd.MultiIndex):
+                data = data.copy(deep=False)  # do not modify columns of caller's DataFrame
+                data.columns = data.columns.get_level_values(0)
+            if not (data.index.equals(self.index) and data.columns.equals(self.symbols)):
+                data = data.reindex(index=self.index, columns=self.symbols)
+            arr = data.values
+        elif isinstance(data, np.ndarray):
+            arr = data
+        else:
+            raise ValueError("Data to be appended must be pandas format. But we have {}".format(type(data)))
+
+        if arr.shape != self.shape:
+            raise ValueError("shape of data {} and store {} do not match".format(arr.shape, self.shape))
+        self._arrays[field] = np.ascontiguousarray(arr)
+
+    def drop(self, field):
+        del self._arrays[field]
+
+    def _rows(self, start_date=None, end_date=None):
+        if start_date is None and end_date is None:
+            return slice(None)
+        return self.index.slice_indexer(start_date, end_date)
+
+    def _columns(self, symbols=None):
+        """Positions of symbols in the grid, in the order of the grid."""
+        if symbols is None:
+            return slice(None)
+        pos = self.symbols.get_indexer(symbols)
+        if (pos < 0).any():
+            raise KeyError("symbols not in data: {}".format(list(np.asarray(symbols)[pos < 0])))
+        return np.sort(pos)
+
+    def frame(self, field, symbols=None, start_date=None, end_date=None):
+        """
+        Data of a single field.
+
+        Parameters
+        ----------
+        field : str
+        symbols : list of str, optional
+            Default all symbols.
+        start_date, end_date : int, optional
+            Dates range (both included), default all dates.
+
+        Returns
+        -------
+        pd.DataFrame
+            A copy. Index is date, column is symbol.
+
+        """
+        rows, cols = self._rows(start_date, end_date), self._columns(symbols)
+        arr = self._arrays[field][rows]
+        if not isinstance(cols, slice):
+            arr = arr[:, cols]
+        df = pd.DataFrame(arr.copy(), index=self.index[rows], columns=self.symbols[cols])
+        df.columns.name = 'symbol'
+        return df
+
+    def snapshot(self, date, fields, symbols=None):
+        """
+        Values of fields at a single date, without building any DataFrame.
+
+        Parameters
+        ----------
+        date : int
+        fields : list of str
+        symbols : list of str, optional
+            Default all symbols.
+
+        Returns
+        -------
+        symbols : pd.Index
+        dic : dict
+            {field: 1-D np.ndarray}. If symbols is None, arrays are read-only views of the stored rows.
+
+        """
+        row = self.index.get_loc(date)
+        cols = self._columns(symbols)
+        dic = dict()
+        for field in fields:
+            arr = self._arrays[field][row]
+            if isinstance(cols, slice):
+                arr = arr.view()
+                arr.flags.writeable = False
+            else:
+                arr = arr[cols]
+            dic[field] = arr
+        return self.symbols[cols], dic
+
+    def to_frame(self, fields=None, symbols=None, start_date=None, end_date=None):
+        """
+        Build wide DataFrame of fields.
+
+        Returns
+        -------
+        pd.DataFrame
+            A copy. Index is date, columns is symbol-field MultiIndex sorted by symbol and field.
+
+        """
+        if fields is None:
+            fields = self.fields
+        fields = sorted(fields)
+        rows, cols = self._rows(start_date, end_date), self._columns(symbols)
+        index = self.index[rows]
+        columns = self.symbols[cols]
+        df_list = []
+        for field in fields:
+            arr = self._arrays[field][rows]
+            if not isinstance(cols, slice):
+                arr = arr[:, cols]
+            df_list.append(pd.DataFrame(arr, index=index, columns=columns))
+        if df_list:
+            res = pd.concat(df_list, axis=1, keys=fields)
+            res = res.swaplevel(0, 1, axis=1)
+        else:
+            res = pd.DataFrame(index=index, columns=pd.MultiIndex.from_product([columns, []]))
+        res.columns.names = ['symbol', 'field']
+        res = res.sort_index(axis=1, level=['symbol', 'field'])
+        res.index.name = self.index.name
+        return res
+
+    def select(self, fields=None, symbols=None, start_date=None, end_date=None):
+        """
+        New store of a part of this one. Arrays are views if all symbols are selected.
+
+        Parameters
+        ----------
+        fields : list of str, optional
+            Default all fields.
+        symbols : list of str, optional
+            Default all symbols.
+        start_date, end_date : int, optional
+            Dates range (both included), default all dates.
+
+        Returns
+        -------
+        PanelStore
+
+        """
+        rows, cols = self._rows(start_date, end_date), self._columns(symbols)
+        store = PanelStore(self.index[rows], self.symbols[cols])
+        for field in (self.fields if fields is None else fields):
+            arr = self._arrays[field][rows]
+            store._arrays[field] = arr if isinstance(cols, slice) else arr[:, cols]
+        return store
+
+    def reindex(self, index=None, symbols=None):
+        """
+        New store on another grid. Values at new dates or symbols are NaN.
+
+        Parameters
+        ----------
+        index : array-like, optional
+            Dates, default dates of this store.
+        symbols : array-like, optional
+            Symbols, default symbols of this store.
+
+        Returns
+        -------
+        PanelStore
+
+        """
+        index = self.index if index is None else pd.Index(index, name=self.index.name)
+        symbols = self.symbols if symbols is None else pd.Index(symbols)
+        store = PanelStore(index, symbols)
+        for field, arr in self._arrays.items():
+            df = pd.DataFrame(arr, index=self.index, columns=self.symbols).reindex(index=index, columns=symbols)
+            store._arrays[field] = np.ascontiguousarray(df.values)
+        return store
+
+    def update(self, other):
+        """
+        Write all values of other into this store at its dates and symbols.
+        Fields not in this store are added, their values are NaN elsewhere.
+
+        Parameters
+        ----------
+        other : PanelStore
+            Its dates and symbols must be in the grid of this store.
+
+        """
+        rows = self.index.get_indexer(other.index)
+        cols = self.symbols.get_indexer(other.symbols)
+        if (rows < 0).any() or (cols < 0).any():
+            raise KeyError("dates or symbols of other are not in the store")
+        grid = np.ix_(rows, cols)
+        for field in other.fields:
+            src = other._arrays[field]
+            if field in self._arrays:
+                arr = self._arrays[field]
+                dtype = np.result_type(arr.dtype, src.dtype)
+                if dtype != arr.dtype or not arr.flags.writeable:
+                    arr = arr.astype(dtype)  # memory-mapped arrays are read-only
+            else:
+                dtype = src.dtype if src.dtype.kind in 'fO' else np.result_type(src.dtype, np.float64)
+                arr = np.full(self.shape, np.nan, dtype=dtype)
+            arr[grid] = src
+            self._arrays[field] = arr
+
+    def save(self, folder):
+        """
+        Save to folder: index.npy, symbols.npy, panel.json and one .npy file per field.
+        Files are replaced by rename, so a store memory-mapped from the same folder is not affected.
+
+        Parameters
+        ----------
+        folder : str
+
+        """
+        files = dict()
+        pickled = []
+        for i, field in enumerate(self.fields):
+            # name of field may not be a valid file name
+            fn = field if re.match(r'^\w+$', field) else 'field_{:d}'.format(i)
+            files[field] = fn + '.npy'
+            arr = self._arrays[field]
+            if arr.dtype.kind == 'O':
+                pickled.append(field)
+            _save_array(os.path.join(folder, files[field]), arr)
+        _save_array(os.path.join(folder, 'index.npy'), np.asarray(self.index.values))
+        _save_array(os.path.join(folder, 'symbols.npy'), np.array(list(self.symbols)))
+
+        info = {'format_version': FORMAT_VERSION,
+                'index_name': self.index.name,
+                'shape': list(self.shape),
+                'files': files,
+                'pickled': pickled}
+        jaqs.util.fileio.save_json(info, os.path.join(folder, 'panel.json'))
+
+    @classmethod
+    def load(cls, folder, fields=None, symbols=None, start_date=None, end_date=None, mmap=True):
+        """
+        Load a store saved by save. Only files of the given fields are read.
+
+        Parameters
+        ----------
+        folder : str
+        fields : list of str, optional
+            Default all fields.
+        symbols : list of str, optional
+            Default all symbols.
+        start_date, end_date : int, optional
+            Dates range (both included), default all dates.
+        mmap : bool
+            If True, arrays are read-only memory-mapped files (except non-numeric ones),
+            only pages of selected dates are read when accessed.
+
+        Returns
+        -------
+        PanelStore
+
+        """
+        info = jaqs.util.fileio.read_json(os.path.join(folder, 'panel.json'))
+        if info is None:
+            raise IOError("No panel.json in {:s}".format(folder))
+        if info['format_version'] > FORMAT_VERSION:
+            raise ValueError("Format version {} is newer than supported version {}.".format(info['format_version'],
+                                                                                        FORMAT_VERSION))
+
+        whole = cls(np.load(os.path.join(folder, 'index.npy')),
+                    np.load(os.path.join(folder, 'symbols.npy')).tolist())
+        rows, cols = whole._rows(start_date, end_date), whole._columns(symbols)
+        index = whole.index[rows]
+        index.name = info['index_name']
+        store = cls(index, whole.symbols[cols])
+
+        files = info['files']
+        if fields is None:
+            fields = sorted(files.keys())
+        missing = [field for field in fields if field not in files]
+        if missing:
+            raise KeyError("fields not in data: {}".format(missing))
+        for field in fields:
+            pickled = field in info['pickled']
+            arr = np.load(os.path.join(folder, files[field]),
+                          mmap_mode='r' if mmap and not pickled else None, allow_pickle=pickled)
+            arr = arr[rows]
+            store._arrays[field] = arr if isinstance(cols, slice) else arr[:, cols]
+        return store
+
+    def astype(self, field, dtype):
+        """Change dtype of a float field."""
+        arr = self._arrays[field]
+        if arr.dtype.kind == 'f' and arr.dtype != dtype:
+            self._arrays[field] = arr.astype(dtype)
+
+
+def _save_array(path, arr):
+    jaqs.util.fileio.create_dir(path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, arr)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
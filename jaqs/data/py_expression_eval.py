@@ -15,12 +15,24 @@
 
 from __future__ import division
 
+import copy
 import math
+import os
+import time
+import threading
+import warnings
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from multiprocessing import sharedctypes
 
 import numpy as np
 import pandas as pd
 
-from jaqs.data.align import align
+from jaqs.data.align import align, AlignCache
+from jaqs.data import rolling
+from jaqs.data import group_ops
+from jaqs.data import array_backend
 
 TNUMBER = 0
 TOP1 = 1
@@ -28,6 +40,13 @@ TOP2 = 2
 TVAR = 3
 TFUNCALL = 4
 
+# process-wide LRU cache of parsed formulas, {(formula, function name style): (tokens, plan)}
+PARSE_CACHE_SIZE = 4096
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+# {style: Parser}, see get_parser
+_shared_parsers = dict()
+
 
 class Expression(object):
     
@@ -38,6 +57,16 @@ class Expression(object):
         self.functions = functions
         self.ann_dts = None
         self.trade_dts = None
+        self._plan = None
+    
+    @property
+    def plan(self):
+        """Compiled plan of this expression. See Plan."""
+        if self._plan is None:
+            builder = PlanBuilder(self.ops1, self.ops2)
+            root = builder.add_tokens(self.tokens)
+            self._plan = Plan([root])
+        return self._plan
     
     def simplify(self, values):
         values = values or {}
@@ -68,7 +97,7 @@ class Expression(object):
                     newexpression.append(nstack.pop(0))
                 newexpression.append(item)
         while nstack:
-            newexpression.add(nstack.pop(0))
+            newexpression.append(nstack.pop(0))
         
         return Expression(newexpression, self.ops1, self.ops2, self.functions)
     
@@ -203,6 +232,300 @@ class Token(object):
             return 'Invalid Token'
 
 
+# kinds of nodes in a compiled plan
+NCONST = 'const'
+NVAR = 'var'
+NOP1 = 'op1'
+NOP2 = 'op2'
+NCALL = 'call'
+
+
+# Lookback (number of previous rows needed) of time series functions, keyed by name of the Parser method.
+# Value is a function of the constant arguments of the call. Lookback of a call is its own lookback
+# plus the max lookback of its arguments. Cross section and element-wise functions need no lookback.
+def _window_arg(pos):
+    return lambda args: int(args[pos]) - 1
+
+
+def _shift_arg(pos, default=None):
+    return lambda args: int(args[pos]) if len(args) > pos else default
+
+
+LOOKBACK_FUNCS = {
+    'delay': _shift_arg(1),
+    'delta': _shift_arg(1),
+    'calc_return': _shift_arg(1, default=1),
+    'sum': _window_arg(1),
+    'product': _window_arg(1),
+    'count_nans': _window_arg(1),
+    'std_dev': _window_arg(1),
+    'ts_mean': _window_arg(1),
+    'ts_min': _window_arg(1),
+    'ts_max': _window_arg(1),
+    'ts_skew': _window_arg(1),
+    'ts_kurt': _window_arg(1),
+    'ts_rank': _window_arg(1),
+    'ts_argmax': _window_arg(1),
+    'ts_argmin': _window_arg(1),
+    'ts_median': _window_arg(1),
+    'ts_quantile': _window_arg(1),
+    'decay_linear': _window_arg(1),
+    'corr': _window_arg(2),
+    'cov': _window_arg(2),
+    'decay_exp': _window_arg(2),
+}
+
+# Result depends on all history (exponential weights, or position from the first row).
+UNBOUNDED_FUNCS = {'ewma', 'sma', 'step'}
+
+ZERO_LOOKBACK_FUNCS = {
+    'rank', 'group_rank', 'cond_rank', 'standardize', 'cutoff', 'group_apply',
+    'industry_neutral', 'industry_mkt_cap_neutral', 'signed_power', 'tail', 'ifFunction',
+    'minimum', 'maximum', 'power',
+}
+
+UNBOUNDED = None
+
+# Functions operating on each date across symbols. Other known functions work on each symbol separately.
+CROSS_SECTION_FUNCS = {
+    'rank', 'group_rank', 'cond_rank', 'standardize', 'cutoff', 'group_apply',
+    'industry_neutral', 'industry_mkt_cap_neutral',
+}
+
+# kinds of plans
+PLAN_TS = 'ts'  # only time series and element-wise operations: symbols are independent
+PLAN_CS = 'cs'  # only cross section and element-wise operations: dates are independent
+PLAN_MIXED = 'mixed'
+
+# frequency of a node, quarterly data is expanded to daily (trade dates) when it meets daily data
+FREQ_DAILY = 'd'
+FREQ_QUARTERLY = 'q'
+# functions which expand quarterly argument when the other argument is daily (Parser._align_bivariate)
+ALIGN_BIVARIATE_FUNCS = {
+    'add', 'sub', 'mul', 'div', 'mod', 'pyt', 'corr', 'cov',
+    'equal', 'notEqual', 'greaterThan', 'lessThan', 'greaterThanEqual', 'lessThanEqual',
+    'andOperator', 'orOperator',
+}
+# functions which always expand quarterly arguments at these positions (Parser._align_univariate)
+ALIGN_UNIVARIATE_FUNCS = {
+    'rank': (0,),
+    'cond_rank': (0,),
+    'group_rank': (0,),
+    'group_apply': (1,),
+    'industry_neutral': (0, 2),
+    'industry_mkt_cap_neutral': (0, 1),
+}
+
+
+class Node(object):
+    """
+    A node of a compiled expression DAG.
+    Nodes are hash-consed by PlanBuilder: structurally equal sub-expressions share one Node.
+    
+    Attributes
+    ----------
+    kind : {'const', 'var', 'op1', 'op2', 'call'}
+    name : str
+        Operator, function or variable name. None for constants.
+    children : tuple of Node
+        Operands / arguments.
+    value : object
+        Value of a constant node.
+    index : int
+        Creation order in the builder, which is also a topological order.
+
+    """
+    __slots__ = ('kind', 'name', 'children', 'value', 'index', '_expr')
+    
+    def __init__(self, kind, name, children=(), value=None, index=0):
+        self.kind = kind
+        self.name = name
+        self.children = tuple(children)
+        self.value = value
+        self.index = index
+        self._expr = None
+    
+    @property
+    def expr(self):
+        """Formula-like string of the sub-expression rooted at this node."""
+        if self._expr is None:
+            if self.kind == NCONST:
+                self._expr = repr(self.value)
+            elif self.kind == NVAR:
+                self._expr = self.name
+            elif self.kind == NOP2:
+                self._expr = '({}{}{})'.format(self.children[0].expr, self.name, self.children[1].expr)
+            elif self.kind == NOP1 and self.name == '-':
+                self._expr = '(-{})'.format(self.children[0].expr)
+            else:
+                self._expr = '{}({})'.format(self.name, ', '.join(child.expr for child in self.children))
+        return self._expr
+    
+    def __repr__(self):
+        return 'Node({:s})'.format(self.expr)
+
+
+class _Args(tuple):
+    """Argument list of a function call, built by the ',' operator."""
+    pass
+
+
+class PlanBuilder(object):
+    """
+    Convert RPN tokens into a DAG of Node.
+    
+    Structurally equal sub-expressions are merged (hash-consing), so a repeated term like Delay(close, 1)
+    is computed only once. Unary / binary operators whose operands are all constants are folded.
+    Several token lists can be added to one builder, they will then share common sub-expressions.
+    
+    """
+    def __init__(self, ops1, ops2):
+        self.ops1 = ops1
+        self.ops2 = ops2
+        self.nodes = []
+        self._table = dict()
+    
+    def _intern(self, kind, name, children=(), value=None):
+        if kind == NCONST:
+            key = (kind, type(value), value)
+        else:
+            key = (kind, name, tuple(child.index for child in children))
+        
+        node = self._table.get(key, None)
+        if node is None:
+            node = Node(kind, name, children, value, index=len(self.nodes))
+            self.nodes.append(node)
+            self._table[key] = node
+        return node
+    
+    def const(self, value):
+        return self._intern(NCONST, None, value=value)
+    
+    def _operator(self, kind, name, children):
+        for child in children:
+            if isinstance(child, _Args):
+                raise Exception('invalid Expression')
+        
+        if all(child.kind == NCONST for child in children):
+            f = self.ops1[name] if kind == NOP1 else self.ops2[name]
+            try:
+                value = f(*[child.value for child in children])
+            except Exception:
+                value = None  # leave it to evaluation, which will raise the same error
+            if isinstance(value, (int, long, float, bool, np.number, np.bool_)):
+                return self.const(value)
+        
+        return self._intern(kind, name, children)
+    
+    def add_tokens(self, tokens, bindings=None):
+        """
+        Add an expression to the DAG.
+        
+        Parameters
+        ----------
+        tokens : list of Token
+            RPN tokens returned by Parser.parse.
+        bindings : dict, optional
+            {variable name: Node}. Variables in bindings will be replaced by the given nodes.
+
+        Returns
+        -------
+        Node
+            Root node of the expression.
+
+        """
+        bindings = bindings or {}
+        nstack = []
+        for item in tokens:
+            type_ = item.type_
+            if type_ == TNUMBER:
+                if isinstance(item.number_, list):  # argument list of a nullary call
+                    nstack.append(_Args(item.number_))
+                else:
+                    nstack.append(self.const(item.number_))
+            elif type_ == TVAR:
+                if item.index_ in bindings:
+                    nstack.append(bindings[item.index_])
+                else:
+                    nstack.append(self._intern(NVAR, item.index_))
+            elif type_ == TOP1:
+                n1 = nstack.pop()
+                nstack.append(self._operator(NOP1, item.index_, (n1,)))
+            elif type_ == TOP2:
+                n2 = nstack.pop()
+                n1 = nstack.pop()
+                if item.index_ == ',':
+                    args = n1 if isinstance(n1, _Args) else (n1,)
+                    nstack.append(_Args(args + (n2,)))
+                else:
+                    nstack.append(self._operator(NOP2, item.index_, (n1, n2)))
+            elif type_ == TFUNCALL:
+                n1 = nstack.pop()
+                f = nstack.pop()
+                if isinstance(f, _Args) or f.kind != NVAR:
+                    raise Exception('invalid Expression')
+                args = n1 if isinstance(n1, _Args) else (n1,)
+                nstack.append(self._intern(NCALL, f.name, args))
+            else:
+                raise Exception('invalid Expression')
+        if len(nstack) != 1 or isinstance(nstack[0], _Args):
+            raise Exception('invalid Expression (parity)')
+        return nstack[0]
+
+
+class Plan(object):
+    """
+    Compiled, reusable evaluation plan of one or more expressions.
+    
+    Attributes
+    ----------
+    nodes : tuple of Node
+        All nodes reachable from outputs, in topological order. Each node is evaluated once.
+    children : tuple of tuple of int
+        Positions (in nodes) of the operands of each node.
+    outputs : tuple of Node
+    output_pos : tuple of int
+        Positions (in nodes) of outputs.
+
+    """
+    def __init__(self, outputs):
+        self.outputs = tuple(outputs)
+        
+        reachable = dict()
+        to_visit = list(self.outputs)
+        while to_visit:
+            node = to_visit.pop()
+            if node.index in reachable:
+                continue
+            reachable[node.index] = node
+            to_visit.extend(node.children)
+        
+        self.nodes = tuple(reachable[idx] for idx in sorted(reachable.keys()))
+        pos_map = {node.index: i for i, node in enumerate(self.nodes)}
+        self.children = tuple(tuple(pos_map[child.index] for child in node.children) for node in self.nodes)
+        self.output_pos = tuple(pos_map[node.index] for node in self.outputs)
+    
+    @property
+    def root(self):
+        return self.outputs[0]
+    
+    def levels(self):
+        """Positions of nodes grouped by depth. Nodes of the same depth do not depend on each other."""
+        depth = [0] * len(self.nodes)
+        for i, children in enumerate(self.children):
+            if children:
+                depth[i] = max(depth[j] for j in children) + 1
+        res = [[] for _ in range(max(depth or [0]) + 1)]
+        for i, d in enumerate(depth):
+            res[d].append(i)
+        return res
+    
+    def variables(self, functions=None):
+        """Names of variables used by the plan, excluding function names."""
+        functions = functions or {}
+        return [node.name for node in self.nodes if node.kind == NVAR and node.name not in functions]
+
+
 class Parser(object):
     def __init__(self):
         self.success = False
@@ -212,6 +535,7 @@ class Parser(object):
         self.pos = 0
         
         self.tokens = None
+        self.plan = None
         self.tokennumber = 0
         self.tokenprio = 0
         self.tokenindex = 0
@@ -279,6 +603,8 @@ class Parser(object):
             'Standardize': self.standardize,
             'Cutoff': self.cutoff,
             'GroupApply': self.group_apply,
+            'IndustryNeutral': self.industry_neutral,
+            'IndustryMktCapNeutral': self.industry_mkt_cap_neutral,
             # time series
             'Ewma': self.ewma,
             'Sma':self.sma,
@@ -297,6 +623,11 @@ class Parser(object):
             'Ts_Max': self.ts_max,
             'Ts_Skewness': self.ts_skew,
             'Ts_Kurtosis': self.ts_kurt,
+            'Ts_Rank': self.ts_rank,
+            'Ts_ArgMax': self.ts_argmax,
+            'Ts_ArgMin': self.ts_argmin,
+            'Ts_Median': self.ts_median,
+            'Ts_Quantile': self.ts_quantile,
             'Tail': self.tail,
             'Step': self.step,
             'Decay_linear': self.decay_linear,
@@ -343,6 +674,29 @@ class Parser(object):
         self.ann_dts = None
         self.trade_dts = None
         self.df_group = None
+        self._group_index = None
+        
+        # expanded quarterly variables, can be shared by parsers using the same data
+        self.align_cache = AlignCache()
+        # {node position: expanded result} of the current evaluation
+        self._expanded = dict()
+        self._expand_args = dict()
+        
+        # function name style, see set_capital
+        self.style = 'upper'
+        
+        # if not None (e.g. np.float32), float result of every node is stored in this dtype.
+        # Kernels still accumulate in float64.
+        self.dtype = None
+        
+        # if True, every evaluation records time, shapes, memory and NaN ratio of each node, see get_profile
+        self.profile = False
+        self.last_profile = None
+        
+        # number of workers used by evaluate: process pool for time series plans, threads for others
+        self.n_workers = 1
+        # 'numpy': evaluate single-frequency plans on raw arrays (see array_backend), 'pandas': on DataFrames
+        self.backend = 'pandas'
     
     # -----------------------------------------------------
     # functions
@@ -502,22 +856,39 @@ class Parser(object):
         r = df.ewm(com=a, axis=0)
         return r.mean()
     
+    @staticmethod
+    def _rolling(func, x, *args):
+        """Apply a 2-D kernel of jaqs.data.rolling on DataFrame x and wrap the result with the same index and columns."""
+        if isinstance(x, pd.DataFrame):
+            return pd.DataFrame(func(x.values, *args), index=x.index, columns=x.columns)
+        elif isinstance(x, pd.Series):
+            return pd.Series(func(x.values, *args).ravel(), index=x.index, name=x.name)
+        return func(x, *args)
+
+    @staticmethod
+    def _rolling_bivariate(func, x, y, *args):
+        if isinstance(x, pd.DataFrame) and isinstance(y, pd.DataFrame):
+            # same as pandas: union of index and columns, NaN of one side is propagated to the other
+            x, y = x + 0 * y, y + 0 * x
+            return pd.DataFrame(func(x.values, y.values, *args), index=x.index, columns=x.columns)
+        return func(x, y, *args)
+
     def corr(self, x, y, n):
         (x, y) = self._align_bivariate(x, y)
-        return pd.rolling_corr(x, y, n)
+        return self._rolling_bivariate(rolling.rolling_corr, x, y, n)
     
     def cov(self, x, y, n):
         (x, y) = self._align_bivariate(x, y)
-        return pd.rolling_cov(x, y, n)
+        return self._rolling_bivariate(rolling.rolling_cov, x, y, n)
     
     def std_dev(self, x, n):
-        return pd.rolling_std(x, n)
+        return self._rolling(rolling.rolling_std, x, n)
     
     def sum(self, x, n):
-        return pd.rolling_sum(x, n)
+        return self._rolling(rolling.rolling_sum, x, n)
     
     def count_nans(self, x, n):
-        return n - pd.rolling_count(x, n)
+        return self._rolling(rolling.count_nans, x, n)
     
     def delay(self, x, n):
         return x.shift(n)
@@ -535,22 +906,41 @@ class Parser(object):
         return res
     
     def ts_mean(self, x, n):
-        return pd.rolling_mean(x, n)
+        return self._rolling(rolling.rolling_mean, x, n)
     
     def ts_min(self, x, n):
-        return pd.rolling_min(x, n)
+        return self._rolling(rolling.rolling_min, x, n)
     
     def ts_max(self, x, n):
-        return pd.rolling_max(x, n)
+        return self._rolling(rolling.rolling_max, x, n)
     
     def ts_kurt(self, x, n):
-        return pd.rolling_kurt(x, n)
+        return self._rolling(rolling.rolling_kurt, x, n)
     
     def ts_skew(self, x, n):
-        return pd.rolling_skew(x, n)
+        return self._rolling(rolling.rolling_skew, x, n)
+    
+    def ts_rank(self, x, n):
+        """Rank (from 1 to n) of the latest value in the last n values."""
+        return self._rolling(rolling.rolling_rank, x, n)
+    
+    def ts_argmax(self, x, n):
+        """Position (1 is the earliest, n is the latest) of the maximum of the last n values."""
+        return self._rolling(rolling.rolling_argmax, x, n)
+    
+    def ts_argmin(self, x, n):
+        """Position (1 is the earliest, n is the latest) of the minimum of the last n values."""
+        return self._rolling(rolling.rolling_argmin, x, n)
+    
+    def ts_median(self, x, n):
+        return self._rolling(rolling.rolling_median, x, n)
+    
+    def ts_quantile(self, x, n, q):
+        """q-th (0 <= q <= 1) quantile of the last n values."""
+        return self._rolling(rolling.rolling_quantile, x, n, q)
     
     def product(self, x, n):
-        return pd.rolling_apply(x, n, np.product)
+        return self._rolling(rolling.rolling_product, x, n)
 
     def rank(self, x):
         x = self._align_univariate(x)
@@ -564,23 +954,11 @@ class Parser(object):
             st.loc[:, col] = range(begin, n, 1)
         return st
     
-    def decay_exp_array(self, x, f):
-        n = len(x)
-        step = range(0, n)
-        step = step[::-1]
-        fs = np.power(f, step)
-        return np.dot(x, fs) / np.sum(fs)
-    
-    def decay_linear_array(self, x):
-        n = len(x) + 1
-        step = range(1, n)
-        return np.dot(x, step) / np.sum(step)
-    
     def decay_linear(self, x, n):
-        return pd.rolling_apply(x, n, self.decay_linear_array)
+        return self._rolling(rolling.decay_linear, x, n)
     
     def decay_exp(self, x, f, n):
-        return pd.rolling_apply(x, n, self.decay_exp_array, args=[f])
+        return self._rolling(rolling.decay_exp, x, f, n)
     
     def signed_power(self, x, e):
         signs = np.sign(x)
@@ -598,15 +976,18 @@ class Parser(object):
     # TODO: all cross-section operations support in-group modification: neutral, extreme values, standardize.
     def group_rank(self, x, group):
         x = self._align_univariate(x)
-        vals = pd.Series(group.values.ravel()).unique()
-        df = None
-        for val in vals:
-            rank = x[group == val].rank(axis=1)
-            if df is None:
-                df = rank
-            else:
-                df.fillna(rank, inplace=True)
-        return df
+        gi = group_ops.GroupIndex.from_group(group, x.index, x.columns)
+        return pd.DataFrame(group_ops.group_rank(x.values, gi), index=x.index, columns=x.columns)
+
+    def _get_group_index(self, df_group, df):
+        """Factorize df_group for values df. The result is kept, as all group functions of a formula share it."""
+        cached = self._group_index
+        if (cached is not None and cached[0] is df_group
+                and cached[1].equals(df.index) and cached[2].equals(df.columns)):
+            return cached[3]
+        gi = group_ops.GroupIndex.from_group(df_group, df.index, df.columns)
+        self._group_index = (df_group, df.index, df.columns, gi)
+        return gi
 
     def group_apply(self, func, df_arg, *args, **kwargs):
         """
@@ -637,6 +1018,15 @@ class Parser(object):
         # align for quarterly data
         df_arg = self._align_univariate(df_arg)
         
+        # built-in functions are computed for all dates and groups at once
+        vectorized = {self.rank: group_ops.group_rank,
+                      self.standardize: group_ops.group_standardize,
+                      self.cutoff: group_ops.group_cutoff}
+        if func in vectorized and isinstance(df_arg, pd.DataFrame):
+            gi = self._get_group_index(df_group, df_arg)
+            res = vectorized[func](df_arg.values, gi, *args, **kwargs)
+            return pd.DataFrame(res, index=df_arg.index, columns=df_arg.columns)
+        
         # validity check
         if isinstance(df_group, pd.DataFrame):
             if df_group.shape[0] == 1 or df_group.shape[1] == 1:
@@ -682,20 +1072,57 @@ class Parser(object):
 
         """
         axis = 1
-        x = df.values
+        x = df.values.copy()
         
-        median = np.median(x, axis=axis)
+        median = np.median(x, axis=axis).reshape(-1, 1)
         diff = x - median
         diff_abs = np.abs(diff)
-        mad = np.median(np.abs(diff), axis=axis)
+        mad = np.median(np.abs(diff), axis=axis).reshape(-1, 1)
         
         mask = diff_abs > z_score * mad
-        x[mask] = z_score * mad * np.sign(diff[mask]) + median
+        x[mask] = (z_score * mad * np.sign(diff) + median)[mask]
         
         return pd.DataFrame(index=df.index, columns=df.columns, data=x)
     
-    def industry_netural(self, x, group):
-        pass
+    def industry_neutral(self, x, group=None, mkt_cap=None):
+        """
+        Residual of cross-sectional regression on industry dummies (and market value) of each date.
+        
+        Parameters
+        ----------
+        x : pd.DataFrame
+        group : pd.DataFrame or None
+            Industry codes. If None, df_group of evaluation (DataView.data_group) is used.
+        mkt_cap : pd.DataFrame or None
+            If not None, log(mkt_cap) is also used as a regressor.
+
+        Returns
+        -------
+        pd.DataFrame
+
+        """
+        x = self._align_univariate(x)
+        if group is None:
+            if self.df_group is None:
+                raise ValueError("no group is given and no df_group for evaluation.")
+            gi = self._get_group_index(self.df_group, x)
+        else:
+            gi = group_ops.GroupIndex.from_group(group, x.index, x.columns)
+        
+        exog = None
+        if mkt_cap is not None:
+            mkt_cap = self._align_univariate(mkt_cap).reindex(index=x.index, columns=x.columns)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                exog = np.log(mkt_cap.values.astype(float))
+            exog[~np.isfinite(exog)] = np.nan
+        
+        res = group_ops.group_neutralize(x.values, gi, exog)
+        return pd.DataFrame(res, index=x.index, columns=x.columns)
+    
+    def industry_mkt_cap_neutral(self, x, mkt_cap):
+        return self.industry_neutral(x, mkt_cap=mkt_cap)
+    
+    industry_netural = industry_neutral  # old name
     
     # -----------------------------------------------------
     # align functions
@@ -762,6 +1189,7 @@ class Parser(object):
         
         self.functions = set_dic_key_capital(self.functions, style=style)
         self.ops1 = set_dic_key_capital(self.ops1, style=style)
+        self.style = style
     
     def register_function(self, name, func):
         """Register a new function to function map.
@@ -777,12 +1205,91 @@ class Parser(object):
             return
         
         self.functions[name] = func
+    
+    def copy(self, align_cache=None):
+        """
+        Parser with the functions of this one, but with its own evaluation state,
+        so that it can be configured (align_cache, dtype, profile) and used without affecting this one.
+        Methods of this parser in the function tables are bound to the copy, registered functions are shared.
+        
+        Parameters
+        ----------
+        align_cache : AlignCache, optional
+            Default a new AlignCache.
+
+        Returns
+        -------
+        Parser
+
+        """
+        parser = copy.copy(self)
+        for name in ['ops1', 'ops2', 'functions', 'values']:
+            table = getattr(self, name)
+            setattr(parser, name, {k: self._rebind(func, parser) for k, func in table.items()})
+        parser.align_cache = AlignCache() if align_cache is None else align_cache
+        parser.dtype = None
+        parser.profile = False
+        parser.last_profile = None
+        parser._expanded = dict()
+        parser._expand_args = dict()
+        return parser
+
+    def _rebind(self, func, parser):
+        """func bound to parser if it is a method of self, otherwise func."""
+        if getattr(func, '__self__', None) is self and hasattr(func, '__func__'):
+            return func.__func__.__get__(parser, type(parser))
+        return func
 
     # -----------------------------------------------------
     # parse and evaluate
+    def compile_formulas(self, formulas):
+        """
+        Parse several formulas and merge them into one plan.
+        A formula can refer to other formulas by their names.
+        
+        Parameters
+        ----------
+        formulas : dict
+            {name: formula}
+
+        Returns
+        -------
+        plan : Plan
+            plan.outputs are in the same order as names.
+        names : list of str
+            Names of formulas, sorted so that every formula comes after the formulas it depends on.
+
+        """
+        dic_tokens = dict()
+        dic_deps = dict()
+        for name, formula in formulas.items():
+            expr = self.parse(formula)
+            dic_tokens[name] = expr.tokens
+            dic_deps[name] = set(expr.variables()).intersection(formulas.keys())
+        
+        # topological sort, reject cyclic references
+        names = []
+        done = set()
+        while len(names) < len(formulas):
+            ready = sorted(name for name, deps in dic_deps.items() if name not in done and deps <= done)
+            if not ready:
+                raise ValueError("Cyclic reference in formulas: {}".format(sorted(set(formulas.keys()) - done)))
+            names.extend(ready)
+            done.update(ready)
+        
+        builder = PlanBuilder(self.ops1, self.ops2)
+        roots = dict()
+        for name in names:
+            roots[name] = builder.add_tokens(dic_tokens[name], bindings=roots)
+        
+        plan = Plan([roots[name] for name in names])
+        return plan, names
+    
     def parse(self, expr):
         """
         Parse a string expression.
+        Tokens and plan of a formula are cached process-wide (LRU) by (expr, function name style),
+        so the same formula is tokenized only once.
         
         Parameters
         ----------
@@ -794,6 +1301,30 @@ class Parser(object):
         Expression
 
         """
+        key = (expr, self.style)
+        with _parse_cache_lock:
+            cached = _parse_cache.pop(key, None)
+            if cached is not None:
+                _parse_cache[key] = cached
+        
+        if cached is None:
+            tokens = tuple(self._tokenize(expr))
+            cached = (tokens, Expression(tokens, self.ops1, self.ops2, self.functions).plan)
+            with _parse_cache_lock:
+                _parse_cache[key] = cached
+                while len(_parse_cache) > PARSE_CACHE_SIZE:
+                    _parse_cache.popitem(last=False)
+        
+        tokens, plan = cached
+        self.expression = expr
+        self.tokens = tokens
+        expression = Expression(tokens, self.ops1, self.ops2, self.functions)
+        expression._plan = plan
+        self.plan = plan
+        return expression
+    
+    def _tokenize(self, expr):
+        """Convert expr to a list of tokens in reverse Polish notation."""
         self.errormsg = ''
         self.success = True
         operstack = []
@@ -904,8 +1435,260 @@ class Parser(object):
             tokenstack.append(tmp)
         if (noperators + 1) != len(tokenstack):
             self.error_parsing(self.pos, 'parity')
-        self.tokens = tokenstack
-        return Expression(tokenstack, self.ops1, self.ops2, self.functions)
+        return tokenstack
+    
+    def _own_lookback(self, node):
+        """
+        Shift of the function of a call node itself (not including its arguments), 0 for other nodes.
+        Negative for look-ahead, e.g. Delay(x, -1).
+        
+        """
+        if node.kind != NCALL:
+            return 0
+        func = self.functions.get(node.name, None)
+        func_name = getattr(func, '__name__', None)
+        if func_name in ZERO_LOOKBACK_FUNCS:
+            return 0
+        elif func_name in LOOKBACK_FUNCS:
+            try:
+                return LOOKBACK_FUNCS[func_name]([arg.value if arg.kind == NCONST else None
+                                                  for arg in node.children])
+            except (TypeError, ValueError, IndexError):
+                return UNBOUNDED
+        return UNBOUNDED  # Ewma, Sma, Step and unknown functions
+    
+    def get_lookbacks(self, plan=None):
+        """
+        Number of previous rows each output of plan needs to compute one row, computed statically from the DAG.
+        
+        Parameters
+        ----------
+        plan : Plan, optional
+            Default is the plan of the last parsed expression.
+
+        Returns
+        -------
+        list
+            Lookback of each output of plan, int or UNBOUNDED (None) if the result depends on all history,
+            e.g. Ewma, or unknown (registered) functions, or window given by non-constant arguments.
+
+        """
+        plan = plan or self.plan
+        lookbacks = [0] * len(plan.nodes)
+        for i, node in enumerate(plan.nodes):
+            children = [lookbacks[j] for j in plan.children[i]]
+            own = self._own_lookback(node)
+            if own is UNBOUNDED or UNBOUNDED in children:
+                lookbacks[i] = UNBOUNDED
+            else:
+                lookbacks[i] = max(own, 0) + max(children or [0])
+        return [lookbacks[i] for i in plan.output_pos]
+    
+    def get_lookaheads(self, plan=None):
+        """
+        Number of following rows each output of plan needs to compute one row, e.g. 1 for Delay(x, -1).
+        
+        Parameters
+        ----------
+        plan : Plan, optional
+            Default is the plan of the last parsed expression.
+
+        Returns
+        -------
+        list
+            Look-ahead of each output of plan, int or UNBOUNDED (None), see get_lookbacks.
+
+        """
+        plan = plan or self.plan
+        lookaheads = [0] * len(plan.nodes)
+        for i, node in enumerate(plan.nodes):
+            children = [lookaheads[j] for j in plan.children[i]]
+            own = self._own_lookback(node)
+            if own is UNBOUNDED or UNBOUNDED in children:
+                lookaheads[i] = UNBOUNDED
+            else:
+                lookaheads[i] = max(-own, 0) + max(children or [0])
+        return [lookaheads[i] for i in plan.output_pos]
+    
+    def get_warm_up(self, plan, quarterly_vars, days_per_quarter=60):
+        """
+        Number of previous dates of daily and quarterly variables needed to compute one row of each output.
+        
+        Quarterly variables are expanded to daily when they meet daily data, so a node is daily if any operand is.
+        A window of daily node adds to daily lookback, and also to quarterly lookback by (rounded up) quarters,
+        as quarterly data of these dates must be available after expansion.
+        
+        Parameters
+        ----------
+        plan : Plan
+        quarterly_vars : set of str
+            Names of quarterly variables. Other variables are daily.
+        days_per_quarter : int
+            Number of trade days in a quarter, used to convert daily window to quarterly.
+
+        Returns
+        -------
+        list of tuple
+            (n_days, n_quarters) of each output. n_days is None if no daily variable is used.
+            Both are UNBOUNDED (None) if the lookback is unbounded.
+
+        """
+        warm = [None] * len(plan.nodes)
+        unbounded = [False] * len(plan.nodes)
+        for i, node in enumerate(plan.nodes):
+            if node.kind == NVAR:
+                if node.name in self.functions and node.name not in quarterly_vars:
+                    warm[i] = (None, None)
+                else:
+                    warm[i] = (None, 0) if node.name in quarterly_vars else (0, None)
+                continue
+            
+            children = plan.children[i]
+            own = self._own_lookback(node)
+            if own is UNBOUNDED or any(unbounded[j] for j in children):
+                unbounded[i] = True
+                warm[i] = (None, None)
+                continue
+            
+            own = max(own, 0)  # look-ahead needs no warm-up
+            days = [warm[j][0] for j in children if warm[j] is not None and warm[j][0] is not None]
+            quarters = [warm[j][1] for j in children if warm[j] is not None and warm[j][1] is not None]
+            if days:
+                n_days = max(days) + own
+                n_quarters = max(quarters) + -(-own // days_per_quarter) if quarters else None
+            else:
+                n_days = None
+                n_quarters = max(quarters) + own if quarters else None
+            warm[i] = (n_days, n_quarters)
+        
+        return [(UNBOUNDED, UNBOUNDED) if unbounded[i] else warm[i] for i in plan.output_pos]
+    
+    @staticmethod
+    def _common_dates(values):
+        """Date index shared by all DataFrame values, or None if they do not have the same index."""
+        dfs = [v for v in values.values() if isinstance(v, pd.DataFrame)]
+        if not dfs:
+            return None
+        dates = dfs[0].index
+        for df in dfs[1:]:
+            if not df.index.equals(dates):
+                return None
+        return dates
+    
+    def _get_window(self):
+        """Lookback and look-ahead of the expression, UNBOUNDED (None) if either is unbounded."""
+        lookback, lookahead = self.get_lookbacks()[0], self.get_lookaheads()[0]
+        if lookback is UNBOUNDED or lookahead is UNBOUNDED:
+            return UNBOUNDED, UNBOUNDED
+        return lookback, lookahead
+    
+    def _evaluate_rows(self, values, dates, start, end, lookback, lookahead=0,
+                       ann_dts=None, trade_dts=None, df_group=None):
+        """
+        Evaluate rows [start, end) of dates, using only the lookback rows before start
+        and the lookahead rows after end.
+        
+        Returns
+        -------
+        pd.DataFrame
+            end - start rows.
+
+        """
+        begin = max(start - lookback, 0)
+        stop = min(end + lookahead, len(dates))
+        values_part = {k: v.iloc[begin: stop] if isinstance(v, pd.DataFrame) else v for k, v in values.items()}
+        if trade_dts is not None:
+            trade_dts = np.asarray(trade_dts)
+            trade_dts = trade_dts[(trade_dts >= dates[begin]) & (trade_dts <= dates[stop - 1])]
+        if isinstance(df_group, pd.DataFrame) and df_group.shape[0] > 1 and df_group.shape[1] > 1:
+            df_group = df_group.loc[(df_group.index >= dates[begin]) & (df_group.index <= dates[stop - 1])]
+        df_part = self.evaluate(values_part, ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group)
+        return df_part.iloc[start - begin: end - begin]
+    
+    def evaluate_incremental(self, values, df_old, ann_dts=None, trade_dts=None, df_group=None):
+        """
+        Evaluate the expression only on dates after the last date of df_old, and append them to df_old.
+        Only the new dates and the lookback window before them are computed. If the expression looks ahead
+        (see get_lookaheads), the last dates of df_old, which depend on new dates, are re-computed too.
+        If the expression has unbounded lookback (see get_lookbacks), all dates are re-computed.
+        
+        Parameters
+        ----------
+        values : dict
+            Key is variable name, value is pd.DataFrame of all dates (old and new), index is date, column is symbol.
+            All values must have the same date index (daily data).
+        df_old : pd.DataFrame or None
+            Previous result of this expression.
+        ann_dts, trade_dts, df_group
+            See evaluate.
+
+        Returns
+        -------
+        pd.DataFrame
+            Values of df_old with results of new dates appended.
+
+        """
+        lookback, lookahead = self._get_window()
+        dates = self._common_dates(values)
+        if df_old is None or len(df_old) == 0 or lookback is UNBOUNDED or dates is None:
+            if lookback is UNBOUNDED and df_old is not None:
+                warnings.warn("Lookback of expression [{:s}] is unbounded, "
+                              "all dates are re-computed.".format(self.expression))
+            elif dates is None and df_old is not None:
+                raise ValueError("incremental evaluation needs values with the same date index.")
+            return self.evaluate(values, ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group)
+        
+        n_old = dates.searchsorted(df_old.index[-1], side='right')
+        if n_old >= len(dates):
+            return df_old
+        start = max(n_old - lookahead, 0)
+        df_new = self._evaluate_rows(values, dates, start, len(dates), lookback,
+                                     ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group)
+        return pd.concat([df_old.loc[df_old.index < dates[start]], df_new], axis=0)
+    
+    def evaluate_chunked(self, values, chunk_size, ann_dts=None, trade_dts=None, df_group=None):
+        """
+        Evaluate the expression on blocks of chunk_size dates, each with its lookback rows before it
+        and look-ahead rows after it, and write results of each block into one pre-allocated result.
+        Peak memory of intermediate results is bounded by chunk_size (plus lookback) rather than number of dates.
+        
+        If lookback of the expression is unbounded, or values have different date index (quarterly data),
+        or the result is not a DataFrame, all dates are evaluated at once.
+        
+        Parameters
+        ----------
+        values : dict
+        chunk_size : int
+            Number of dates in each block.
+        ann_dts, trade_dts, df_group
+            See evaluate.
+
+        Returns
+        -------
+        pd.DataFrame
+
+        """
+        lookback, lookahead = self._get_window()
+        dates = self._common_dates(values)
+        if lookback is UNBOUNDED or dates is None or len(dates) <= chunk_size:
+            if lookback is UNBOUNDED:
+                warnings.warn("Lookback of expression [{:s}] is unbounded, "
+                              "evaluate all dates at once.".format(self.expression))
+            return self.evaluate(values, ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group)
+        
+        res = None
+        for start in range(0, len(dates), chunk_size):
+            end = min(start + chunk_size, len(dates))
+            df_chunk = self._evaluate_rows(values, dates, start, end, lookback, lookahead,
+                                           ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group)
+            if res is None:
+                if not isinstance(df_chunk, pd.DataFrame):
+                    return self.evaluate(values, ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group)
+                res = pd.DataFrame(np.empty((len(dates), df_chunk.shape[1]), dtype=df_chunk.values.dtype),
+                                   index=dates, columns=df_chunk.columns)
+            res.iloc[start: end] = df_chunk.reindex(columns=res.columns).values
+            del df_chunk
+        return res
     
     def evaluate(self, values, ann_dts=None, trade_dts=None, df_group=None):
         """
@@ -927,50 +1710,330 @@ class Parser(object):
         -------
         pd.DataFrame
 
+        """
+        if self.n_workers > 1:
+            return self.evaluate_parallel(values, self.n_workers,
+                                          ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group)
+        res = self.evaluate_plan(self.plan, values, ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group)
+        return res[0]
+    
+    def evaluate_plan(self, plan, values, ann_dts=None, trade_dts=None, df_group=None, n_workers=1):
+        """
+        Evaluate every node of a compiled plan once, in topological order.
+        
+        Parameters
+        ----------
+        plan : Plan
+        values : dict
+            Key is variable name, value is pd.DataFrame (index is date, column is symbol)
+        ann_dts : pd.DataFrame
+        trade_dts : np.ndarray
+        df_group : pd.DataFrame
+            See evaluate.
+        n_workers : int
+            If larger than 1, independent nodes (nodes of the same depth in the DAG) are evaluated
+            concurrently on a thread pool. NumPy releases GIL in most heavy operations.
+            Otherwise, if self.backend is 'numpy' and the plan is supported, it is evaluated on arrays.
+
+        Returns
+        -------
+        list
+            Values of plan.outputs.
+
         """
         self.ann_dts = ann_dts
         self.trade_dts = trade_dts
         self.df_group = df_group
+        self._group_index = None
         
         values = values or {}
-        nstack = []
-        L = len(self.tokens)
-        for i in range(0, L):
-            item = self.tokens[i]
-            type_ = item.type_
-            if type_ == TNUMBER:
-                nstack.append(item.number_)
-            elif type_ == TOP2:
-                n2 = nstack.pop()
-                n1 = nstack.pop()
-                f = self.ops2[item.index_]
-                nstack.append(f(n1, n2))
-            elif type_ == TVAR:
-                if item.index_ in values:
-                    nstack.append(values[item.index_])
-                elif item.index_ in self.functions:
-                    nstack.append(self.functions[item.index_])
-                else:
-                    raise Exception('undefined variable: ' + item.index_)
-            elif type_ == TOP1:
-                n1 = nstack.pop()
-                f = self.ops1[item.index_]
-                nstack.append(f(n1))
-            elif type_ == TFUNCALL:
-                n1 = nstack.pop()
-                f = nstack.pop()
-                if callable(f):
-                    if type(n1) is list:
-                        nstack.append(f(*n1))
-                    else:
-                        nstack.append(f(n1))  # call(f, n1)
-                else:
-                    raise Exception(f + ' is not a function')
+        
+        records = None
+        evaluate_node = self._evaluate_node
+        if self.profile:
+            records = [None] * len(plan.nodes)
+            self.last_profile = None
+            
+            def record(i, args, res, seconds):
+                records[i] = _profile_record(plan, i, args, res, seconds)
+            
+            def evaluate_node(plan_, i, values_, results_):
+                args = [results_[j] for j in plan_.children[i]]
+                for k in self._expand_args.get(i, ()):
+                    args[k] = self._expanded[plan_.children[i][k]]
+                start = time.time()
+                res = self._evaluate_node(plan_, i, values_, results_)
+                record(i, args, res, time.time() - start)
+                return res
+        
+        if (self.backend == 'numpy' and n_workers <= 1
+                and array_backend.supports(self, plan, values, trade_dts=trade_dts)):
+            res_list = array_backend.evaluate_plan(self, plan, values, df_group=df_group,
+                                                   on_node=None if records is None else record)
+            if records is not None:
+                self.last_profile = _profile_frame(records)
+            return res_list
+        
+        results = [None] * len(plan.nodes)
+        
+        # quarterly nodes consumed by daily nodes are expanded once, right after they are evaluated
+        self._expanded = dict()
+        self._expand_args = dict()
+        if ann_dts is not None and trade_dts is not None:
+            _, self._expand_args = self.get_frequencies(plan, values, trade_dts)
+        to_expand = set(plan.children[i][k] for i, args in self._expand_args.items() for k in args)
+        
+        def expand(i):
+            if i in to_expand:
+                start = time.time()
+                self._expanded[i] = self._expand_node(plan.nodes[i], results[i])
+                if records is not None:
+                    records[i]['expand_seconds'] = time.time() - start
+        
+        # number of pending consumers of each node, an intermediate result is released when it drops to 0
+        n_consumers = [0] * len(plan.nodes)
+        for children in plan.children:
+            for j in children:
+                n_consumers[j] += 1
+        for j in plan.output_pos:
+            n_consumers[j] += 1
+        
+        def release_children(i):
+            for j in plan.children[i]:
+                n_consumers[j] -= 1
+                if n_consumers[j] == 0:
+                    results[j] = None
+                    self._expanded.pop(j, None)
+        
+        if n_workers <= 1:
+            for i in range(len(plan.nodes)):
+                results[i] = evaluate_node(plan, i, values, results)
+                expand(i)
+                release_children(i)
+        else:
+            pool = ThreadPool(n_workers)
+            try:
+                for level in plan.levels():
+                    level_results = pool.map(lambda i: evaluate_node(plan, i, values, results), level)
+                    for i, res in zip(level, level_results):
+                        results[i] = res
+                        expand(i)
+                    for i in level:
+                        release_children(i)
+            finally:
+                pool.close()
+                pool.join()
+        
+        if records is not None:
+            self.last_profile = _profile_frame(records)
+        return [results[i] for i in plan.output_pos]
+    
+    def _evaluate_node(self, plan, i, values, results):
+        node = plan.nodes[i]
+        kind = node.kind
+        if kind == NCONST:
+            return node.value
+        elif kind == NVAR:
+            if node.name in values:
+                return values[node.name]
+            elif node.name in self.functions:
+                return self.functions[node.name]
             else:
-                raise Exception('invalid Expression')
-        if len(nstack) > 1:
-            raise Exception('invalid Expression (parity)')
-        return nstack[0]
+                raise Exception('undefined variable: ' + node.name)
+        
+        args = [results[j] for j in plan.children[i]]
+        for k in self._expand_args.get(i, ()):
+            args[k] = self._expanded[plan.children[i][k]]
+        if kind == NOP2:
+            return self._cast(self.ops2[node.name](*args))
+        elif kind == NOP1:
+            return self._cast(self.ops1[node.name](*args))
+        
+        if node.name in values:
+            f = values[node.name]
+        elif node.name in self.functions:
+            f = self.functions[node.name]
+        else:
+            raise Exception('undefined variable: ' + node.name)
+        if not callable(f):
+            raise Exception(node.name + ' is not a function')
+        return self._cast(f(*args))
+    
+    def _cast(self, res):
+        """Cast float result of a node to self.dtype. Inputs are not cast, e.g. integer dates stored as float64."""
+        if self.dtype is None or not isinstance(res, pd.DataFrame):
+            return res
+        arr = res.values
+        if arr.dtype.kind != 'f' or arr.dtype == self.dtype:
+            return res
+        return pd.DataFrame(arr.astype(self.dtype), index=res.index, columns=res.columns)
+    
+    def get_profile(self, tree=False):
+        """
+        Profile of the last evaluation, only available if self.profile is True.
+        
+        Parameters
+        ----------
+        tree : bool
+            If True, return a text tree of nodes from outputs to variables.
+
+        Returns
+        -------
+        pd.DataFrame or str
+            DataFrame is indexed by node position, columns are
+            expr, kind, children, seconds (evaluation of the node itself), expand_seconds (expansion of
+            quarterly result), input_shapes, output_shape, bytes (of output) and nan_ratio (of output).
+
+        """
+        df = self.last_profile
+        if df is None:
+            return None
+        if not tree:
+            return df
+        
+        lines = []
+        visited = set()
+        
+        def visit(i, depth):
+            row = df.loc[i]
+            line = "{:s}{:s}  {:.3f}ms".format('    ' * depth, row['expr'], row['seconds'] * 1e3)
+            if row['expand_seconds']:
+                line += " (expand {:.3f}ms)".format(row['expand_seconds'] * 1e3)
+            if row['output_shape'] is not None:
+                line += "  shape={}  {:.1f}MB  nan={:.1%}".format(row['output_shape'], row['bytes'] / 1e6,
+                                                                   row['nan_ratio'])
+            if i in visited and row['children']:
+                lines.append(line + "  (shared, see above)")
+                return
+            visited.add(i)
+            lines.append(line)
+            for j in row['children']:
+                visit(j, depth + 1)
+        
+        for i in df.index[df['output']]:
+            visit(i, 0)
+        return '\n'.join(lines)
+    
+    def _expand_node(self, node, value):
+        """Expand quarterly result of a node to trade dates, variables are cached by self.align_cache."""
+        if node.kind == NVAR:
+            return self.align_cache.align(node.name, value, self.ann_dts, self.trade_dts)
+        return align(value, self.ann_dts, self.trade_dts)
+    
+    def _node_func_name(self, node):
+        if node.kind == NOP1:
+            func = self.ops1.get(node.name, None)
+        elif node.kind == NOP2:
+            func = self.ops2.get(node.name, None)
+        else:
+            func = self.functions.get(node.name, None)
+        return getattr(func, '__name__', None)
+    
+    def get_frequencies(self, plan, values, trade_dts):
+        """
+        Frequency of each node of plan, and where quarterly data is expanded to daily.
+        
+        A variable is quarterly if its length is not the same as trade_dts.
+        Quarterly-only subtrees are evaluated on the compact quarterly dates. A quarterly node is expanded
+        (at most once) when a daily node consumes it in an operation which aligns its arguments,
+        e.g. arithmetic with daily data or Rank.
+        
+        Parameters
+        ----------
+        plan : Plan
+        values : dict
+            {var: pd.DataFrame}
+        trade_dts : np.ndarray
+            Daily dates.
+
+        Returns
+        -------
+        freqs : list
+            FREQ_DAILY, FREQ_QUARTERLY, or None (not a DataFrame) of each node.
+        expand_args : dict
+            {node position: set of argument indices}, these quarterly arguments are expanded before the node
+            is evaluated.
+
+        """
+        n_dates = len(trade_dts)
+        freqs = [None] * len(plan.nodes)
+        expand_args = dict()
+        for i, node in enumerate(plan.nodes):
+            if node.kind == NCONST:
+                continue
+            elif node.kind == NVAR:
+                value = values.get(node.name, None)
+                if isinstance(value, pd.DataFrame):
+                    freqs[i] = FREQ_DAILY if len(value.index) == n_dates else FREQ_QUARTERLY
+                continue
+            
+            children = [freqs[j] for j in plan.children[i]]
+            func_name = self._node_func_name(node)
+            if func_name in ALIGN_BIVARIATE_FUNCS and FREQ_DAILY in children:
+                args = {k for k, freq in enumerate(children) if freq == FREQ_QUARTERLY}
+            elif func_name in ALIGN_UNIVARIATE_FUNCS:
+                args = {k for k in ALIGN_UNIVARIATE_FUNCS[func_name]
+                        if k < len(children) and children[k] == FREQ_QUARTERLY}
+            else:
+                args = set()
+            if args:
+                expand_args[i] = args
+                children = [FREQ_DAILY if k in args else freq for k, freq in enumerate(children)]
+            
+            if FREQ_DAILY in children:
+                freqs[i] = FREQ_DAILY
+            elif FREQ_QUARTERLY in children:
+                freqs[i] = FREQ_QUARTERLY
+        return freqs, expand_args
+    
+    def classify_plan(self, plan=None):
+        """
+        Kind of plan: PLAN_TS if symbols are independent (only time series and element-wise operations),
+        PLAN_CS if dates are independent (only cross section and element-wise operations), or PLAN_MIXED.
+        Registered (unknown) functions make a plan PLAN_MIXED.
+        
+        """
+        plan = plan or self.plan
+        has_ts, has_cs = False, False
+        for node in plan.nodes:
+            if node.kind != NCALL:
+                continue
+            func_name = getattr(self.functions.get(node.name, None), '__name__', None)
+            if func_name in CROSS_SECTION_FUNCS:
+                has_cs = True
+            elif func_name in LOOKBACK_FUNCS or func_name in UNBOUNDED_FUNCS:
+                has_ts = True
+            elif func_name not in ZERO_LOOKBACK_FUNCS:
+                return PLAN_MIXED
+        if has_cs and has_ts:
+            return PLAN_MIXED
+        return PLAN_CS if has_cs else PLAN_TS
+    
+    def evaluate_parallel(self, values, n_workers, ann_dts=None, trade_dts=None, df_group=None):
+        """
+        Evaluate the expression with n_workers.
+        
+        Plans of PLAN_TS are split into blocks of symbols, which are evaluated on a (forked) process pool.
+        Input and output data are in shared memory, so nothing large is pickled.
+        Other plans evaluate independent sub-expressions concurrently on a thread pool.
+        
+        Parameters
+        ----------
+        values : dict
+        n_workers : int
+        ann_dts, trade_dts, df_group
+            See evaluate.
+
+        Returns
+        -------
+        pd.DataFrame
+
+        """
+        if (n_workers > 1 and hasattr(os, 'fork') and self.classify_plan() == PLAN_TS
+                and _can_share(values)):
+            return _evaluate_symbol_blocks(self, values, n_workers, ann_dts=ann_dts, trade_dts=trade_dts)
+        return self.evaluate_plan(self.plan, values, ann_dts=ann_dts, trade_dts=trade_dts, df_group=df_group,
+                                  n_workers=n_workers)[0]
 
     # -----------------------------------------------------
     # Other
@@ -1225,3 +2288,144 @@ class Parser(object):
                 self.pos = len(self.expression)
             return True
         return False
+
+
+# -----------------------------------------------------
+# Evaluation of time series plans on blocks of symbols in forked processes.
+# The task is passed to each worker by the pool initializer, so forked workers inherit it
+# (and the shared memory in it) without pickling.
+_worker_task = None
+
+
+def _init_block_worker(task):
+    global _worker_task
+    _worker_task = task
+
+
+def _can_share(values):
+    """All DataFrame values have float dtype, the same index and the same columns."""
+    dfs = [v for v in values.values() if isinstance(v, pd.DataFrame)]
+    if not dfs:
+        return False
+    for df in dfs:
+        if not (df.index.equals(dfs[0].index) and df.columns.equals(dfs[0].columns)):
+            return False
+        if not all(dtype.kind == 'f' for dtype in df.dtypes):
+            return False
+    return True
+
+
+def _to_shared(arr):
+    shared = sharedctypes.RawArray('d', arr.size)
+    view = np.frombuffer(shared, dtype=np.float64).reshape(arr.shape)
+    view[:] = arr
+    return shared, view
+
+
+def _evaluate_block(columns):
+    """Evaluate one block of symbols in a worker, result is written into the shared output."""
+    parser, values, ann_dts, trade_dts, out = _worker_task
+    block_values = {k: v.iloc[:, columns] if isinstance(v, pd.DataFrame) else v for k, v in values.items()}
+    block_ann = ann_dts.iloc[:, columns] if isinstance(ann_dts, pd.DataFrame) else ann_dts
+    res = parser.evaluate_plan(parser.plan, block_values, ann_dts=block_ann, trade_dts=trade_dts)[0]
+    out[:, columns] = np.asarray(res, dtype=np.float64)
+
+
+def _evaluate_symbol_blocks(parser, values, n_workers, ann_dts=None, trade_dts=None):
+    columns = [v for v in values.values() if isinstance(v, pd.DataFrame)][0].columns
+    n_cols = len(columns)
+    block_size = n_cols // n_workers + 1
+    blocks = [slice(start, min(start + block_size, n_cols)) for start in range(0, n_cols, block_size)]
+    if len(blocks) <= 1:
+        return parser.evaluate_plan(parser.plan, values, ann_dts=ann_dts, trade_dts=trade_dts)[0]
+    
+    # the first block is evaluated here, to know index and dtype of the result
+    shared_values = dict()
+    for k, v in values.items():
+        if isinstance(v, pd.DataFrame):
+            shared, view = _to_shared(v.values.astype(np.float64))
+            v = pd.DataFrame(view, index=v.index, columns=v.columns, copy=False)
+        shared_values[k] = v
+    block_ann = ann_dts.iloc[:, blocks[0]] if isinstance(ann_dts, pd.DataFrame) else ann_dts
+    first = parser.evaluate_plan(parser.plan, {k: v.iloc[:, blocks[0]] if isinstance(v, pd.DataFrame) else v
+                                               for k, v in shared_values.items()},
+                                 ann_dts=block_ann, trade_dts=trade_dts)[0]
+    if not isinstance(first, pd.DataFrame):
+        return parser.evaluate_plan(parser.plan, values, ann_dts=ann_dts, trade_dts=trade_dts)[0]
+    
+    out_shared, out = _to_shared(np.empty((first.shape[0], n_cols)))
+    out[:, blocks[0]] = first.values
+    
+    task = (parser, shared_values, ann_dts, trade_dts, out)
+    pool = multiprocessing.Pool(min(n_workers, len(blocks) - 1), initializer=_init_block_worker, initargs=(task,))
+    try:
+        pool.map(_evaluate_block, blocks[1:])
+    finally:
+        pool.close()
+        pool.join()
+    
+    return pd.DataFrame(out.copy(), index=first.index, columns=columns)
+
+
+def _nbytes(x):
+    if isinstance(x, pd.DataFrame):
+        return len(x.index) * sum(dtype.itemsize for dtype in x.dtypes.values)
+    return int(getattr(x, 'nbytes', 0))
+
+
+def _nan_ratio(x):
+    if isinstance(x, pd.DataFrame):
+        x = x.values
+    if not isinstance(x, np.ndarray) or x.size == 0 or x.dtype.kind != 'f':
+        return 0.0
+    return float(np.isnan(x).sum()) / x.size
+
+
+def _profile_record(plan, i, args, res, seconds):
+    return {'expr': plan.nodes[i].expr,
+            'kind': plan.nodes[i].kind,
+            'children': plan.children[i],
+            'output': i in plan.output_pos,
+            'seconds': seconds,
+            'expand_seconds': 0.0,
+            'input_shapes': tuple(getattr(arg, 'shape', None) for arg in args),
+            'output_shape': getattr(res, 'shape', None),
+            'bytes': _nbytes(res),
+            'nan_ratio': _nan_ratio(res)}
+
+
+def _profile_frame(records):
+    columns = ['expr', 'kind', 'children', 'output', 'seconds', 'expand_seconds',
+               'input_shapes', 'output_shape', 'bytes', 'nan_ratio']
+    df = pd.DataFrame(records, columns=columns)
+    df.index.name = 'node'
+    return df
+
+
+def get_parser(style='upper'):
+    """
+    Process-wide Parser with function names of style, so that Parser is not built for each formula.
+    The shared parser must not be configured or used by several threads at the same time,
+    evaluate on a Parser.copy of it instead. Functions registered on it are visible to all users.
+    
+    Parameters
+    ----------
+    style : {'upper', 'lower'}
+        See Parser.set_capital.
+
+    Returns
+    -------
+    Parser
+
+    """
+    with _parse_cache_lock:
+        if style not in _shared_parsers:
+            parser = Parser()
+            parser.set_capital(style)
+            _shared_parsers[style] = parser
+        return _shared_parsers[style]
+
+
+def clear_parse_cache():
+    with _parse_cache_lock:
+        _parse_cache.clear()
@@ -0,0 +1,619 @@
+# encoding: utf-8
+"""
+Rolling window kernels on 2-D arrays (index is date, column is symbol).
+
+All kernels work on whole arrays along axis 0. Except weighted windows, rank and quantile, the cost is
+O(n_dates * n_symbols) no matter how large the window is, and nothing is called per window in Python.
+Weighted windows cost O(n_dates * n_symbols * window) vectorized flops. Rank and quantile cost the same
+for small windows, and O(n_dates * n_symbols * log(window)) by a sorted window for larger ones.
+
+NaN policy (the same as pd.rolling_* with default min_periods):
+    The result of a window is NaN if the window is not full (the first window - 1 rows),
+    or if there is any NaN in the window.
+    count_nans is the only exception: it counts NaN in partial windows at the beginning too.
+
+"""
+import bisect
+
+import numpy as np
+
+
+def _as_2d(x):
+    arr = np.asarray(x, dtype=float)
+    if arr.ndim == 1:
+        arr = arr.reshape(-1, 1)
+    return arr
+
+
+def _check_window(window):
+    window = int(window)
+    if window <= 0:
+        raise ValueError("window must be a positive integer, but we have {}".format(window))
+    return window
+
+
+def _window_sum(arr, window):
+    """
+    Sum of each full window along axis 0, using difference of cumulative sums.
+    arr must not contain NaN. The first window - 1 rows are 0.
+
+    """
+    csum = np.cumsum(arr, axis=0, dtype=np.float64)
+    if window > arr.shape[0]:
+        return np.zeros(arr.shape, dtype=np.float64)
+    res = np.empty(arr.shape, dtype=np.float64)
+    res[:window - 1] = 0.0
+    res[window - 1] = csum[window - 1]
+    np.subtract(csum[window:], csum[:-window], out=res[window:])
+    return res
+
+
+def _valid_count(mask, window):
+    """Number of True in each full window of a boolean array."""
+    return _window_sum(mask.astype(np.float64), window)
+
+
+def _full_mask(valid, window):
+    """True where the window is full and contains no NaN."""
+    if valid.all():
+        res = np.ones(valid.shape, dtype=bool)
+        res[:window - 1] = False
+        return res
+    return _valid_count(valid, window) >= window - 0.5
+
+
+def _center(arr, valid):
+    """Subtract the mean of each column to reduce round-off error of cumulative sums. NaN are set to 0."""
+    if valid.all():
+        return arr - arr.mean(axis=0)
+    n = valid.sum(axis=0)
+    col_sum = np.where(valid, arr, 0.0).sum(axis=0)
+    col_mean = np.where(n > 0, col_sum / np.maximum(n, 1), 0.0)
+    return np.where(valid, arr - col_mean, 0.0)
+
+
+def _block_extreme(arr, window, func, fill):
+    """
+    Rolling max / min using the van Herk / Gil-Werman algorithm:
+    split rows into blocks of size window, then every window is covered by the suffix of one block
+    and the prefix of the next block. Prefix and suffix extremes are cumulative, so the cost is O(n),
+    and it is fully vectorized on all columns.
+
+    """
+    n_rows, n_cols = arr.shape
+    n_blocks = -(-n_rows // window)
+    padded = np.empty((n_blocks * window, n_cols), dtype=np.float64)
+    padded[:n_rows] = arr
+    padded[n_rows:] = fill
+
+    blocks = padded.reshape(n_blocks, window, n_cols)
+    prefix = func.accumulate(blocks, axis=1).reshape(-1, n_cols)
+    suffix = func.accumulate(blocks[:, ::-1, :], axis=1)[:, ::-1, :].reshape(-1, n_cols)
+
+    res = np.empty((n_rows, n_cols), dtype=np.float64)
+    res.fill(np.nan)
+    if window <= n_rows:
+        res[window - 1:] = func(suffix[:n_rows - window + 1], prefix[window - 1:n_rows])
+    return res
+
+
+def rolling_max(x, window):
+    arr = _as_2d(x)
+    window = _check_window(window)
+    res = _block_extreme(arr, window, np.maximum, -np.inf)  # NaN propagates through np.maximum
+    return res
+
+
+def rolling_min(x, window):
+    arr = _as_2d(x)
+    window = _check_window(window)
+    res = _block_extreme(arr, window, np.minimum, np.inf)
+    return res
+
+
+def rolling_count(x, window):
+    """Number of non-NaN values in each window, partial windows at the beginning included."""
+    arr = _as_2d(x)
+    window = _check_window(window)
+    valid = (~np.isnan(arr)).astype(np.float64)
+    csum = np.cumsum(valid, axis=0)
+    res = csum.copy()
+    res[window:] = csum[window:] - csum[:-window]
+    return res
+
+
+def count_nans(x, window):
+    """Number of NaN in each window, partial windows at the beginning are counted as if NaN are padded."""
+    window = _check_window(window)
+    return window - rolling_count(x, window)
+
+
+def rolling_sum(x, window):
+    arr = _as_2d(x)
+    window = _check_window(window)
+    valid = ~np.isnan(arr)
+    finite = np.isfinite(arr)
+
+    if finite.all():
+        res = _window_sum(arr, window)
+        res[:window - 1] = np.nan
+        return res
+    res = _window_sum(np.where(finite, arr, 0.0), window)
+
+    # infinite values are summed separately, otherwise inf - inf of cumsum will pollute all later windows
+    is_inf = valid & ~finite
+    if is_inf.any():
+        n_pos = _valid_count(is_inf & (arr > 0), window)
+        n_neg = _valid_count(is_inf & (arr < 0), window)
+        res[n_pos > 0.5] = np.inf
+        res[n_neg > 0.5] = -np.inf
+        res[(n_pos > 0.5) & (n_neg > 0.5)] = np.nan
+
+    res[~_full_mask(valid, window)] = np.nan
+    return res
+
+
+def rolling_mean(x, window):
+    window = _check_window(window)
+    return rolling_sum(x, window) / window
+
+
+def _moments(arr, window, orders):
+    """Window sums of powers of centered data. NaN where window is not full or contains NaN / inf."""
+    finite = np.isfinite(arr)
+    all_finite = finite.all()
+    full = None if all_finite else _full_mask(finite, window)
+    centered = _center(arr, finite)
+
+    res = []
+    power = centered
+    for k in range(1, max(orders) + 1):
+        if k > 1:
+            power = power * centered
+        if k in orders:
+            s = _window_sum(power, window)
+            if all_finite:
+                s[:window - 1] = np.nan
+            else:
+                s[~full] = np.nan
+            res.append(s)
+    return res
+
+
+def _round_off_zero(arr, window, spread, scale):
+    """
+    True where spread (variance like) is only round-off error of a constant window.
+    Only windows with spread tiny compared to scale are checked, which is rare for real data.
+
+    """
+    with np.errstate(invalid='ignore'):
+        suspect = spread <= 1e-9 * scale
+    if not suspect.any():
+        return suspect
+    return suspect & _is_constant(arr, window)
+
+
+def _is_constant(arr, window):
+    """True if all values in window are the same, i.e. no change between adjacent rows in the window."""
+    res = np.zeros(arr.shape, dtype=bool)
+    if window > arr.shape[0]:
+        return res
+    if window == 1:
+        res[:] = True
+        return res
+    with np.errstate(invalid='ignore'):
+        changed = np.diff(arr, axis=0) != 0  # NaN counts as a change
+    n_changed = _valid_count(changed, window - 1)
+    res[window - 1:] = n_changed[window - 2:] < 0.5
+    return res
+
+
+def rolling_var(x, window, ddof=1):
+    arr = _as_2d(x)
+    window = _check_window(window)
+    s1, s2 = _moments(arr, window, (1, 2))
+
+    if window <= ddof:
+        return np.full_like(s1, np.nan)
+    res = s1 * s1
+    res /= -window
+    res += s2
+    res[_round_off_zero(arr, window, res, s2)] = 0.0
+    np.maximum(res, 0.0, out=res)  # remove negative round-off error, NaN kept
+    res /= (window - ddof)
+    return res
+
+
+def rolling_std(x, window, ddof=1):
+    return np.sqrt(rolling_var(x, window, ddof=ddof))
+
+
+def rolling_cov(x, y, window, ddof=1):
+    """Rolling covariance. A window is valid only if both x and y have no NaN in it."""
+    xarr, yarr = _as_2d(x), _as_2d(y)
+    window = _check_window(window)
+    both = np.isfinite(xarr) & np.isfinite(yarr)
+    full = _full_mask(both, window)
+
+    xc = _center(xarr, both)
+    yc = _center(yarr, both)
+    sx = _window_sum(xc, window)
+    sy = _window_sum(yc, window)
+    sxy = _window_sum(xc * yc, window)
+
+    if window > ddof:
+        res = (sxy - sx * sy / window) / (window - ddof)
+    else:
+        res = np.full_like(sx, np.nan)
+    res[~full] = np.nan
+    return res
+
+
+def rolling_corr(x, y, window):
+    """Rolling correlation. NaN if either x or y is constant in the window."""
+    xarr, yarr = _as_2d(x), _as_2d(y)
+    window = _check_window(window)
+    both = np.isfinite(xarr) & np.isfinite(yarr)
+    xarr = np.where(both, xarr, np.nan)
+    yarr = np.where(both, yarr, np.nan)
+
+    cov = rolling_cov(xarr, yarr, window)
+    var_x = rolling_var(xarr, window)
+    var_y = rolling_var(yarr, window)
+
+    denom = np.sqrt(var_x * var_y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = cov / denom
+    res[denom == 0] = np.nan
+    return np.clip(res, -1.0, 1.0)  # clip keeps NaN
+
+
+def rolling_skew(x, window):
+    """Rolling sample skewness (bias corrected, the same as pandas)."""
+    arr = _as_2d(x)
+    window = _check_window(window)
+    res = np.empty(arr.shape, dtype=np.float64)
+    res.fill(np.nan)
+    if window < 3:
+        return res
+
+    n = float(window)
+    s1, s2, s3 = _moments(arr, window, (1, 2, 3))
+    a = s1 / n
+    b = s2 / n - a * a
+    c = s3 / n - a * a * a - 3 * a * b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = np.sqrt(n * (n - 1)) * c / ((n - 2) * np.power(b, 1.5))
+    res[~(b > 0) | _round_off_zero(arr, window, b, s2 / n)] = np.nan
+    return res
+
+
+def rolling_kurt(x, window):
+    """Rolling sample excess kurtosis (bias corrected, the same as pandas)."""
+    arr = _as_2d(x)
+    window = _check_window(window)
+    res = np.empty(arr.shape, dtype=np.float64)
+    res.fill(np.nan)
+    if window < 4:
+        return res
+
+    n = float(window)
+    s1, s2, s3, s4 = _moments(arr, window, (1, 2, 3, 4))
+    a = s1 / n
+    r = a * a
+    b = s2 / n - r
+    r = r * a
+    c = s3 / n - r - 3 * a * b
+    r = r * a
+    d = s4 / n - r - 6 * b * a * a - 4 * c * a
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = (n * n - 1) * d / (b * b) - 3 * ((n - 1) ** 2)
+        res = k / ((n - 2) * (n - 3))
+    res[~(b > 0) | _round_off_zero(arr, window, b, s2 / n)] = np.nan
+    return res
+
+
+def rolling_product(x, window):
+    """
+    Rolling product, computed as sign * exp(sum of log of absolute values).
+    Zeros and signs are counted separately, so they are exact.
+
+    """
+    arr = _as_2d(x)
+    window = _check_window(window)
+    valid = ~np.isnan(arr)
+
+    is_zero = valid & (arr == 0)
+    is_neg = valid & (arr < 0)
+    with np.errstate(divide='ignore'):
+        log_abs = np.where(valid & ~is_zero, np.log(np.abs(np.where(valid, arr, 1.0))), 0.0)
+
+    finite = np.isfinite(log_abs)
+    log_sum = _window_sum(np.where(finite, log_abs, 0.0), window)
+    n_inf = _valid_count(~finite, window)
+    n_zero = _valid_count(is_zero, window)
+    n_neg = _valid_count(is_neg, window)
+
+    sign = np.where(np.mod(np.round(n_neg), 2) > 0.5, -1.0, 1.0)
+    res = sign * np.exp(log_sum)
+    res[n_inf > 0.5] = sign[n_inf > 0.5] * np.inf
+    res[n_zero > 0.5] = 0.0
+    res[(n_inf > 0.5) & (n_zero > 0.5)] = np.nan
+    res[~_full_mask(valid, window)] = np.nan
+    return res
+
+
+# -----------------------------------------------------
+# order statistics
+def _shifted_scan(arr, window):
+    """
+    Yield (k, view) for k = 0 .. window - 1, view[t] is the k-th value (from the earliest) of the window
+    ending at row t + window - 1. Scanning window views of the whole array costs O(n_dates * n_symbols * window)
+    flops, with O(n_dates * n_symbols) memory.
+
+    """
+    n_out = arr.shape[0] - window + 1
+    for k in range(window):
+        yield k, arr[k: k + n_out]
+
+
+def _sorted_scan(arr, window, func):
+    """
+    Slide a sorted list of the window down each column: every step deletes the oldest value and inserts
+    the latest one by binary search, so it costs O(log(window)) comparisons per element,
+    O(n_dates * n_symbols * log(window)) in total (the list memmove on insert / delete is O(window) but
+    done in C). Return (n_dates - window + 1, n_symbols) array of func(sorted_window, latest_value).
+
+    """
+    filled = np.where(np.isnan(arr), 0.0, arr)  # windows with NaN are set to NaN afterwards
+    n_rows, n_cols = filled.shape
+    res = np.empty((n_rows - window + 1, n_cols), dtype=np.float64)
+    for j in range(n_cols):
+        col = filled[:, j].tolist()
+        win = sorted(col[:window])
+        values = [func(win, col[window - 1])]
+        for t in range(window, n_rows):
+            del win[bisect.bisect_left(win, col[t - window])]
+            bisect.insort(win, col[t])
+            values.append(func(win, col[t]))
+        res[:, j] = values
+    return res
+
+
+# windows not larger than these are scanned by whole-array views (O(window) vectorized passes),
+# which is faster than the per-element sorted window for small windows (measured break-even points).
+_RANK_SCAN_MAX_WINDOW = 200
+_QUANTILE_SCAN_MAX_WINDOW = 64
+
+
+def _order_result(arr, window, out_func):
+    """Result array with the first window - 1 rows NaN; out_func(out) fills the rest."""
+    res = np.empty(arr.shape, dtype=np.float64)
+    res.fill(np.nan)
+    if window <= arr.shape[0]:
+        out_func(res[window - 1:])
+        res[~_full_mask(~np.isnan(arr), window)] = np.nan
+    return res
+
+
+def _rank_in_sorted(win, value):
+    left = bisect.bisect_left(win, value)
+    return left + (bisect.bisect_right(win, value) - left + 1) / 2.0
+
+
+def rolling_rank(x, window):
+    """
+    Rank (start from 1) of the latest value in its window, ties get the average rank,
+    the same as rank of the last element of each window by pd.Series.rank.
+
+    Cost is O(n_dates * n_symbols * window) vectorized flops for window <= _RANK_SCAN_MAX_WINDOW,
+    and O(n_dates * n_symbols * log(window)) comparisons by a sorted window for larger windows.
+
+    """
+    arr = _as_2d(x)
+    window = _check_window(window)
+
+    def fill(out):
+        if window > _RANK_SCAN_MAX_WINDOW:
+            out[:] = _sorted_scan(arr, window, _rank_in_sorted)
+            return
+        last = arr[window - 1:]
+        n_less = np.zeros(out.shape, dtype=np.float64)
+        n_equal = np.zeros(out.shape, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            for k, view in _shifted_scan(arr, window):
+                n_less += view < last
+                n_equal += view == last
+        out[:] = n_less + (n_equal + 1) / 2.0
+
+    return _order_result(arr, window, fill)
+
+
+def _block_arg_max(arr, window):
+    """
+    Row index of the maximum (the earliest if tied) of each full window, by the same blocks as _block_extreme:
+    the prefix / suffix maximum of a block is cumulative, and its position is where the cumulative maximum
+    was last raised (prefix) or the nearest raise on the right (suffix). O(n_dates * n_symbols) in total.
+    arr must not contain NaN. Return (n_dates - window + 1, n_symbols) int array.
+
+    """
+    n_rows, n_cols = arr.shape
+    n_blocks = -(-n_rows // window)
+    padded = np.empty((n_blocks * window, n_cols), dtype=np.float64)
+    padded[:n_rows] = arr
+    padded[n_rows:] = -np.inf
+    blocks = padded.reshape(n_blocks, window, n_cols)
+    local = np.arange(window).reshape(1, window, 1)
+    block_start = (np.arange(n_blocks) * window).reshape(n_blocks, 1, 1)
+
+    prefix = np.maximum.accumulate(blocks, axis=1)
+    raised = np.ones(blocks.shape, dtype=bool)
+    raised[:, 1:] = blocks[:, 1:] > prefix[:, :-1]  # strict, so the earliest one is kept in ties
+    prefix_pos = np.maximum.accumulate(np.where(raised, local, 0), axis=1) + block_start
+
+    rev = blocks[:, ::-1]
+    suffix = np.maximum.accumulate(rev, axis=1)
+    raised[:, 1:] = rev[:, 1:] >= suffix[:, :-1]  # not strict, an earlier one wins ties
+    suffix_pos = (window - 1 - np.maximum.accumulate(np.where(raised, local, 0), axis=1))[:, ::-1] + block_start
+    suffix = suffix[:, ::-1]
+
+    prefix, prefix_pos, suffix, suffix_pos = [a.reshape(-1, n_cols)
+                                              for a in (prefix, prefix_pos, suffix, suffix_pos)]
+    n_out = n_rows - window + 1
+    left, right = suffix[:n_out], prefix[window - 1:n_rows]
+    return np.where(left >= right, suffix_pos[:n_out], prefix_pos[window - 1:n_rows])
+
+
+def _rolling_arg_extreme(arr, window):
+    def fill(out):
+        filled = np.where(np.isnan(arr), -np.inf, arr)  # windows with NaN are set to NaN afterwards
+        pos = _block_arg_max(filled, window)
+        out[:] = pos - np.arange(out.shape[0]).reshape(-1, 1) + 1
+
+    return _order_result(arr, window, fill)
+
+
+def rolling_argmax(x, window):
+    """
+    Position (1 is the earliest, window is the latest) of the maximum in each window, the earliest if tied.
+    O(n_dates * n_symbols) no matter how large the window is.
+
+    """
+    arr = _as_2d(x)
+    window = _check_window(window)
+    return _rolling_arg_extreme(arr, window)
+
+
+def rolling_argmin(x, window):
+    """
+    Position (1 is the earliest, window is the latest) of the minimum in each window, the earliest if tied.
+    O(n_dates * n_symbols) no matter how large the window is.
+
+    """
+    arr = _as_2d(x)
+    window = _check_window(window)
+    return _rolling_arg_extreme(-arr, window)
+
+
+# max number of elements of window copies partitioned at once
+_MAX_BLOCK_ELEMENTS = 1 << 22
+
+
+def rolling_quantile(x, window, q):
+    """
+    q-th quantile (0 <= q <= 1) of each window with linear interpolation, the same as np.percentile(w, q * 100).
+
+    For window <= _QUANTILE_SCAN_MAX_WINDOW, windows are strided views (n_windows, window, n_symbols) of the array,
+    which are copied and partitioned (O(window) per window) in blocks of rows to bound the memory.
+    Larger windows use a sorted window, O(n_dates * n_symbols * log(window)) comparisons.
+
+    """
+    arr = _as_2d(x)
+    window = _check_window(window)
+    q = float(q)
+    if not 0.0 <= q <= 1.0:
+        raise ValueError("q must be in [0, 1], but we have {}".format(q))
+
+    pos = q * (window - 1)
+    lo = int(np.floor(pos))
+    hi = min(lo + 1, window - 1)
+    frac = pos - lo
+
+    def in_sorted(win, value):
+        if frac == 0:
+            return win[lo]
+        return win[lo] + (win[hi] - win[lo]) * frac
+
+    def fill(out):
+        if window > _QUANTILE_SCAN_MAX_WINDOW:
+            with np.errstate(invalid='ignore'):
+                out[:] = _sorted_scan(arr, window, in_sorted)
+            return
+        filled = np.where(np.isnan(arr), 0.0, arr)  # windows with NaN are set to NaN afterwards
+        n_out, n_cols = out.shape
+        stride_row, stride_col = filled.strides
+        windows = np.lib.stride_tricks.as_strided(filled, shape=(n_out, window, n_cols),
+                                                  strides=(stride_row, stride_row, stride_col))
+        block = max(1, _MAX_BLOCK_ELEMENTS // (window * max(n_cols, 1)))
+        for start in range(0, n_out, block):
+            part = np.partition(windows[start: start + block], sorted({lo, hi}), axis=1)
+            if frac == 0:
+                out[start: start + block] = part[:, lo]
+            else:
+                with np.errstate(invalid='ignore'):
+                    out[start: start + block] = part[:, lo] + (part[:, hi] - part[:, lo]) * frac
+
+    return _order_result(arr, window, fill)
+
+
+def rolling_median(x, window):
+    return rolling_quantile(x, window, 0.5)
+
+
+# -----------------------------------------------------
+# weighted windows
+_weights_cache = {}
+
+
+def decay_linear_weights(window):
+    """Normalized weights 1, 2, ..., window (the latest date has the largest weight)."""
+    window = _check_window(window)
+    key = ('linear', window)
+    if key not in _weights_cache:
+        w = np.arange(1, window + 1, dtype=np.float64)
+        w /= w.sum()
+        w.flags.writeable = False
+        _weights_cache[key] = w
+    return _weights_cache[key]
+
+
+def decay_exp_weights(window, f):
+    """Normalized weights f^(window-1), ..., f, 1 (the latest date has weight 1 before normalization)."""
+    window = _check_window(window)
+    key = ('exp', window, float(f))
+    if key not in _weights_cache:
+        w = np.power(float(f), np.arange(window - 1, -1, -1, dtype=np.float64))
+        w /= w.sum()
+        w.flags.writeable = False
+        _weights_cache[key] = w
+    return _weights_cache[key]
+
+
+def rolling_weighted_sum(x, weights):
+    """
+    Weighted sum of each window, weights[0] is for the earliest date in the window.
+
+    The window at row t is the strided view x[t - window + 1: t + 1], so the result is
+    the sum of window shifted views of the whole array times a scalar weight each:
+    O(n_dates * n_symbols * window) flops with no Python call per window or per symbol.
+
+    NaN policy is the same as other kernels: NaN if the window is not full or has any NaN
+    (NaN propagates through multiplication and addition). inf is kept as in np.dot.
+
+    """
+    arr = _as_2d(x)
+    weights = np.asarray(weights, dtype=np.float64).ravel()
+    window = _check_window(len(weights))
+    n_rows = arr.shape[0]
+
+    res = np.empty(arr.shape, dtype=np.float64)
+    res.fill(np.nan)
+    if window > n_rows:
+        return res
+
+    n_out = n_rows - window + 1
+    out = res[window - 1:]
+    np.multiply(arr[:n_out], weights[0], out=out)
+    tmp = np.empty_like(out)
+    for k in range(1, window):
+        np.multiply(arr[k: k + n_out], weights[k], out=tmp)
+        out += tmp
+    return res
+
+
+def decay_linear(x, window):
+    return rolling_weighted_sum(x, decay_linear_weights(window))
+
+
+def decay_exp(x, f, window):
+    return rolling_weighted_sum(x, decay_exp_weights(window, f))
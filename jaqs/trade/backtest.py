@@ -261,8 +261,7 @@ class AlphaBacktestInstance_dv(BacktestInstance):
     def get_univ_prices(self, field_name='close'):
         dv = self.ctx.dataview
         df = dv.get_snapshot(self.current_date, fields=field_name)
-        gp = df.groupby(by='symbol')
-        return {sec: df for sec, df in gp}
+        return {sec: df.iloc[i: i + 1] for i, sec in enumerate(df.index.values)}
     
     def _is_trade_date(self, date):
         return date in self.ctx.dataview.dates
@@ -292,10 +291,9 @@ class AlphaBacktestInstance_dv(BacktestInstance):
         self.last_date = self.ctx.calendar.get_last_trade_date(self.current_date)
     
     def get_suspensions(self):
-        trade_status = self.ctx.dataview.get_snapshot(self.current_date, fields='trade_status')
-        trade_status = trade_status.loc[:, 'trade_status']
-        mask_sus = trade_status != u'交易'.encode('utf-8')
-        return list(trade_status.loc[mask_sus].index.values)
+        symbols, dic = self.ctx.dataview.get_snapshot_arrays(self.current_date, fields='trade_status')
+        mask_sus = dic['trade_status'] != u'交易'.encode('utf-8')
+        return list(symbols[mask_sus])
 
     def on_new_day(self, date):
         self.ctx.trade_date = date
@@ -63,8 +63,8 @@ def convert_datetime_to_int(dt):
     return res
 
 
-def shift(date, n_weeks=0):
-    """Shift date backward or forward for n weeks.
+def shift(date, n_weeks=0, n_days=0):
+    """Shift date backward or forward for n weeks and n days.
     
     Parameters
     ----------
@@ -73,13 +73,16 @@ def shift(date, n_weeks=0):
     n_weeks : int, optional
         Positive for increasing date, negative for decreasing date.
         Default 0 (no shift).
+    n_days : int, optional
+        Positive for increasing date, negative for decreasing date.
+        Default 0 (no shift).
     
     Returns
     -------
     res : int or datetime
     
     """
-    delta = pd.Timedelta(weeks=n_weeks)
+    delta = pd.Timedelta(weeks=n_weeks, days=n_days)
     
     is_int = isinstance(date, (int, np.integer))
     if is_int:
@@ -56,6 +56,82 @@ def test_align():
     assert abs(df_res.loc[20170427, sec] - 42360000000) < 1
 
 
+
+def test_align_multiple_fields():
+    import numpy as np
+    from jaqs.data.align import align
+    
+    df_ann = pd.DataFrame({'000001.SZ': [20160425, 20160826, np.nan],
+                           '600000.SH': [20160428, 20160830, 20161028]})
+    df_value1 = pd.DataFrame({'000001.SZ': [1.0, 2.0, 3.0],
+                              '600000.SH': [10.0, 20.0, 30.0]})
+    df_value2 = df_value1 * 2
+    date_arr = [20160101, 20160426, 20160829, 20161031]
+    
+    dic_res = align({'v1': df_value1, 'v2': df_value2}, df_ann, date_arr)
+    df_res = align(df_value1, df_ann, date_arr)
+    
+    assert np.isnan(df_res.loc[20160101, '000001.SZ'])
+    assert df_res.loc[20160426, '000001.SZ'] == 1.0
+    assert np.isnan(df_res.loc[20160426, '600000.SH'])
+    assert df_res.loc[20160829, '000001.SZ'] == 2.0
+    assert df_res.loc[20161031, '000001.SZ'] == 2.0  # ann_date of the third quarter is missing
+    assert df_res.loc[20161031, '600000.SH'] == 30.0
+    assert dic_res['v1'].equals(df_res)
+    assert dic_res['v2'].equals(df_res * 2)
+
+
+def test_align_push_down():
+    import numpy as np
+    from jaqs.data import align as align_module
+    
+    df_ann = pd.DataFrame({'000001.SZ': [20160425, 20160826, 20161027],
+                           '600000.SH': [20160428, 20160830, 20161028]})
+    df_eps = pd.DataFrame({'000001.SZ': [1.0, 2.0, 3.0],
+                           '600000.SH': [10.0, 20.0, 30.0]})
+    date_arr = np.array([20160101, 20160426, 20160829, 20160831, 20161031])
+    df_close = pd.DataFrame(index=date_arr, columns=df_eps.columns, data=2.0)
+    values = {'eps': df_eps, 'close': df_close}
+    
+    parser = Parser()
+    parser.parse('Delta(eps, 1) * close + eps / close - Rank(eps)')
+    freqs, expand_args = parser.get_frequencies(parser.plan, values, date_arr)
+    # eps is expanded once for both daily consumers, Delta is evaluated on quarterly data then expanded
+    expanded = set(parser.plan.children[i][k] for i, args in expand_args.items() for k in args)
+    assert sorted(parser.plan.nodes[j].expr for j in expanded) == ['Delta(eps, 1)', 'eps']
+    assert freqs[parser.plan.output_pos[0]] == 'd'
+    
+    df_res = parser.evaluate(values, df_ann, date_arr)
+    eps = align_module.align(df_eps, df_ann, date_arr)
+    delta = align_module.align(df_eps.diff(1), df_ann, date_arr)
+    expected = delta * df_close + eps / df_close - eps.rank(axis=1)
+    assert np.allclose(df_res.values, expected.values, equal_nan=True)
+    assert parser.align_cache.misses == 1
+    
+    parser.evaluate(values, df_ann, date_arr)
+    assert parser.align_cache.hits == 1
+    parser.evaluate({'eps': df_eps + 1, 'close': df_close}, df_ann, date_arr)
+    assert parser.align_cache.misses == 2
+
+
+def test_expanded_cache():
+    import numpy as np
+    from jaqs.data.align import ExpandedCache
+    
+    cache = ExpandedCache(max_bytes=2 * 800)
+    a, b, c = np.zeros(100), np.ones(100), np.ones(100) * 2  # 800 bytes each
+    assert cache.get('a') is None
+    cache.put('a', a)
+    cache.put('b', b)
+    assert cache.get('a') is a
+    cache.put('c', c)  # 'b' is least recently used
+    assert 'b' not in cache and 'a' in cache and cache.nbytes == 1600
+    cache.put('big', np.zeros(1000))
+    assert 'big' not in cache
+    cache.invalidate('a')
+    assert cache.info() == {'hits': 1, 'misses': 1, 'size': 1, 'nbytes': 800, 'max_bytes': 1600}
+
+
 if __name__ == "__main__":
     import time
     t_start = time.time()
@@ -0,0 +1,93 @@
+# encoding: utf-8
+import numpy as np
+import pandas as pd
+
+from jaqs.data import array_backend
+from jaqs.data.py_expression_eval import Parser
+
+
+def _make_values():
+    rs = np.random.RandomState(5)
+    index = np.arange(20170101, 20170141)
+    columns = ['s{:d}'.format(i) for i in range(6)]
+    close = pd.DataFrame(np.abs(rs.randn(len(index), len(columns))) + 1, index=index, columns=columns)
+    close.iloc[3, 2] = np.nan
+    open_ = pd.DataFrame(np.abs(rs.randn(len(index), len(columns))) + 1, index=index, columns=columns)
+    group = pd.DataFrame(rs.randint(0, 2, close.shape), index=index, columns=columns)
+    return {'close': close, 'open': open_}, group
+
+
+def test_numpy_backend():
+    values, group = _make_values()
+    formulas = ['(close - open) / (close + open) * 2 + Sqrt(close * open)',
+                'If(close > open, Ts_Mean(close, 5), -Delay(close, 2))',
+                'Rank(Corr(close, open, 6)) + Standardize(Return(close, 3, 0))',
+                'GroupApply(Cutoff, Decay_linear(close, 4), 2.0) - IndustryNeutral(open)',
+                'close >= open && Abs(Delta(close, 1)) < 0.5']
+    for formula in formulas:
+        parser = Parser()
+        parser.parse(formula)
+        assert array_backend.supports(parser, parser.plan, values)
+        expected = parser.evaluate(values, df_group=group)
+        parser.backend = 'numpy'
+        res = parser.evaluate(values, df_group=group)
+        expected = expected.reindex(index=res.index, columns=res.columns)
+        assert np.allclose(res.values, expected.values, equal_nan=True)
+
+
+def test_buffer_reuse():
+    values, _ = _make_values()
+    parser = Parser()
+    parser.parse('close * 2 + 1 - close / 3 + close * close')
+    pool_sizes = []
+
+    class Pool(array_backend.BufferPool):
+        def __init__(self, shape, dtype=np.float64):
+            super(Pool, self).__init__(shape, dtype)
+            pool_sizes.append(self)
+
+    old_pool, array_backend.BufferPool = array_backend.BufferPool, Pool
+    try:
+        parser.backend = 'numpy'
+        res = parser.evaluate(values)
+    finally:
+        array_backend.BufferPool = old_pool
+    # 6 arithmetic nodes, a few buffers
+    assert pool_sizes[0].n_allocated <= 3
+    close = values['close'].values
+    assert np.allclose(res.values, close * 2 + 1 - close / 3 + close * close, equal_nan=True)
+
+
+def test_fallback():
+    values, _ = _make_values()
+    values['pe'] = values['close'].iloc[::5]  # another frequency
+    parser = Parser()
+    parser.parse('close + open')
+    assert not array_backend.supports(parser, parser.plan, values)
+    parser.parse('ConditionRank(close, open > 1, 2)')
+    assert not array_backend.supports(parser, parser.plan, {'close': values['close'], 'open': values['open']})
+
+
+def test_float32():
+    values, group = _make_values()
+    values['volume'] = values['open'] * 1e6  # float64 input is not cast
+    values['open'] = values['open'].astype(np.float32)
+    formula = 'Rank(Ts_Mean(close, 5) / open) + Sum(volume, 3) / 1000000 - If(close > open, close, open)'
+    parser = Parser()
+    parser.parse(formula)
+    expected = parser.evaluate(values)
+    for backend in ['pandas', 'numpy']:
+        parser.backend = backend
+        parser.dtype = np.float32
+        res = parser.evaluate(values)
+        assert (res.dtypes == np.float32).all()
+        assert np.allclose(res.values, expected.values, rtol=1e-5, equal_nan=True)
+        parser.dtype = None
+        assert (parser.evaluate(values).dtypes == np.float64).all()
+
+
+if __name__ == "__main__":
+    test_numpy_backend()
+    test_buffer_reuse()
+    test_fallback()
+    test_float32()
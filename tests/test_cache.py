@@ -0,0 +1,108 @@
+# encoding: utf-8
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data.cache import ResponseCache
+
+
+def _make_frame(n=10):
+    return pd.DataFrame({'symbol': ['600030.SH'] * n,
+                         'trade_date': np.arange(20170101, 20170101 + n),
+                         'close': np.linspace(10.0, 11.0, n)}, columns=['symbol', 'trade_date', 'close'])
+
+
+def test_get_put():
+    folder = tempfile.mkdtemp()
+    try:
+        cache = ResponseCache(folder)
+        params = {'view': 'lb.income', 'fields': 'oper_rev',
+                  'filter': 'symbol=600030.SH&start_date=20160101&end_date=20170101'}
+        assert cache.get('jset.query', params) is None
+        
+        df = _make_frame()
+        cache.put('jset.query', params, df, '0,')
+        cache.put('jset.query', dict(params, fields='tot_profit'), None, '-1,timeout')
+        assert len(cache) == 1
+        
+        # order of filter conditions does not matter
+        params2 = dict(params, filter='end_date=20170101&symbol=600030.SH&start_date=20160101')
+        res, msg = cache.get('jset.query', params2)
+        assert msg == '0,'
+        assert res.equals(df)
+        assert cache.get('jset.query', dict(params, fields='tot_profit')) is None
+        assert cache.info()['hits'] == 1 and cache.info()['misses'] == 2
+        
+        # shared by another cache on the same folder
+        res, msg = ResponseCache(folder).get('jset.query', params)
+        assert res.equals(df)
+        
+        cache.enabled = False
+        assert cache.get('jset.query', params) is None
+        cache.enabled = True
+        cache.clear()
+        assert len(cache) == 0 and cache.get('jset.query', params) is None
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_evict_and_expire():
+    folder = tempfile.mkdtemp()
+    try:
+        df = _make_frame(1000)
+        cache = ResponseCache(folder, ttl=0.0)
+        cache.put('jsd.query', {'symbol': 'a', 'end_date': 20170101}, df, '0,')
+        cache.max_bytes = cache.nbytes * 2 + 1
+        cache.put('jsd.query', {'symbol': 'b', 'end_date': 20170101}, df, '0,')
+        time.sleep(0.05)
+        assert cache.get('jsd.query', {'symbol': 'a', 'end_date': 20170101}) is not None
+        cache.put('jsd.query', {'symbol': 'c', 'end_date': 20170101}, df, '0,')
+        # b is least recently used
+        assert len(cache) == 2
+        assert cache.get('jsd.query', {'symbol': 'b', 'end_date': 20170101}) is None
+        assert cache.get('jsd.query', {'symbol': 'a', 'end_date': 20170101}) is not None
+        
+        # results of recent dates expire
+        cache.put('jsd.query', {'symbol': 'a', 'end_date': 99991231}, df, '0,')
+        time.sleep(0.05)
+        assert cache.get('jsd.query', {'symbol': 'a', 'end_date': 99991231}) is None
+    finally:
+        shutil.rmtree(folder)
+
+
+
+def test_shared_folder():
+    folder = tempfile.mkdtemp()
+    try:
+        df = _make_frame(1000)
+        cache1, cache2 = ResponseCache(folder), ResponseCache(folder)
+        cache1.put('jsd.query', {'symbol': 'a'}, df, '0,')
+        time.sleep(0.05)
+        cache2.put('jsd.query', {'symbol': 'b'}, df, '0,')
+        # entries of both are kept and counted by both
+        assert len(cache1) == len(cache2) == 2
+        assert cache1.nbytes == cache2.nbytes
+        assert cache2.get('jsd.query', {'symbol': 'a'})[0].equals(df)
+        time.sleep(0.05)
+        
+        # access by cache2 is seen by eviction of cache1
+        cache1.max_bytes = cache1.nbytes + 100  # room for 2 entries
+        cache1.put('jsd.query', {'symbol': 'c'}, df, '0,')
+        assert len(cache2) == 2
+        assert cache2.get('jsd.query', {'symbol': 'b'}) is None
+        assert cache2.get('jsd.query', {'symbol': 'a'}) is not None
+        # no file escapes the size limit
+        files = [fn for fn in os.listdir(folder) if not os.path.isdir(os.path.join(folder, fn))]
+        assert len(files) == 2
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_get_put()
+    test_evict_and_expire()
+    test_shared_folder()
@@ -185,6 +185,64 @@ def test_remote_data_service_inst_info():
     assert res.loc[0, 'multiplier'] == 1
     assert abs(res.loc[0, 'pricetick'] - 0.01) < 1e-2
     assert res.loc[0, 'buylot'] == 100
+
+
+def test_remote_data_service_batches():
+    import pandas as pd
+    
+    ds = RemoteDataService.__new__(RemoteDataService)  # no login
+    ds.symbol_batch_size, ds.date_batch_days, ds.n_workers, ds.n_retries, ds.retry_wait = 2, 10, 4, 1, 0.0
+    
+    assert ds._split_dates(20170101, 20170125, 10) == [(20170101, 20170110), (20170111, 20170120),
+                                                        (20170121, 20170125)]
+    assert ds._split_symbol('a,b,c', 2) == ['a,b', 'c']
+    
+    calls = []
+    
+    def query(symbol, start_date, end_date):
+        calls.append((symbol, start_date))
+        if symbol == 'c' and calls.count((symbol, start_date)) == 1:
+            return None, '-1,timeout'  # succeed when retried
+        if symbol == 'd' and start_date == 20170111:
+            raise IOError("timeout")
+        return pd.DataFrame({'symbol': symbol.split(','), 'start_date': start_date}), '0,'
+    
+    df, msg = ds._query_batches(query, 'a,b,c', 20170101, 20170125)
+    assert msg == '0,'
+    assert len(calls) == 9
+    assert df.shape == (9, 2)
+    assert list(df['symbol'].values[:3]) == ['a', 'b', 'a']
+    
+    df, msg = ds._query_batches(query, 'd', 20170101, 20170125)
+    assert msg.startswith('-1,IOError: timeout [1 of 3 batches failed')
+    assert list(df['start_date']) == [20170101, 20170121]
+
+
+def test_remote_data_service_adjusted_batches():
+    import pandas as pd
+    
+    ds = RemoteDataService.__new__(RemoteDataService)  # no login
+    ds.symbol_batch_size, ds.date_batch_days, ds.n_workers, ds.n_retries, ds.retry_wait = 2, 10, 4, 0, 0.0
+    
+    class Api(object):
+        def __init__(self):
+            self.calls = []
+        
+        def daily(self, symbol, start_date, end_date, fields, adjust_mode, data_format):
+            self.calls.append((symbol, start_date, end_date, adjust_mode))
+            return pd.DataFrame({'symbol': symbol.split(','), 'trade_date': start_date}), '0,'
+    
+    ds.api = Api()
+    # adjusted prices depend on end_date of the query, so dates are not split
+    df, msg = ds.daily('a,b,c', 20170101, 20170125, adjust_mode='pre')
+    assert msg == '0,'
+    assert sorted(ds.api.calls) == [('a,b', 20170101, 20170125, 'pre'), ('c', 20170101, 20170125, 'pre')]
+    
+    ds.api.calls = []
+    df, msg = ds.daily('a,b,c', 20170101, 20170125, adjust_mode=None)
+    assert msg == '0,'
+    assert len(ds.api.calls) == 6
+
     
 if __name__ == "__main__":
     import time
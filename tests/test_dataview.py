@@ -95,6 +95,72 @@ def test_add_formula():
     assert dv.data_d.shape == (nrows, ncols + 2 * n_securities)
 
 
+def test_add_formulas():
+    dv = DataView()
+    folder_path = '../output/prepared/20160601_20170601_freq=1D'
+    dv.load_dataview(folder=folder_path)
+    nrows, ncols = dv.data_d.shape
+    n_securities = len(dv.data_d.columns.levels[0])
+    
+    formulas = {'myvar3': 'Delta(high - close, 1)',
+                'myvar4': 'myvar3 - close'}
+    dv.add_formulas(formulas, is_quarterly=False)
+    assert dv.data_d.shape == (nrows, ncols + 2 * n_securities)
+    
+    df3 = dv.get_ts('myvar3')
+    df4 = dv.get_ts('myvar4')
+    df_close = dv.get_ts('close')
+    assert ((df4 - (df3 - df_close)).abs() < 1e-8).values[1:].all()
+
+def test_formula_warm_up():
+    from jaqs.data.dataservice import RemoteDataService
+    
+    ds = RemoteDataService()
+    dv = DataView()
+    
+    props = {'start_date': 20170605, 'end_date': 20170630, 'symbol': '600030.SH,000063.SZ',
+             'fields': 'close', 'freq': 1,
+             'formulas': {'ma60': 'Ts_Mean(close, 60)'}}
+    dv.init_from_config(props, data_api=ds)
+    
+    dates = ds.get_trade_date(dv.extended_start_date_d, dv.start_date)
+    assert len(dates[dates < dv.start_date]) == 59
+    
+    dv.prepare_data()
+    df_ma = dv.get_ts('ma60')
+    assert df_ma.notnull().values.all()
+    
+    # quarterly lookback at start_date
+    props['formulas'] = {'rev_d2': 'Delay(total_oper_rev, 2)', 'rev_ma4': 'Ts_Mean(total_oper_rev, 4)'}
+    dv = DataView()
+    dv.init_from_config(props, data_api=ds)
+    dv.prepare_data()
+    for field in ['rev_d2', 'rev_ma4']:
+        assert dv.get_ts(field, start_date=dv.start_date).notnull().values.all()
+
+
+def test_quarterly_warm_up():
+    import pandas as pd
+    from jaqs.data.dataview import ANN_LAG_DAYS
+    
+    dv = DataView()
+    assert dv._get_warm_up({'x': 'Delay(total_oper_rev, 2)'})[1] == 2
+    assert dv._get_warm_up({'x': 'Ts_Mean(total_oper_rev, 4)'})[1] == 3
+    
+    period_ends = pd.date_range('2013-01-01', '2018-12-31', freq='Q')
+    for start in pd.date_range('2016-01-01', '2017-12-31', freq='D'):
+        dv.start_date = int(start.strftime('%Y%m%d'))
+        for n_quarters in [0, 2, 3]:
+            extended = dv._get_extended_start_date_q(n_quarters)
+            # latest report announced before start_date, if all reports are announced as late as possible
+            latest = max(i for i, dt in enumerate(period_ends) if dt + pd.Timedelta(days=ANN_LAG_DAYS) <= start)
+            # a report is announced after its period ends, so its ann_date is not earlier than extended
+            needed = int(period_ends[latest - n_quarters].strftime('%Y%m%d'))
+            assert extended <= needed
+            # and not more than one quarter earlier
+            assert extended >= int(period_ends[latest - n_quarters - 1].strftime('%Y%m%d'))
+
+
 def test_dataview_universe():
     from jaqs.data.dataservice import RemoteDataService
 
@@ -177,14 +243,208 @@ def test_q_add_formula():
     assert not df2.empty
 
 
+def test_update():
+    import pytest
+    from jaqs.data.dataservice import RemoteDataService
+    
+    ds = RemoteDataService()
+    props = {'start_date': 20170301, 'end_date': 20170601, 'universe': '000016.SH',
+             'fields': 'open,close,pb,total_oper_rev', 'freq': 1,
+             'formulas': {'ma5': 'Ts_Mean(close, 5)'}}
+    dv_full = DataView()
+    dv_full.init_from_config(props, data_api=ds)
+    dv_full.prepare_data()
+    dv_full.append_df(dv_full.get_ts('close') * 2, 'close2')
+    dv_full.add_formula('ma3', 'Ts_Mean(close2, 3)', is_quarterly=False, chunk_size=20)
+    
+    props['end_date'] = 20170501
+    dv = DataView()
+    dv.init_from_config(props, data_api=ds)
+    dv.prepare_data()
+    dv.append_df(dv.get_ts('close') * 2, 'close2')
+    dv.add_formula('ma3', 'Ts_Mean(close2, 3)', is_quarterly=False, chunk_size=20)
+    # appended fields can not be queried
+    with pytest.raises(ValueError):
+        dv.update(20170601)
+    dv.update(20170601, custom_data={'close2': dv_full.get_ts('close2')})
+    
+    assert dv.end_date == 20170601
+    assert (dv.dates == dv_full.dates).all()
+    assert dv.symbol == dv_full.symbol
+    for field in ['ma5', 'ma3']:
+        df, df_full = dv.get_ts(field), dv_full.get_ts(field)
+        assert ((df - df_full).abs() < 1e-8).values[df_full.notnull().values].all()
+    df, df_full = dv.get_ts('total_oper_rev'), dv_full.get_ts('total_oper_rev')
+    assert ((df - df_full).abs() < 1e-8).values[df_full.notnull().values].all()
+
+
+def test_run_queries():
+    import time
+    import pytest
+    
+    def query(x):
+        time.sleep(0.2)
+        return x
+    
+    def fail():
+        raise IOError("timeout")
+    
+    dv = DataView()
+    queries = {'a': lambda: query(1), 'b': lambda: query(2), 'c': lambda: query(3)}
+    t = time.time()
+    assert dv._run_queries(queries) == {'a': 1, 'b': 2, 'c': 3}
+    assert time.time() - t < 0.5
+    
+    queries.update({'d': fail, 'e': fail})
+    with pytest.raises(ValueError) as e:
+        dv._run_queries(queries)
+    assert '[d] IOError: timeout' in str(e.value) and '[e] IOError: timeout' in str(e.value)
+
+
+
+def test_update_failed():
+    import numpy as np
+    import pandas as pd
+    import pytest
+    
+    class FailingApi(object):
+        """Trade dates are available, but daily queries fail."""
+        def __init__(self):
+            self.n_daily = 0
+        
+        def get_trade_date(self, start_date, end_date, symbol=None, is_datetime=False):
+            dates = np.array([int(d.strftime('%Y%m%d')) for d in pd.bdate_range('2017-01-01', '2017-02-28')])
+            return dates[(dates >= start_date) & (dates <= end_date)]
+        
+        def daily(self, symbol, start_date, end_date, adjust_mode=None, fields=""):
+            self.n_daily += 1
+            return None, '-1,timeout'
+    
+    index = pd.Index(np.arange(20170103, 20170113), name='trade_date')
+    columns = pd.MultiIndex.from_product([['000001.SZ', '600030.SH'], ['close', 'open']], names=['symbol', 'field'])
+    dv = DataView()
+    dv.data_d = pd.DataFrame(np.random.randn(len(index), len(columns)), index=index, columns=columns)
+    dv.fields = ['close', 'open']
+    dv.symbol = ['000001.SZ', '600030.SH']
+    dv.start_date, dv.end_date = 20170103, 20170112
+    
+    api = FailingApi()
+    n_daily = 0
+    for _ in range(2):
+        # nothing is changed by a failed update, so a retry queries again
+        with pytest.raises(ValueError):
+            dv.update(20170131, data_api=api)
+        assert api.n_daily > n_daily
+        n_daily = api.n_daily
+        assert dv.end_date == 20170112
+        assert dv.symbol == ['000001.SZ', '600030.SH']
+        assert (dv.dates == index.values).all()
+        assert dv.get_ts('close').shape == (len(index), 2)
+
+def test_query_partial():
+    import pandas as pd
+    import pytest
+    from jaqs.data.dataservice import RemoteDataService
+    
+    class BatchApi(object):
+        """daily is queried one symbol at a time, queries of symbol 'b' fail."""
+        def __init__(self):
+            self.ds = RemoteDataService.__new__(RemoteDataService)  # no login
+            self.ds.symbol_batch_size, self.ds.date_batch_days, self.ds.n_workers = 1, 0, 2
+            self.ds.n_retries, self.ds.retry_wait = 0, 0.0
+        
+        def daily(self, symbol, start_date, end_date, adjust_mode=None, fields=""):
+            def query(symbol, start, end):
+                if symbol == 'b':
+                    return None, '-1,timeout'
+                df = pd.DataFrame({'trade_date': [start, end]})
+                for col in ['open', 'high', 'low', 'close']:
+                    df[col] = 1.0
+                df['symbol'] = symbol
+                return df, '0,'
+            return self.ds._query_batches(query, symbol, start_date, end_date)
+    
+    dv = DataView()
+    dv.data_api = BatchApi()
+    dv.extended_start_date_d, dv.end_date = 20170103, 20170110
+    
+    # symbols of failed batches must not be missing silently
+    with pytest.raises(ValueError) as e:
+        dv._query_data(['a', 'b'], ['close'])
+    assert '[market_daily] -1,timeout [1 of 2 batches failed' in str(e.value)
+    with pytest.raises(ValueError):
+        dv._query_data(['b'], ['close'])
+    
+    dv.allow_partial = True
+    dic_daily = dv._query_data(['a', 'b'], ['close'])[0]
+    assert list(dic_daily.keys()) == ['a']
+    assert 'close_adj' in dic_daily['a']
+    assert dv._query_data(['b'], ['close'])[0] is None
+
+
+def test_add_group_formula():
+    import numpy as np
+    import pandas as pd
+    from jaqs.data.py_expression_eval import Parser
+    
+    rs = np.random.RandomState(3)
+    index = pd.Index(np.arange(20170103, 20170113), name='trade_date')
+    symbols = ['000001.SZ', '000002.SZ', '600000.SH', '600030.SH']
+    columns = pd.MultiIndex.from_product([symbols, ['close']], names=['symbol', 'field'])
+    dv = DataView()
+    dv.data_d = pd.DataFrame(rs.randn(len(index), len(columns)), index=index, columns=columns)
+    dv.fields = ['close']
+    dv.symbol = symbols
+    dv._data_group = pd.DataFrame([['a', 'a', 'b', 'b']] * len(index), index=index, columns=symbols)
+    
+    for name, formula in [('std', 'GroupApply(Standardize, close)'), ('neutral', 'IndustryNeutral(close)')]:
+        dv.add_formula(name, formula, is_quarterly=False)
+        parser = Parser()
+        parser.parse(formula)
+        expected = parser.evaluate({'close': dv.get_ts('close')}, df_group=dv.data_group)
+        assert np.allclose(dv.get_ts(name).values, expected.values, equal_nan=True)
+
+
+def test_edit_data_d():
+    import numpy as np
+    import pandas as pd
+    import pytest
+    
+    index = pd.Index(np.arange(20170103, 20170113), name='trade_date')
+    columns = pd.MultiIndex.from_product([['000001.SZ', '600030.SH'], ['close', 'open']], names=['symbol', 'field'])
+    dv = DataView()
+    dv.data_d = pd.DataFrame(np.random.randn(len(index), len(columns)), index=index, columns=columns)
+    dv.fields = ['close', 'open']
+    dv.symbol = ['000001.SZ', '600030.SH']
+    
+    # data_d is a copy, modifying it does not change the DataView
+    df = dv.data_d
+    df.loc[:, pd.IndexSlice[:, 'close']] = -1.0
+    assert not (dv.data_d.loc[:, pd.IndexSlice[:, 'close']] == -1.0).any().any()
+    assert not (dv.get_ts('close') == -1.0).any().any()
+    
+    # set_field writes data
+    dv.set_field('close', df.loc[:, pd.IndexSlice[:, 'close']])
+    assert (dv.get_ts('close') == -1.0).all().all()
+    assert (dv.data_d.loc[:, pd.IndexSlice[:, 'close']] == -1.0).all().all()
+    assert not (dv.get_ts('open') == -1.0).any().any()
+    assert dv.fields == ['close', 'open']
+    
+    with pytest.raises(ValueError):
+        dv.set_field('high', df.loc[:, pd.IndexSlice[:, 'close']])
+
+
 if __name__ == "__main__":
     g = globals()
     g = {k: v for k, v in g.items() if k.startswith('test_') and callable(v)}
 
     # for test_name, test_func in g.viewitems():
     for test_name in ['test_write', 'test_load', 'test_add_field', 'test_add_formula_directly',
-                      'test_add_formula', 'test_dataview_universe',
-                      'test_q', 'test_q_get', 'test_q_add_field', 'test_q_add_formula']:
+                      'test_add_formula', 'test_add_formulas', 'test_formula_warm_up', 'test_quarterly_warm_up',
+                      'test_dataview_universe',
+                      'test_q', 'test_q_get', 'test_q_add_field', 'test_q_add_formula', 'test_update',
+                      'test_update_failed', 'test_run_queries',
+                      'test_query_partial', 'test_add_group_formula', 'test_edit_data_d']:
         test_func = g[test_name]
         print "\nTesting {:s}...".format(test_name)
         test_func()
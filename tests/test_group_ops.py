@@ -0,0 +1,108 @@
+# encoding: utf-8
+import numpy as np
+import pandas as pd
+
+from jaqs.data import group_ops
+
+
+def _make_data():
+    rs = np.random.RandomState(7)
+    index = np.arange(20170101, 20170131)
+    columns = ['s{:d}'.format(i) for i in range(12)]
+    df_value = pd.DataFrame(rs.randn(len(index), len(columns)), index=index, columns=columns)
+    df_value.iloc[2, 3] = np.nan
+    df_value.iloc[5, 1] = df_value.iloc[5, 2]  # ties
+    df_group = pd.DataFrame(rs.randint(0, 3, df_value.shape), index=index, columns=columns).astype(float)
+    df_group.iloc[4, 0] = np.nan
+    return df_value, df_group
+
+
+def _loop(df_value, df_group, func):
+    """Apply func on each group of each date with pandas."""
+    res = pd.DataFrame(np.nan, index=df_value.index, columns=df_value.columns)
+    for date in df_value.index:
+        row = df_value.loc[date]
+        for _, symbols in row.groupby(df_group.loc[date]).groups.items():
+            res.loc[date, symbols] = func(row[symbols])
+    return res
+
+
+def test_group_ops():
+    df_value, df_group = _make_data()
+    gi = group_ops.GroupIndex.from_group(df_group, df_value.index, df_value.columns)
+
+    expected = _loop(df_value, df_group, lambda s: s.rank())
+    assert np.allclose(group_ops.group_rank(df_value.values, gi), expected.values, equal_nan=True)
+
+    expected = _loop(df_value, df_group, lambda s: (s - s.mean()) / s.std())
+    assert np.allclose(group_ops.group_standardize(df_value.values, gi), expected.values, equal_nan=True)
+
+    expected = _loop(df_value, df_group, lambda s: s - s.mean())
+    assert np.allclose(group_ops.group_demean(df_value.values, gi), expected.values, equal_nan=True)
+
+    # symbol without group
+    assert np.isnan(group_ops.group_mean(df_value.values, gi)[4, 0])
+
+
+def test_static_group():
+    df_value, df_group = _make_data()
+    sr_group = df_group.iloc[0]
+    gi = group_ops.GroupIndex.from_group(sr_group, df_value.index, df_value.columns)
+    gi2 = group_ops.GroupIndex.from_group(df_group.iloc[[0]], df_value.index, df_value.columns)
+    assert (gi.seg == gi2.seg).all()
+
+    df_group_full = pd.DataFrame(np.tile(sr_group.values, (len(df_value), 1)),
+                                 index=df_value.index, columns=df_value.columns)
+    expected = _loop(df_value, df_group_full, lambda s: s.rank())
+    assert np.allclose(group_ops.group_rank(df_value.values, gi), expected.values, equal_nan=True)
+
+
+def test_group_cutoff():
+    df_value, df_group = _make_data()
+    df_value = df_value.fillna(0.0)
+    gi = group_ops.GroupIndex.from_group(df_group, df_value.index, df_value.columns)
+
+    def cutoff(s, z_score=1.0):
+        median = s.median()
+        mad = (s - median).abs().median()
+        return s.clip(median - z_score * mad, median + z_score * mad)
+
+    expected = _loop(df_value, df_group, cutoff)
+    assert np.allclose(group_ops.group_cutoff(df_value.values, gi, 1.0), expected.values, equal_nan=True)
+
+
+def test_group_neutralize():
+    df_value, df_group = _make_data()
+    rs = np.random.RandomState(8)
+    exog = rs.randn(*df_value.shape)
+    gi = group_ops.GroupIndex.from_group(df_group, df_value.index, df_value.columns)
+    res = group_ops.group_neutralize(df_value.values, gi, exog)
+
+    for i in [0, 2, 4]:
+        y = df_value.values[i]
+        g = df_group.values[i]
+        mask = ~np.isnan(y) & ~np.isnan(g)
+        dummies = (g[mask].reshape(-1, 1) == np.unique(g[mask])).astype(float)
+        a = np.hstack([dummies, exog[i, mask].reshape(-1, 1)])
+        beta = np.linalg.lstsq(a, y[mask], rcond=-1)[0]
+        assert np.allclose(res[i, mask], y[mask] - a.dot(beta))
+        assert np.isnan(res[i, ~mask]).all()
+
+
+def test_industry_neutral_formula():
+    from jaqs.data.py_expression_eval import Parser
+    
+    df_value, df_group = _make_data()
+    parser = Parser()
+    parser.parse('IndustryNeutral(close)')
+    res = parser.evaluate({'close': df_value}, df_group=df_group)
+    expected = _loop(df_value, df_group, lambda s: s - s.mean())
+    assert np.allclose(res.values, expected.values, equal_nan=True)
+
+
+if __name__ == "__main__":
+    test_group_ops()
+    test_static_group()
+    test_group_cutoff()
+    test_group_neutralize()
+    test_industry_neutral_formula()
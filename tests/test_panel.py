@@ -0,0 +1,124 @@
+# encoding: utf-8
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data.panel import PanelStore
+
+
+def _make_frame():
+    rs = np.random.RandomState(9)
+    index = pd.Index(np.arange(20170101, 20170121), name='trade_date')
+    columns = pd.MultiIndex.from_product([['000001.SZ', '600000.SH', '600030.SH'], ['close', 'open', 'volume']],
+                                         names=['symbol', 'field'])
+    return pd.DataFrame(rs.randn(len(index), len(columns)), index=index, columns=columns)
+
+
+def test_round_trip():
+    df = _make_frame()
+    store = PanelStore.from_frame(df)
+    assert store.fields == ['close', 'open', 'volume']
+    assert store.shape == (20, 3)
+
+    res = store.to_frame()
+    assert res.index.equals(df.index) and res.index.name == 'trade_date'
+    assert res.columns.equals(df.columns)
+    assert np.allclose(res.values, df.values)
+    res.iloc[:] = 0.0  # a copy
+    assert not (store.get_array('close') == 0.0).any()
+
+    sub = store.to_frame(['open'], symbols=['600030.SH', '000001.SZ'], start_date=20170105, end_date=20170110)
+    expected = df.loc[20170105: 20170110, pd.IndexSlice[['000001.SZ', '600030.SH'], ['open']]]
+    assert sub.columns.equals(expected.columns)
+    assert np.allclose(sub.values, expected.values)
+
+
+def test_frame_and_set():
+    df = _make_frame()
+    store = PanelStore.from_frame(df)
+
+    close = store.frame('close', start_date=20170103)
+    assert close.columns.name == 'symbol'
+    assert np.allclose(close.values, df.xs('close', level='field', axis=1).loc[20170103:].values)
+    close.iloc[:] = 0.0  # a copy
+    assert not (store.get_array('close') == 0.0).any()
+
+    # aligned by label: reversed columns, missing date
+    new = df.xs('open', level='field', axis=1).iloc[1:, ::-1] * 2
+    store.set('open2', new)
+    res = store.frame('open2')
+    assert np.isnan(res.values[0]).all()
+    assert np.allclose(res.values[1:], 2 * df.xs('open', level='field', axis=1).values[1:])
+    assert store.to_frame().shape == (20, 12)
+
+    store.astype('open2', np.float32)
+    assert store.get_array('open2').dtype == np.float32
+    store.drop('open2')
+    assert 'open2' not in store
+
+
+def test_snapshot():
+    df = _make_frame()
+    store = PanelStore.from_frame(df)
+
+    symbols, dic = store.snapshot(20170105, ['close', 'volume'])
+    assert list(symbols) == ['000001.SZ', '600000.SH', '600030.SH']
+    assert np.allclose(dic['close'], df.loc[20170105, pd.IndexSlice[:, 'close']].values)
+    assert not dic['close'].flags.writeable
+    assert np.may_share_memory(dic['close'], store.get_array('close'))
+
+    symbols, dic = store.snapshot(20170105, ['volume'], symbols=['600030.SH', '000001.SZ'])
+    assert list(symbols) == ['000001.SZ', '600030.SH']
+    assert np.allclose(dic['volume'], df.loc[20170105, pd.IndexSlice[['000001.SZ', '600030.SH'], 'volume']].values)
+
+
+def test_save_load():
+    df = _make_frame()
+    store = PanelStore.from_frame(df)
+    store.set('status', np.where(df.xs('close', level='field', axis=1).values > 0, 'up', 'down').astype(object))
+    folder = tempfile.mkdtemp()
+    try:
+        store.save(folder)
+        res = PanelStore.load(folder)
+        assert res.fields == store.fields
+        assert res.index.equals(store.index) and res.index.name == 'trade_date'
+        assert isinstance(res.get_array('close'), np.memmap)
+        assert (res.to_frame() == store.to_frame()).all().all()
+
+        res = PanelStore.load(folder, fields=['open', 'status'], symbols=['600030.SH'],
+                              start_date=20170103, end_date=20170110, mmap=False)
+        assert res.fields == ['open', 'status']
+        assert list(res.symbols) == ['600030.SH']
+        assert res.to_frame().equals(store.to_frame(['open', 'status'], symbols=['600030.SH'],
+                                                    start_date=20170103, end_date=20170110))
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_reindex_update():
+    df = _make_frame()
+    store = PanelStore.from_frame(df.iloc[:15])
+    whole = PanelStore.from_frame(df)
+
+    res = store.reindex(index=df.index, symbols=['000001.SZ', '000002.SZ', '600000.SH', '600030.SH'])
+    assert res.shape == (20, 4) and res.index.name == 'trade_date'
+    assert np.isnan(res.get_array('close')[15:]).all()
+    assert np.isnan(res.get_array('close')[:, 1]).all()
+
+    res.update(whole.select(['close', 'open'], start_date=20170116))
+    res.update(PanelStore.from_frame(df.iloc[:, :3] + 1).select(symbols=['000001.SZ']))
+    assert np.allclose(res.frame('open', symbols=['600000.SH', '600030.SH']).values,
+                       df.xs('open', level='field', axis=1).values[:, 1:])
+    assert np.allclose(res.frame('close', symbols=['000001.SZ']).values,
+                       df.loc[:, ('000001.SZ', 'close')].values[:, None] + 1)
+    assert np.isnan(res.get_array('volume')[15:, 1:]).all()
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_frame_and_set()
+    test_snapshot()
+    test_save_load()
+    test_reindex_update()
@@ -110,6 +110,140 @@ def test_calc_return():
     assert abs(res.loc[20170808, '000001.SH'] - 0.006067) < 1e-6
 
 
+def test_compiled_plan():
+    expr = parser.parse('Delay(close, 1) * Delay(close, 1) + 2 * 3')
+    plan = expr.plan
+    assert len([node for node in plan.nodes if node.name == 'Delay']) == 1
+    assert plan.root.children[1].kind == 'const' and plan.root.children[1].value == 6
+    res = parser.evaluate({'close': dfx})
+    res_expected = dfx.shift(1) * dfx.shift(1) + 6
+    assert (res - res_expected).abs().max().max() < 1e-8
+    # plan can be reused
+    res2 = parser.evaluate({'close': dfy})
+    assert abs(res2.iloc[-1, 0] - (dfy.iloc[-2, 0] ** 2 + 6)) < 1e-8
+
+
+def test_lookback_and_incremental():
+    parser.parse('Ts_Mean(Delay(close, 2), 5) + Delta(close, 1)')
+    assert parser.get_lookbacks() == [6]
+    res_full = parser.evaluate({'close': dfx})
+    res_old = res_full.iloc[:-3]
+    res_inc = parser.evaluate_incremental({'close': dfx}, res_old)
+    assert res_inc.index.equals(res_full.index)
+    assert ((res_inc - res_full).abs().max().max()) < 1e-8
+    
+    parser.parse('Ewma(close, 3)')
+    assert parser.get_lookbacks() == [None]
+    
+    # the warning names the formula, also if it was parsed from cache
+    Parser().parse('Ewma(open, 3)')
+    parser.parse('Ewma(open, 3)')
+    with pytest.warns(UserWarning, match=r'\[Ewma\(open, 3\)\] is unbounded'):
+        res_inc = parser.evaluate_incremental({'open': dfx}, res_old)
+    assert res_inc.shape == dfx.shape
+
+
+def test_chunked():
+    parser.parse('Ts_Mean(close, 3) - Delay(open, 2) + Rank(close)')
+    res_full = parser.evaluate({'close': dfx, 'open': dfy})
+    res_chunk = parser.evaluate_chunked({'close': dfx, 'open': dfy}, chunk_size=4)
+    assert res_chunk.index.equals(res_full.index)
+    assert ((res_chunk - res_full).abs().max().max()) < 1e-8
+    
+    # look-ahead
+    parser.parse('Ts_Mean(Delay(close, -1), 3) - Delay(open, -2)')
+    assert parser.get_lookbacks() == [2] and parser.get_lookaheads() == [2]
+    values = {'close': dfx.iloc[:30], 'open': dfy.iloc[:30]}
+    res_full = parser.evaluate(values)
+    res_chunk = parser.evaluate_chunked(values, chunk_size=7)
+    assert ((res_chunk - res_full).abs() < 1e-8).values[res_full.notnull().values].all()
+    assert (res_chunk.isnull() == res_full.isnull()).values.all()
+    res_inc = parser.evaluate_incremental(values, res_full.iloc[:-5])
+    assert ((res_inc - res_full).abs() < 1e-8).values[res_full.notnull().values].all()
+    assert (res_inc.isnull() == res_full.isnull()).values.all()
+
+
+def test_parallel():
+    from jaqs.data.py_expression_eval import PLAN_TS, PLAN_CS, PLAN_MIXED
+    
+    parser.parse('Rank(close) - Standardize(open)')
+    assert parser.classify_plan() == PLAN_CS
+    parser.parse('Rank(Ts_Mean(close, 3)) + Rank(Delta(open, 1))')
+    assert parser.classify_plan() == PLAN_MIXED
+    res = parser.evaluate({'close': dfx, 'open': dfy})
+    res_par = parser.evaluate_parallel({'close': dfx, 'open': dfy}, n_workers=2)
+    assert ((res_par - res).abs().max().max()) < 1e-8
+    
+    parser.parse('Ts_Mean(close, 3) - Delay(open, 2) * 2')
+    assert parser.classify_plan() == PLAN_TS
+    res = parser.evaluate({'close': dfx, 'open': dfy})
+    res_par = parser.evaluate_parallel({'close': dfx, 'open': dfy}, n_workers=2)
+    assert res_par.columns.equals(res.columns)
+    assert ((res_par - res).abs().max().max()) < 1e-8
+    
+    # no or a single symbol is evaluated serially
+    for cols in [[], dfx.columns[:1]]:
+        values = {'close': dfx.loc[:, cols], 'open': dfy.loc[:, cols]}
+        res_par = parser.evaluate_parallel(values, n_workers=4)
+        assert res_par.shape == (len(dfx), len(cols))
+
+
+def test_parse_cache():
+    from jaqs.data import py_expression_eval
+    
+    formula = 'Ts_Mean(close, 3) / open'
+    expr1 = Parser().parse(formula)
+    expr2 = Parser().parse(formula)
+    assert expr1.tokens is expr2.tokens
+    assert expr1.plan is expr2.plan
+    
+    # the same formula in another function name style is parsed again
+    parser_lower = Parser()
+    parser_lower.set_capital('lower')
+    expr3 = parser_lower.parse('ts_mean(close, 3) / open')
+    assert expr3.plan.root.expr == expr1.plan.root.expr.lower()
+    
+    assert py_expression_eval.get_parser() is py_expression_eval.get_parser('upper')
+    assert py_expression_eval.get_parser('lower').style == 'lower'
+    
+    parser.parse(formula)
+    res = parser.evaluate({'close': dfx, 'open': dfy})
+    shared = py_expression_eval.get_parser()
+    shared.parse(formula)
+    assert ((shared.evaluate({'close': dfx, 'open': dfy}) - res).abs().max().max()) < 1e-8
+    
+    # a copy is configured without affecting the shared parser
+    import numpy as np
+    copied = shared.copy()
+    copied.dtype = np.float32
+    assert copied.functions['Rank'].__self__ is copied
+    assert shared.functions['Rank'].__self__ is shared
+    assert copied.align_cache is not shared.align_cache
+    assert shared.dtype is None
+    copied.parse(formula)
+    assert copied.evaluate({'close': dfx, 'open': dfy}).values.dtype == np.float32
+
+
+def test_profile():
+    parser.parse('Rank(Ts_Mean(close, 3) - open) + Ts_Mean(close, 3)')
+    parser.evaluate({'close': dfx, 'open': dfy})
+    assert parser.get_profile() is None
+    
+    parser.profile = True
+    res = parser.evaluate({'close': dfx, 'open': dfy})
+    parser.profile = False
+    df_profile = parser.get_profile()
+    assert len(df_profile) == len(parser.plan.nodes)
+    root = df_profile.loc[parser.plan.output_pos[0]]
+    assert root['output_shape'] == res.shape
+    assert root['bytes'] == res.values.nbytes
+    assert (df_profile['seconds'] >= 0).all()
+    
+    tree = parser.get_profile(tree=True)
+    assert tree.splitlines()[0].startswith(parser.plan.root.expr)
+    assert 'shared' in tree
+
+
 @pytest.fixture(autouse=True)
 def my_globals(request):
     ds = RemoteDataService()
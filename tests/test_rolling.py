@@ -0,0 +1,149 @@
+# encoding: utf-8
+import numpy as np
+import pandas as pd
+
+from jaqs.data import rolling
+
+
+def _naive(arr, window, func):
+    res = np.empty(arr.shape)
+    res.fill(np.nan)
+    for i in range(window - 1, arr.shape[0]):
+        win = arr[i - window + 1: i + 1]
+        for j in range(arr.shape[1]):
+            if not np.isnan(win[:, j]).any():
+                res[i, j] = func(win[:, j])
+    return res
+
+
+def test_rolling_univariate():
+    rs = np.random.RandomState(0)
+    arr = rs.randn(50, 4) * 10 + 100
+    arr[rs.rand(50, 4) < 0.1] = np.nan
+    arr[10:20, 0] = 3.3
+    arr[30:33, 1] = 0.0
+
+    for window in [1, 2, 5, 60]:
+        assert np.allclose(rolling.rolling_sum(arr, window), _naive(arr, window, np.sum), equal_nan=True)
+        assert np.allclose(rolling.rolling_mean(arr, window), _naive(arr, window, np.mean), equal_nan=True)
+        assert np.allclose(rolling.rolling_max(arr, window), _naive(arr, window, np.max), equal_nan=True)
+        assert np.allclose(rolling.rolling_min(arr, window), _naive(arr, window, np.min), equal_nan=True)
+        assert np.allclose(rolling.rolling_product(arr, window), _naive(arr, window, np.prod), equal_nan=True)
+        if window > 1:
+            std = _naive(arr, window, lambda x: np.std(x, ddof=1))
+            assert np.allclose(rolling.rolling_std(arr, window), std, equal_nan=True)
+
+    # constant window has exactly zero variance, and undefined skewness
+    assert (rolling.rolling_std(arr, 5)[14:20, 0] == 0).all()
+    assert np.isnan(rolling.rolling_skew(arr, 5)[14:20, 0]).all()
+
+    df = pd.DataFrame(arr)
+    assert np.allclose(rolling.count_nans(arr, 5), 5 - pd.rolling_count(df, 5).values)
+
+
+def test_rolling_bivariate():
+    rs = np.random.RandomState(1)
+    x = rs.randn(40, 3)
+    y = rs.randn(40, 3) + x
+    y[7, 2] = np.nan
+
+    window = 6
+    cov_expected = np.empty(x.shape)
+    corr_expected = np.empty(x.shape)
+    cov_expected.fill(np.nan)
+    corr_expected.fill(np.nan)
+    for i in range(window - 1, x.shape[0]):
+        for j in range(x.shape[1]):
+            xw, yw = x[i - window + 1: i + 1, j], y[i - window + 1: i + 1, j]
+            if not np.isnan(yw).any():
+                cov_expected[i, j] = np.cov(xw, yw)[0, 1]
+                corr_expected[i, j] = np.corrcoef(xw, yw)[0, 1]
+
+    assert np.allclose(rolling.rolling_cov(x, y, window), cov_expected, equal_nan=True)
+    assert np.allclose(rolling.rolling_corr(x, y, window), corr_expected, equal_nan=True)
+
+
+def test_decay():
+    rs = np.random.RandomState(3)
+    arr = rs.randn(30, 3)
+    arr[12, 1] = np.nan
+    
+    lin = np.arange(1.0, 6.0)
+    assert np.allclose(rolling.decay_linear(arr, 5), _naive(arr, 5, lambda x: np.dot(x, lin) / lin.sum()),
+                       equal_nan=True)
+    ex = np.power(0.8, np.arange(3, -1, -1))
+    assert np.allclose(rolling.decay_exp(arr, 0.8, 4), _naive(arr, 4, lambda x: np.dot(x, ex) / ex.sum()),
+                       equal_nan=True)
+    assert rolling.decay_exp_weights(4, 0.8) is rolling.decay_exp_weights(4, 0.8)
+
+
+def test_order_statistics():
+    rs = np.random.RandomState(4)
+    arr = np.round(rs.randn(40, 4) * 2)  # many ties
+    arr[rs.rand(40, 4) < 0.05] = np.nan
+
+    for window in [1, 3, 7]:
+        rank = _naive(arr, window, lambda x: pd.Series(x).rank().iloc[-1])
+        assert np.allclose(rolling.rolling_rank(arr, window), rank, equal_nan=True)
+        argmax = _naive(arr, window, lambda x: np.argmax(x) + 1)
+        assert np.allclose(rolling.rolling_argmax(arr, window), argmax, equal_nan=True)
+        argmin = _naive(arr, window, lambda x: np.argmin(x) + 1)
+        assert np.allclose(rolling.rolling_argmin(arr, window), argmin, equal_nan=True)
+        median = _naive(arr, window, np.median)
+        assert np.allclose(rolling.rolling_median(arr, window), median, equal_nan=True)
+        quantile = _naive(arr, window, lambda x: np.percentile(x, 30))
+        assert np.allclose(rolling.rolling_quantile(arr, window, 0.3), quantile, equal_nan=True)
+
+
+def test_order_statistics_large_window():
+    # windows larger than the scan limits use the sorted window
+    rs = np.random.RandomState(5)
+    arr = np.round(rs.randn(260, 3) * 3)
+    arr[rs.rand(260, 3) < 0.003] = np.nan
+    window = max(rolling._RANK_SCAN_MAX_WINDOW, rolling._QUANTILE_SCAN_MAX_WINDOW) + 8
+
+    rank = _naive(arr, window, lambda x: pd.Series(x).rank().iloc[-1])
+    assert np.allclose(rolling.rolling_rank(arr, window), rank, equal_nan=True)
+    argmax = _naive(arr, window, lambda x: np.argmax(x) + 1)
+    assert np.allclose(rolling.rolling_argmax(arr, window), argmax, equal_nan=True)
+    median = _naive(arr, window, np.median)
+    assert np.allclose(rolling.rolling_median(arr, window), median, equal_nan=True)
+    quantile = _naive(arr, window, lambda x: np.percentile(x, 30))
+    assert np.allclose(rolling.rolling_quantile(arr, window, 0.3), quantile, equal_nan=True)
+
+
+def test_parser_rolling():
+    from jaqs.data.py_expression_eval import Parser
+
+    rs = np.random.RandomState(2)
+    df = pd.DataFrame(rs.randn(30, 3) + 10, index=np.arange(20170101, 20170131), columns=['a', 'b', 'c'])
+
+    parser = Parser()
+    parser.parse('Ts_Mean(close, 5) + Product(close, 3)')
+    res = parser.evaluate({'close': df})
+    expected = pd.rolling_mean(df, 5) + pd.rolling_apply(df, 3, np.product)
+    assert res.index.equals(df.index)
+    assert res.columns.equals(df.columns)
+    assert np.allclose(res.values, expected.values, equal_nan=True)
+
+    parser.parse('Ts_Rank(close, 5) + Ts_ArgMax(close, 4) - Ts_Median(close, 6)')
+    res = parser.evaluate({'close': df})
+    expected = (pd.rolling_apply(df, 5, lambda x: pd.Series(x).rank().iloc[-1])
+                + pd.rolling_apply(df, 4, lambda x: np.argmax(x) + 1) - pd.rolling_median(df, 6))
+    assert np.allclose(res.values, expected.values, equal_nan=True)
+    assert parser.get_lookbacks() == [5]
+
+    parser.set_capital('lower')
+    parser.parse('ts_argmin(close, 3) * ts_quantile(close, 3, 0.5)')
+    res = parser.evaluate({'close': df})
+    expected = pd.rolling_apply(df, 3, lambda x: np.argmin(x) + 1) * pd.rolling_median(df, 3)
+    assert np.allclose(res.values, expected.values, equal_nan=True)
+
+
+if __name__ == "__main__":
+    test_rolling_univariate()
+    test_rolling_bivariate()
+    test_decay()
+    test_order_statistics()
+    test_order_statistics_large_window()
+    test_parser_rolling()